@@ -115,11 +115,11 @@ plt.figure(figsize=(15,15))
 f = h5py.File(infile[file], 'r')
 data = f['data']
 
-lu_disk = data['lu_sfr'][:,0]
-lne_disk = data['lne_sfr'][:,0]
-loh12_disk = data['lz_sfr'][:,0]
+lu_disk = data['lu_sfr'][0]
+lne_disk = data['lne_sfr'][0]
+loh12_disk = data['lz_sfr'][0]
 
-lu_agn = data['lu_agn'][:,0]
+lu_agn = data['lu_agn'][0]
 
 minU, maxU = get_limits(propname='U', photmod='gutkin16')
 minnH, maxnH = get_limits(propname='nH', photmod='gutkin16')
@@ -148,16 +148,16 @@ else:
     SII6731 = np.sum(data['SII6717_sfr'],axis=0) + np.sum(data['SII6731_sfr'],axis=0)
     OII3727 = np.sum(data['OII3727_sfr'],axis=0)
 
-lz = data['lz_sfr'][:,0]
+lz = data['lz_sfr'][0]
 
-lu_sfr = data['lu_sfr'][:,0]
-lne = data['lne_sfr'][:,0]
+lu_sfr = data['lu_sfr'][0]
+lne = data['lne_sfr'][0]
 
-lssfr = data['lssfr'][:,0]
+lssfr = data['lssfr'][0]
 
-lms = np.log10(10**data['lms'][:,0] + 10**data['lms'][:,1])
+lms = np.log10(10**data['lms'][0] + 10**data['lms'][1])
 
-lu_agn = data['lu_agn'][:,0]
+lu_agn = data['lu_agn'][0]
 
 Lagn = data['Lagn'][0]
 
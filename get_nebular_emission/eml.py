@@ -1,9 +1,15 @@
-from get_nebular_emission.eml_io import get_data, get_secondary_data, write_data, write_data_AGN
+from get_nebular_emission.eml_io import get_data, correct_units, get_secondary_data, write_data, write_data_AGN, get_galform_params, Writer, WriterThread, get_shard_name, get_sweep_name, share_arrays, view_arrays, close_arrays, stitch_shards, get_checkpoint, get_resume, get_results, get_mp_context
 from get_nebular_emission.eml_une import get_une, bursttobulge, L_agn, calculate_epsilon, calculate_ng_hydro_eq, Z_blanc, Z_tremonti, Z_tremonti2, n_ratio
 import get_nebular_emission.eml_const as const
-from get_nebular_emission.eml_photio import get_lines, get_limits, clean_photarray, calculate_flux
+from get_nebular_emission.eml_photio import get_lines, get_limits, clean_photarray, calculate_flux, get_grid, use_cosmology
 from get_nebular_emission.eml_att import attenuation
+from get_nebular_emission.eml_plan import get_plan, get_nselected, get_tasks, count_rows, get_read_size, get_memory_plan, get_peak_memory, print_memory_plan
+from get_nebular_emission.eml_profile import Profile, stage, get_nbytes
+import os
+import sys
+import json
 import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 #import get_nebular_emission.eml_testplots as get_testplot
 
@@ -20,12 +26,19 @@ def eml(infile, outfile, m_sfr_z,
         epsilon_params=None,
         extra_params=None, extra_params_names=None, extra_params_labels=None,
         attmod='cardelli89',
-        unemod_sfr='kashino19', unemod_agn='panuzzo03',
+        unemod_sfr=const.unemod_sfr, unemod_agn='panuzzo03',
         photmod_sfr='gutkin16', photmod_agn='feltre16',
         LC2sfr=False, cutlimits=False, mtot2mdisk=True,
         verbose=True, testing=False,
         xid_feltre=0.5,alpha_feltre=-1.7,
-        xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100):
+        xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100,
+        dry_run=False, plan_file=None,
+        chunk_size=const.chunk_size, compression=None, compression_opts=None,
+        shuffle=False, fletcher32=False, prealloc=False,
+        line_layout='separate', precision='float64', shards=False,
+        write_queue=0, resume=False, agn_layout='dense', n_workers=1,
+        window_rows=None, profile=False, profile_file=None, profile_header=False,
+        n_threads=1, max_memory=None):
     '''
     Calculate emission lines given the properties of model galaxies
 
@@ -35,14 +48,19 @@ def eml(infile, outfile, m_sfr_z,
      List with the name of the input files. 
      - In text files (*.dat, *txt, *.cat), columns separated by ' '.
      - In csv files (*.csv), columns separated by ','.
+     - In npy format, directories with one <name>.npy file per column or .npz files.
+     - In parquet format, Parquet files with named columns.
+     - In galform format, GALFORM HDF5 outputs, one per ivol subvolume.
     outfile : string
      Name of the output file.
     m_sfr_z : list
      - [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
      - For text or csv files: list of integers with column position.
-     - For hdf5 files: list of data names.
+     - For hdf5, npy or parquet files: list of data names.
+     - For galform files: list of data names. If None, the standard disk
+       and bulge datasets in eml_const are used.
     inputformat : string
-     Format of the input file.
+     Format of the input file: 'txt', 'hdf5', 'npy', 'parquet' or 'galform'.
     infile_z0 : strings
      List with the name of the input files with the galaxies at redshift 0. 
      - In text files (*.dat, *txt, *.cat), columns separated by ' '.
@@ -68,6 +86,8 @@ def eml(infile, outfile, m_sfr_z,
     att_ratio_lines : strings
      Names of the lines corresponding to the values in att_params when attmod=ratios.
      They should be written as they are in the selected model (see eml_const).
+     For galform files with attmod=ratios, att_params are GALFORM line names
+     and, if not given, all the lines in eml_const.galform_lines are used.
     flux : boolean
      If True calculates flux of the emission lines based on the given redshift.
     IMF_i : strings
@@ -110,7 +130,7 @@ def eml(infile, outfile, m_sfr_z,
     attmod : string
      Attenuation model.
     unemod_sfr : string
-     Model to go from galaxy properties to U and ne.
+     Model to go from galaxy properties to U and ne (const.unemod_sfr by default).
     unemod_agn : string
      Model to go from galaxy properties to U and ne.
     photmod_sfr : string
@@ -137,185 +157,1124 @@ def eml(infile, outfile, m_sfr_z,
      C/O ratio for the Gutkin et. al. photoionisation model.
     imf_cut_gutkin : float
      Solar mass high limit for the IMF for the Gutkin et. al. photoionisation model.
-    
+    dry_run : boolean
+     If True, only estimate the memory and time needed for each subvolume,
+     without calculating nor writing emission lines.
+    plan_file : string
+     JSON file for the dry run estimates, by default <outfile>_plan.json.
+    chunk_size : integer
+     Maximum number of galaxies per chunk of the output datasets.
+    compression : string
+     Compression filter for the output datasets: None, 'gzip' or 'lzf'.
+    compression_opts : integer
+     Compression level for gzip (0-9).
+    shuffle : boolean
+     If True the shuffle filter is applied to the output datasets before compression.
+    fletcher32 : boolean
+     If True a checksum is stored for each chunk of the output datasets.
+    prealloc : boolean
+     If True the selected galaxies are counted before the calculation, to create
+     the output datasets with their final size and write each subvolume at its position.
+    line_layout : string
+     'separate' to store each line in its own dataset (e.g. Halpha_sfr_att),
+     'stacked' to store one (ncomp, nlines, ngal) dataset per kind of line
+     (e.g. nebline_sfr_att), with the names of the lines in its 'lines' attribute.
+    precision : string or dictionary
+     Floating point type of the output, 'float64' or 'float32', or a dictionary
+     with the type for the groups 'props', 'lines', 'fluxes' and 'extra'.
+     With 'float32', extra parameters are kept as float64, and lines and fluxes
+     are stored in units given by their 'scale' attribute, to fit in float32
+     (see eml_io.get_precision). The calculation is always done in float64.
+    shards : boolean
+     If True each subvolume is written to its own shard file, <outfile>_shard<i>,
+     and outfile is created with virtual datasets joining the shards in order.
+    write_queue : integer
+     If larger than 0, the output is written by a background thread while the
+     next subvolumes are calculated, with up to write_queue subvolumes waiting.
+    resume : boolean
+     If True and outfile has a checkpoint record from a previous run, the
+     completed subvolumes are checked against infile, any partially written
+     subvolume is removed and the run continues from the next subvolume.
+     Each completed subvolume is recorded in the 'checkpoint' group of the output.
+    agn_layout : string
+     'dense' to store the AGN quantities for all the galaxies, 'sparse' to store
+     them only for the galaxies with Lagn>0, listed in the agn_index dataset
+     (see eml_io.read_sparse).
+    n_workers : integer
+     If larger than 1, number of processes calculating subvolumes in parallel.
+     The output is written in the order of infile, with the same galaxies as
+     a serial run. The subvolumes larger than an even share of the work per
+     worker are split into row windows, which read only their own rows.
+     At most 2*n_workers tasks are submitted ahead of the one being written:
+     the next one to be written and then the largest (in disk) ones.
+     Results waiting for an earlier task to be written are kept in memory.
+     The workers are forked, which is not possible on Windows or safe on macOS,
+     where the subvolumes are calculated serially (see eml_io.get_mp_context).
+    window_rows : integer
+     If not None and n_workers > 1, maximum number of input rows per parallel task.
+    profile : boolean
+     If True, the wall and CPU time, galaxies, galaxies per second and bytes
+     read and written by each stage (reading, U and ne, lines, attenuation,
+     fluxes and writing) are printed out at the end and written to profile_file.
+    profile_file : string
+     JSON file for the timing report, by default <outfile>_profile.json.
+    profile_header : boolean
+     If True, the timing report is also stored in the 'Profile' attribute
+     of the output header, as a JSON string.
+    n_threads : integer
+     Number of threads interpolating the emission lines, split by component
+     and block of galaxies (0 for as many as CPUs). It is limited by the
+     available CPUs and by any OMP_NUM_THREADS or BLAS thread limit. With
+     n_workers > 1, each worker uses n_threads.
+    max_memory : string or float
+     If not None, memory budget for the run, with units (e.g. '16GB') or in bytes.
+     The number of workers, up to n_workers (0 for as many as CPUs available,
+     limited as n_threads), and the input rows per window are chosen from
+     the estimated bytes per galaxy for the given options, so the estimated
+     peak stays within the budget for the largest subvolume (see
+     eml_plan.get_memory_plan). Each window reads only its own rows and, as
+     for n_workers, the largest windows are submitted first, but only n_workers
+     ahead of the one being written, so at most n_workers+1 are kept in memory. The plan and the observed peak
+     memory are printed out and stored in the 'Memory plan' attribute of the
+     output header, as a JSON string.
     
 
     Notes
     -------
     This code returns an .hdf5 file with the mass, specific star formation rate,
     electron density, metallicity, ionization parameter, and the emission lines.
+    In a dry run, it returns a dictionary with the estimates for each subvolume.
 
     '''
     
     if verbose:
         print('Outfile: ' + outfile)
+
+    if inputformat=='galform':
+        m_sfr_z, att_params, att_ratio_lines = get_galform_params(m_sfr_z=m_sfr_z,
+                                    att=att, att_params=att_params,
+                                    att_ratio_lines=att_ratio_lines,
+                                    LC2sfr=LC2sfr, attmod=attmod)
+
+    if dry_run:
+        if plan_file is None:
+            plan_file = os.path.splitext(outfile)[0] + '_plan.json'
+        plan = get_plan(infile, m_sfr_z, inputformat=inputformat,
+                        cutcols=cutcols, mincuts=mincuts, maxcuts=maxcuts,
+                        att=att, att_params=att_params, flux=flux, redshift=redshift,
+                        AGN=AGN, Lagn_params=Lagn_params, epsilon_params=epsilon_params,
+                        extra_params=extra_params, infile_z0=infile_z0,
+                        photmod_sfr=photmod_sfr, photmod_agn=photmod_agn,
+                        xid_feltre=xid_feltre, alpha_feltre=alpha_feltre,
+                        xid_gutkin=xid_gutkin, co_gutkin=co_gutkin,
+                        imf_cut_gutkin=imf_cut_gutkin, n_threads=n_threads,
+                        testing=testing, plan_file=plan_file, verbose=verbose)
+        return plan
     
+    if line_layout not in const.line_layouts:
+        print('STOP (eml.eml): Unrecognised line layout {}.'.format(line_layout),
+              'Possible line layouts = {}'.format(const.line_layouts))
+        sys.exit()
+
+    if agn_layout not in const.agn_layouts:
+        print('STOP (eml.eml): Unrecognised AGN layout {}.'.format(agn_layout),
+              'Possible AGN layouts = {}'.format(const.agn_layouts))
+        sys.exit()
+
     first = True
+
+    storage = {'chunk_size': chunk_size, 'compression': compression,
+               'compression_opts': compression_opts, 'shuffle': shuffle,
+               'fletcher32': fletcher32, 'precision': precision}
+
+    nsel = None
+    if prealloc:
+        nsel = get_nselected(infile, m_sfr_z, inputformat=inputformat, cutcols=cutcols,
+                             mincuts=mincuts, maxcuts=maxcuts, testing=testing)
+        offsets = np.append(0, np.cumsum(nsel))
+
+    # Subvolumes to be calculated
+    ndone, ngal_done = 0, 0
+    if shards:
+        shardfiles = [get_shard_name(outfile, i) for i in range(len(infile))]
+    elif resume:
+        ndone, ngal_done = get_resume(outfile, infile, line_layout=line_layout, nsel=nsel)
+    todo = []
+    for i in range(ndone, len(infile)):
+        if shards and resume:
+            records = get_checkpoint(shardfiles[i])
+            if records and records['infile'] == [str(infile[i])]:
+                if verbose:
+                    print('Subvolume', i+1, 'already in', shardfiles[i])
+                continue
+        todo.append(i)
+
+    calc = {'inputformat': inputformat, 'infile_z0': infile_z0, 'h0': h0,
+            'redshift': redshift, 'cutcols': cutcols, 'mincuts': mincuts, 'maxcuts': maxcuts,
+            'att': att, 'att_params': att_params, 'att_ratio_lines': att_ratio_lines,
+            'flux': flux, 'flag': flag, 'IMF_i': IMF_i, 'IMF_f': IMF_f,
+            'q0': q0, 'z0': z0, 'gamma': gamma, 'T': T,
+            'AGN': AGN, 'AGNinputs': AGNinputs, 'Lagn_params': Lagn_params,
+            'Z_central_cor': Z_central_cor, 'epsilon_params': epsilon_params,
+            'extra_params': extra_params, 'attmod': attmod,
+            'unemod_sfr': unemod_sfr, 'unemod_agn': unemod_agn,
+            'photmod_sfr': photmod_sfr, 'photmod_agn': photmod_agn,
+            'LC2sfr': LC2sfr, 'mtot2mdisk': mtot2mdisk,
+            'verbose': verbose, 'testing': testing,
+            'xid_feltre': xid_feltre, 'alpha_feltre': alpha_feltre,
+            'xid_gutkin': xid_gutkin, 'co_gutkin': co_gutkin,
+            'imf_cut_gutkin': imf_cut_gutkin, 'n_threads': n_threads}
+
+    if n_workers != 1 and get_mp_context() is None:
+        print('WARNING (eml.eml): Parallel workers are not available in this system,',
+              'the subvolumes are calculated serially.')
+        n_workers = 1
+
+    memory_plan = None
+    if max_memory is not None:
+        memory_plan = get_memory_plan(todo, infile, m_sfr_z, max_memory, n_workers=n_workers,
+                                      window_rows=window_rows, inputformat=inputformat,
+                                      att=att, att_params=att_params, flux=flux,
+                                      AGN=AGN, Lagn_params=Lagn_params,
+                                      epsilon_params=epsilon_params, extra_params=extra_params,
+                                      infile_z0=infile_z0, photmod_sfr=photmod_sfr,
+                                      photmod_agn=photmod_agn, write_queue=write_queue,
+                                      n_threads=n_threads, testing=testing, verbose=verbose)
+        n_workers = memory_plan['n_workers']
+        window_rows = memory_plan['window_rows']
+
+    timing = None
+    if profile:
+        timing = Profile()
+        if profile_file is None:
+            profile_file = os.path.splitext(outfile)[0] + '_profile.json'
+
+    def write(func, **kwargs):
+        with stage(timing, 'write', rows_in=len(kwargs['lms']),
+                   bytes_written=get_nbytes(kwargs)):
+            func(**kwargs)
+
+    if n_workers > 1 or memory_plan is not None:
+        windows, order = get_tasks(todo, infile, m_sfr_z[0][0], n_workers,
+                                   inputformat=inputformat, window_rows=window_rows,
+                                   testing=testing)
+    else:
+        windows = {i: [None] for i in todo}
+
+    # Rows and bytes read of each subvolume, shared by its windows in the timing report
+    read_size = {i: None for i in todo}
+    if timing is not None:
+        for i in todo:
+            read_size[i] = get_read_size(infile[i], get_read_cols(m_sfr_z, cutcols),
+                                         inputformat=inputformat)
+
+    if n_workers > 1:
+        # Tasks submitted but not yet written: a look-ahead of 2*n_workers,
+        # or n_workers within a memory budget
+        ntasks = n_workers if memory_plan is not None else 2*n_workers
+        write_order = [(i, j) for i in todo for j in range(len(windows[i]))]
+        waiting = dict.fromkeys(order)
+
+        def submit_tasks(k):
+            # The k-th task to be written goes first, then the largest ones
+            while len(futures) < ntasks and waiting:
+                task = next(iter(waiting))
+                if k < len(write_order) and write_order[k] in waiting:
+                    task = write_order[k]
+                del waiting[task]
+                i, j = task
+                futures[task] = pool.submit(calculate_subvolume if timing is None else profile_subvolume,
+                                            i, infile, m_sfr_z, window=windows[i][j],
+                                            read_size=read_size[i], **calc)
+
+        # The workers are started before opening the output and the writer
+        # thread, so no file handle nor lock is inherited by them
+        pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=get_mp_context())
+        futures = {}
+        submit_tasks(0)
+        nwritten = 0
+
+    # The workers, the writer thread and the output are closed also after an error
+    writer_thread = None
+    writer = None
+    try:
+        if write_queue > 0:
+            writer_thread = WriterThread(maxsize=write_queue)
+            submit = writer_thread.submit
+        else:
+            def submit(func, *args, **kwargs):
+                func(*args, **kwargs)
+
+        if not shards:
+            if ndone > 0:
+                writer = Writer(outfile, mode='a', **storage)
+                first = False
+                if verbose:
+                    print('Resuming from subvolume', ndone+1, 'of', len(infile))
+            else:
+                # Output file kept open for all the subvolumes
+                writer = Writer(outfile, **storage)
+            if prealloc:
+                writer.prealloc(offsets[-1])
+            # Remove any partially written subvolume
+            writer.truncate(ngal_done)
     
-    start_total_time = time.perf_counter()
+        start_total_time = time.perf_counter()
     
-    for i in range(len(infile)):
-        
-        if not verbose:
-            print('Infile: ' + infile[i])
-            if infile_z0[0]:
-                print('Infile_z0: ' + infile_z0[i])
+        for i in todo:
         
-        start_time = time.perf_counter()
+            if not verbose:
+                print('Infile: ' + infile[i])
+                if infile_z0[0]:
+                    print('Infile_z0: ' + infile_z0[i])
         
-        # Read the input data and correct it to the adequate units, etc.
+            start_time = time.perf_counter()
+
+            if shards:
+                writer = Writer(shardfiles[i], **storage)
+                if prealloc:
+                    writer.prealloc(nsel[i])
+                first = True
+
+            # Emission lines of the subvolume (or its row windows, in order),
+            # calculated here or by the workers
+            ngal = 0
+            for j in range(len(windows[i])):
+                if n_workers > 1:
+                    subvol = futures.pop((i, j)).result()
+                    nwritten += 1
+                    submit_tasks(nwritten)
+                    if timing is not None:
+                        subvol, worker_timing = subvol
+                        timing.merge(worker_timing)
+                else:
+                    subvol = calculate_subvolume(i, infile, m_sfr_z, window=windows[i][j],
+                                                 read_size=read_size[i], profile=timing, **calc)
+                if subvol is None:
+                    continue
+
+                if prealloc:
+                    start = ngal if shards else offsets[i] + ngal
+                    submit(writer.set_offset, start)
+                ngal += len(subvol['lms'])
+
+                if AGN:
+                    submit(write, write_data_AGN, extra_params_names=extra_params_names,
+                           extra_params_labels=extra_params_labels,
+                           outfile=outfile,attmod=attmod,unemod_agn=unemod_agn,unemod_sfr=unemod_sfr,
+                           photmod_agn=photmod_agn,photmod_sfr=photmod_sfr,first=first,
+                           writer=writer,line_layout=line_layout,
+                           agn_layout=agn_layout,**subvol)
+                else:
+                    submit(write, write_data, extra_params_names=extra_params_names,
+                           extra_params_labels=extra_params_labels,
+                           outfile=outfile,attmod=attmod,unemod_sfr=unemod_sfr,
+                           photmod_sfr=photmod_sfr,first=first,writer=writer,
+                           line_layout=line_layout,**subvol)
+                del subvol
+                first = False
+
+            if prealloc and ngal != nsel[i]:
+                print('STOP (eml.eml): {} galaxies selected in {}, {} expected.'.format(
+                    ngal, infile[i], nsel[i]))
+                sys.exit()
+
+            # Start of the subvolume, not of its last window
+            offset = None
+            if prealloc:
+                offset = 0 if shards else offsets[i]
+            submit(writer.checkpoint, i, infile[i], ngal, offset=offset)
+
+            if shards:
+                submit(writer.close)
+            
+            if timing is not None:
+                timing.add_subvolume(infile[i], ngal, time.perf_counter() - start_time)
+
+            if verbose:
+                print()
+                print('Subvolume', i+1, 'of', len(infile))
+                print('Time:', round(time.perf_counter() - start_time,2), 's.')
+                print()         
+
+        if n_workers > 1:
+            pool.shutdown()
+
+        if not shards:
+            submit(writer.close)
+        if write_queue > 0:
+            writer_thread.close()
+            if verbose:
+                print('Time waiting for the writer: ', round(writer_thread.wait_time,2), 's.')
+    finally:
+        # After an error, the pending tasks are cancelled and the pending
+        # writes discarded, before the output is closed
+        if n_workers > 1:
+            pool.shutdown(cancel_futures=True)
+        if writer_thread is not None:
+            writer_thread.close(discard=True)
+        if writer is not None:
+            writer.close()
+
+    if shards:
+        with stage(timing, 'stitch_shards'):
+            stitch_shards(outfile, shardfiles, verbose=verbose)
+    
+    if verbose:
+        print('Total time: ', round(time.perf_counter() - start_total_time,2), 's.')
+
+    if timing is not None:
+        timing.print_report()
+        timing.write_report(profile_file)
+        if verbose:
+            print('Timing report written in ' + profile_file)
+        if profile_header:
+            with Writer(outfile, mode='a') as writer:
+                writer.write_header({u'Profile': json.dumps(timing.get_report())})
+
+    if memory_plan is not None:
+        # The workers have finished, so their peak memory is also known
+        memory_plan['peak_memory'] = get_peak_memory()
+        print_memory_plan(memory_plan)
+        with Writer(outfile, mode='a') as writer:
+            writer.write_header({u'Memory plan': json.dumps(memory_plan)})
+
+
+def iter_eml(infile, m_sfr_z, inputformat='hdf5', chunk_rows=None,
+             att=False, att_params=None, att_ratio_lines=None, AGN=False,
+             attmod='cardelli89', LC2sfr=False,
+             photmod_sfr='gutkin16', photmod_agn='feltre16',
+             extra_params_names=None, verbose=False, testing=False, **kwargs):
+    '''
+    Calculate the emission lines subvolume by subvolume, or in chunks
+    of rows, yielding the results instead of writing an output file.
+    Only one batch of galaxies is kept in memory at a time, and each
+    chunk reads only its own rows of the input file.
+
+    Parameters
+    ----------
+    infile : strings
+     List with the name of the input files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    inputformat : string
+     Format of the input file.
+    chunk_rows : integer
+     If not None, maximum number of input rows per batch.
+     Otherwise, one batch is yielded per subvolume.
+    att, att_params, att_ratio_lines, AGN, attmod, LC2sfr, photmod_sfr, photmod_agn :
+     As in eml.
+    extra_params_names : strings
+     Names of the extra parameters in the batches.
+    verbose : boolean
+     If True print out messages.
+    testing : boolean
+     If True only run over few entries for testing purposes.
+    **kwargs :
+     Any other parameter of eml for the calculation (see calculate_subvolume).
+
+    Yields
+    ------
+    batch : dictionary
+     Arrays with the galaxies along the last axis, named as in the
+     output files (see eml_io.get_results): lms, lssfr, lu_sfr, lne_sfr,
+     lz_sfr and nebline_sfr (ncomp, nlines, ngal), the attenuated lines
+     and fluxes if calculated, the AGN quantities if AGN is True, and
+     the extra parameters. Also the index ('subvolume') and name ('infile')
+     of the input file, the row window ('window', None for the whole file)
+     and the names of the lines ('lines_sfr' and 'lines_agn').
+    '''
+
+    if inputformat=='galform':
+        m_sfr_z, att_params, att_ratio_lines = get_galform_params(m_sfr_z=m_sfr_z,
+                                    att=att, att_params=att_params,
+                                    att_ratio_lines=att_ratio_lines,
+                                    LC2sfr=LC2sfr, attmod=attmod)
+
+    for i in range(len(infile)):
+        windows = [None]
+        if chunk_rows is not None:
+            nrows = count_rows(infile[i], m_sfr_z[0][0], inputformat=inputformat, testing=testing)
+            windows = [[start, min(start + chunk_rows, nrows)]
+                       for start in range(0, nrows, chunk_rows)]
+
+        for window in windows:
+            subvol = calculate_subvolume(i, infile, m_sfr_z, inputformat=inputformat,
+                                         att=att, att_params=att_params,
+                                         att_ratio_lines=att_ratio_lines, AGN=AGN,
+                                         attmod=attmod, LC2sfr=LC2sfr,
+                                         photmod_sfr=photmod_sfr, photmod_agn=photmod_agn,
+                                         verbose=verbose, testing=testing,
+                                         window=window, **kwargs)
+            if subvol is None:
+                continue
+
+            subvol.pop('epsilon_sfr', None)
+            batch = get_results(extra_params_names=extra_params_names, **subvol)
+            batch.update({'subvolume': i, 'infile': infile[i], 'window': window,
+                          'lines_sfr': list(const.lines_model[photmod_sfr]),
+                          'lines_agn': list(const.lines_model[photmod_agn]) if AGN else []})
+            del subvol
+            yield batch
+
+def eml_arrays(ms, sfr, zgas, h0=None, redshift=0,
+               att=False, att_param=None, att_ratio_lines=None, flux=False, flag=0,
+               IMF_i=['Kroupa', 'Kroupa'], IMF_f=['Kroupa', 'Kroupa'],
+               q0=const.q0_orsi, z0=const.Z0_orsi, gamma=1.3, T=10000,
+               AGN=False, AGNinputs='Lagn', Lagn_param=None, Z_central_cor=False,
+               epsilon_param=None, epsilon_param_z0=None,
+               extra_param=None, extra_params_names=None,
+               attmod='cardelli89', unemod_sfr=const.unemod_sfr, unemod_agn='panuzzo03',
+               photmod_sfr='gutkin16', photmod_agn='feltre16',
+               LC2sfr=False, mtot2mdisk=True, verbose=False,
+               xid_feltre=0.5, alpha_feltre=-1.7,
+               xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100, n_threads=1):
+    '''
+    Calculate the emission lines of galaxies given as arrays in memory,
+    returning the results as arrays. No file is read or written,
+    apart from the photoionisation tables the first time they are used,
+    and errors in the inputs raise a ValueError instead of stopping.
+    The parameters are those of eml, with the values instead of the
+    columns of the input file.
+
+    Parameters
+    ----------
+    ms : floats
+     Stellar mass of the galaxies per component (Msun), with shape (ngal, ncomp),
+     or (ngal) for one component.
+    sfr : floats
+     SFR of the galaxies per component (Msun/yr), or magnitude of the
+     Lyman Continuum photons if LC2sfr is True.
+    zgas : floats
+     Metallicity of the cold gas per component (Z).
+    att_param : floats
+     Values of the att_params of eml, with shape (nparams, ngal).
+    Lagn_param : floats
+     Values of the Lagn_params of eml, with shape (nparams, ngal).
+    epsilon_param : floats
+     Values of the epsilon_params of eml, with shape (nparams, ngal).
+    epsilon_param_z0 : floats
+     Values of the epsilon_params of eml for the galaxies at redshift 0.
+    extra_param : floats
+     Extra parameters to be returned with the results, with shape (nparams, ngal).
+    extra_params_names : strings
+     Names of the extra parameters.
+    n_threads : integer
+     Number of threads interpolating the emission lines (see eml_photio.get_lines).
+
+    Returns
+    -------
+    results : dictionary
+     Arrays with the galaxies along the last axis, as yielded by iter_eml.
+
+    Examples
+    -------
+    >>> results = eml_arrays(ms, sfr, zgas, mtot2mdisk=False)
+    >>> results['nebline_sfr'].shape
+        (2, 18, 100000)
+    '''
+
+    ms = np.array(ms, dtype=float)
+    sfr = np.array(sfr, dtype=float)
+    zgas = np.array(zgas, dtype=float)
+    if ms.ndim == 1:
+        ms, sfr, zgas = ms[:,None], sfr[:,None], zgas[:,None]
+    if ms.ndim != 2 or sfr.shape != ms.shape or zgas.shape != ms.shape:
+        raise ValueError('eml_arrays: ms, sfr and zgas should have the same shape (ngal, ncomp).')
+    ngal, ncomp = ms.shape
+
+    if mtot2mdisk and ncomp != 2:
+        raise ValueError('eml_arrays: mtot2mdisk can only be True with two components.')
+    if len(IMF_i) < ncomp or len(IMF_f) < ncomp:
+        raise ValueError('eml_arrays: one IMF_i and IMF_f is needed per component.')
+    if unemod_sfr not in const.unemods or (AGN and unemod_agn not in const.unemods):
+        raise ValueError('eml_arrays: unrecognised model to get U and ne, '
+                         'possible unemod = {}.'.format(const.unemods))
+    if photmod_sfr not in const.photmods or (AGN and photmod_agn not in const.photmods):
+        raise ValueError('eml_arrays: unrecognised photoionisation model, '
+                         'possible photmod = {}.'.format(const.photmods))
+
+    params = {}
+    for name, param in [('att_param', att_param), ('Lagn_param', Lagn_param),
+                        ('epsilon_param', epsilon_param),
+                        ('epsilon_param_z0', epsilon_param_z0),
+                        ('extra_param', extra_param)]:
+        if param is None:
+            params[name] = [[None]]
+            continue
+        params[name] = np.atleast_2d(np.array(param, dtype=float))
+        if params[name].shape[1] != ngal:
+            raise ValueError('eml_arrays: {} should have shape (nparams, {}).'.format(name, ngal))
+
+    if att:
+        if attmod not in const.attmods:
+            raise ValueError('eml_arrays: unrecognised attenuation model, '
+                             'possible attmod = {}.'.format(const.attmods))
+        if att_param is None:
+            raise ValueError('eml_arrays: att_param is needed for the attenuation.')
+        if attmod == 'ratios' and att_ratio_lines is None:
+            raise ValueError('eml_arrays: att_ratio_lines is needed with attmod = ratios.')
+    if AGN:
+        if ncomp != 2:
+            raise ValueError('eml_arrays: the AGN emission needs two components (disk and bulge).')
+        if AGNinputs not in const.AGNinputs:
+            raise ValueError('eml_arrays: unrecognised AGNinputs, '
+                             'possible AGNinputs = {}.'.format(const.AGNinputs))
+        if Lagn_param is None or epsilon_param is None:
+            raise ValueError('eml_arrays: Lagn_param and epsilon_param are needed for the AGN emission.')
+
+    lms, lssfr, loh12 = correct_units(ms, sfr, zgas, h0=h0, IMF_i=IMF_i, IMF_f=IMF_f,
+                                      LC2sfr=LC2sfr, mtot2mdisk=mtot2mdisk,
+                                      verbose=verbose)
+
+    subvol = calculate_lines(lms, lssfr, loh12, h0=h0, redshift=redshift,
+                             att=att, att_ratio_lines=att_ratio_lines,
+                             flux=flux, flag=flag, IMF_f=IMF_f, q0=q0, z0=z0, gamma=gamma, T=T,
+                             AGN=AGN, AGNinputs=AGNinputs, Z_central_cor=Z_central_cor,
+                             attmod=attmod, unemod_sfr=unemod_sfr, unemod_agn=unemod_agn,
+                             photmod_sfr=photmod_sfr, photmod_agn=photmod_agn, verbose=verbose,
+                             xid_feltre=xid_feltre, alpha_feltre=alpha_feltre,
+                             xid_gutkin=xid_gutkin, co_gutkin=co_gutkin,
+                             imf_cut_gutkin=imf_cut_gutkin, n_threads=n_threads, **params)
+
+    subvol.pop('epsilon_sfr', None)
+    results = get_results(extra_params_names=extra_params_names, **subvol)
+    results.update({'lines_sfr': list(const.lines_model[photmod_sfr]),
+                    'lines_agn': list(const.lines_model[photmod_agn]) if AGN else []})
+    return results
+
+# Input data of the subvolumes of a sweep, inherited by the forked workers
+_sweep_inputs = []
+
+def sweep(infile, outfile, m_sfr_z, configs, n_workers=1, verbose=True, **kwargs):
+    '''
+    Calculate the emission lines for several configurations of the
+    model parameters, reading and correcting the input data only once.
+    The results of each configuration are written to their own output file,
+    <outfile>_sweep<k>, with the configuration in the 'Sweep configuration'
+    attribute of the header.
+
+    Parameters
+    ----------
+    infile : strings
+     List with the name of the input files.
+    outfile : string
+     Name of the output file, used as base for the name of the sweep files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    configs : list of dictionaries
+     Parameters of each configuration, overriding those in kwargs.
+     Only those in eml_const.sweep_params can change between configurations.
+    n_workers : integer
+     If larger than 1, number of processes calculating configurations in parallel.
+     The input data is read before starting the workers and it is copied to
+     shared memory blocks, which the workers use without copying them
+     (see eml_io.SharedArray). On Windows and macOS, where the workers
+     cannot be forked, the configurations are calculated serially.
+    verbose : boolean
+     If True print out messages.
+    **kwargs :
+     Any other parameter of eml used for reading the data (e.g. inputformat,
+     cutcols, h0, IMF_f, Lagn_params, att_params), for the calculation
+     (any in eml_const.sweep_params and n_threads) or for the output (extra_params_names,
+     extra_params_labels, line_layout, agn_layout, chunk_size, compression,
+     compression_opts, shuffle, fletcher32 and precision).
+
+    Returns
+    -------
+    sweepfiles : strings
+     Name of the output file of each configuration.
+
+    Examples
+    -------
+    >>> configs = [{'q0': q0, 'gamma': gamma} for q0 in [1e7, 2e7] for gamma in [1.3, 1.5]]
+    >>> sweep(infile, 'output.hdf5', m_sfr_z, configs, n_workers=4, inputformat='hdf5')
+    '''
+
+    read_keys = ['inputformat','infile_z0','h0','cutcols','mincuts','maxcuts',
+                 'IMF_i','IMF_f','LC2sfr','mtot2mdisk','epsilon_params','Lagn_params',
+                 'att_params','extra_params','testing']
+    output_keys = ['extra_params_names','extra_params_labels','line_layout','agn_layout']
+    thread_keys = ['n_threads']
+    storage_keys = ['chunk_size','compression','compression_opts','shuffle',
+                    'fletcher32','precision']
+
+    for key in kwargs:
+        if key not in read_keys + output_keys + storage_keys + thread_keys + const.sweep_params:
+            print('STOP (eml.sweep): Unrecognised parameter {}.'.format(key))
+            sys.exit()
+    for config in configs:
+        for key in config:
+            if key not in const.sweep_params:
+                print('STOP (eml.sweep): {} cannot change between configurations.'.format(key),
+                      'Possible parameters = {}'.format(const.sweep_params))
+                sys.exit()
+
+    read = {key: kwargs[key] for key in read_keys if key in kwargs}
+    output = {key: kwargs[key] for key in output_keys if key in kwargs}
+    storage = {key: kwargs[key] for key in storage_keys if key in kwargs}
+    calc = {key: kwargs[key] for key in const.sweep_params + thread_keys if key in kwargs}
+    # Also needed for the calculation
+    calc.update({key: read[key] for key in ['h0','IMF_f'] if key in read})
+
+    if read.get('inputformat') == 'galform':
+        m_sfr_z, read['att_params'], calc['att_ratio_lines'] = get_galform_params(m_sfr_z=m_sfr_z,
+                                    att=any([dict(calc, **config).get('att', False) for config in configs]),
+                                    att_params=read.get('att_params'),
+                                    att_ratio_lines=calc.get('att_ratio_lines'),
+                                    LC2sfr=read.get('LC2sfr', False),
+                                    attmod=calc.get('attmod', 'cardelli89'))
+
+    # Read and correct the input data once
+    del _sweep_inputs[:]
+    for i in range(len(infile)):
+        if verbose:
+            print('Infile: ' + infile[i])
+        _sweep_inputs.append(read_subvolume(i, infile, m_sfr_z,
+                                            attmod=calc.get('attmod', 'cardelli89'),
+                                            verbose=verbose, **read))
+
+    # Load the grids and the cosmology once, before starting the workers
+    for config in configs:
+        params = dict(calc, **config)
+        grid_params = {key: params[key] for key in ['xid_gutkin','co_gutkin','imf_cut_gutkin',
+                                                    'xid_feltre','alpha_feltre'] if key in params}
+        get_grid(params.get('photmod_sfr', 'gutkin16'), **grid_params)
+        if params.get('AGN', False):
+            get_grid(params.get('photmod_agn', 'feltre16'), **grid_params)
+        if params.get('flux', False):
+            use_cosmology(h0=const.h)
+
+    sweepfiles = [get_sweep_name(outfile, k) for k in range(len(configs))]
+    args = [(sweepfiles[k], infile, dict(calc, **configs[k]), configs[k], output, storage)
+            for k in range(len(configs))]
+
+    if n_workers > 1 and get_mp_context() is None:
+        print('WARNING (eml.sweep): Parallel workers are not available in this system,',
+              'the configurations are calculated serially.')
+        n_workers = 1
+
+    if n_workers > 1:
+        # The input data is moved to shared memory, viewed also by this process
+        shared = share_arrays(_sweep_inputs)
+        _sweep_inputs[:] = view_arrays(shared)
+
+        pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=get_mp_context())
+        futures = [pool.submit(sweep_config, *arg, shared=shared) for arg in args]
+        try:
+            for k in range(len(configs)):
+                futures[k].result()
+                if verbose:
+                    print('Configuration', k+1, 'of', len(configs), 'written in', sweepfiles[k])
+        finally:
+            pool.shutdown(cancel_futures=True)
+            del _sweep_inputs[:]
+            close_arrays(shared, unlink=True)
+    else:
+        for k in range(len(configs)):
+            sweep_config(*args[k])
+            if verbose:
+                print('Configuration', k+1, 'of', len(configs), 'written in', sweepfiles[k])
+
+    del _sweep_inputs[:]
+    return sweepfiles
+
+def read_subvolume(i, infile, m_sfr_z, inputformat='hdf5', infile_z0=[None], h0=None,
+                   cutcols=[None], mincuts=[None], maxcuts=[None],
+                   IMF_i=['Kroupa', 'Kroupa'], IMF_f=['Kroupa', 'Kroupa'],
+                   LC2sfr=False, mtot2mdisk=True, epsilon_params=None, Lagn_params=None,
+                   att_params=None, extra_params=None, attmod='cardelli89',
+                   verbose=True, testing=False):
+    '''
+    Read the input data of a subvolume, in the adequate units.
+    The parameters are those of eml.
+
+    Returns
+    -------
+    inputs : dictionary
+     lms, lssfr, loh12, cut, epsilon_param, epsilon_param_z0,
+     Lagn_param, att_param and extra_param, as arguments of calculate_lines.
+    '''
+
+    lms, lssfr, loh12, cut = get_data(i, infile, m_sfr_z, h0=h0,
+                                      cutcols=cutcols, mincuts=mincuts, maxcuts=maxcuts,
+                                      inputformat=inputformat, LC2sfr=LC2sfr,
+                                      mtot2mdisk=mtot2mdisk,
+                                      IMF_i=IMF_i, IMF_f=IMF_f, verbose=verbose,
+                                      testing=testing)
+
+    epsilon_param, epsilon_param_z0, Lagn_param, att_param, extra_param = get_secondary_data(i, infile,
+                               cut, infile_z0=infile_z0,
+                               epsilon_params=epsilon_params, extra_params=extra_params,
+                               Lagn_params=Lagn_params, att_params=att_params,
+                               inputformat=inputformat, attmod=attmod, verbose=verbose)
+
+    return {'lms': lms, 'lssfr': lssfr, 'loh12': loh12, 'cut': cut,
+            'epsilon_param': epsilon_param, 'epsilon_param_z0': epsilon_param_z0,
+            'Lagn_param': Lagn_param, 'att_param': att_param, 'extra_param': extra_param}
+
+def sweep_config(sweepfile, infile, params, config, output, storage, shared=None):
+    '''
+    Calculate the emission lines of all the subvolumes of a sweep
+    for one configuration, writing them to its output file.
+
+    Parameters
+    ----------
+    sweepfile : string
+     Name of the output file of the configuration.
+    infile : strings
+     List with the name of the input files.
+    params : dictionary
+     Parameters of calculate_lines for the configuration.
+    config : dictionary
+     Parameters of the configuration, written in the header.
+    output : dictionary
+     Parameters of the output (extra_params_names, extra_params_labels,
+     line_layout and agn_layout).
+    storage : dictionary
+     Storage options of the Writer.
+    shared : list of dictionaries
+     If not None, input data of the subvolumes in shared memory
+     (see eml_io.share_arrays). Otherwise, that read by sweep is used.
+    '''
+
+    AGN = params.get('AGN', False)
+    names = {'attmod': params.get('attmod', 'cardelli89'),
+             'unemod_sfr': params.get('unemod_sfr', const.unemod_sfr),
+             'photmod_sfr': params.get('photmod_sfr', 'gutkin16')}
+    if AGN:
+        names.update({'unemod_agn': params.get('unemod_agn', 'panuzzo03'),
+                      'photmod_agn': params.get('photmod_agn', 'feltre16'),
+                      'agn_layout': output.get('agn_layout', 'dense')})
+
+    params = dict(params, verbose=False)
+    if shared is None:
+        inputs_all = _sweep_inputs
+    else:
+        inputs_all = view_arrays(shared)
+
+    with Writer(sweepfile, **storage) as writer:
+        for i, inputs in enumerate(inputs_all):
+            # The input arrays modified by the calculation are copied
+            inputs = dict(inputs, lms=np.copy(inputs['lms']), lssfr=np.copy(inputs['lssfr']),
+                          loh12=np.copy(inputs['loh12']))
+            subvol = calculate_lines(**inputs, **params)
+            if AGN:
+                write_data_AGN(outfile=sweepfile, first=(i==0), writer=writer,
+                               extra_params_names=output.get('extra_params_names'),
+                               extra_params_labels=output.get('extra_params_labels'),
+                               line_layout=output.get('line_layout', 'separate'),
+                               **names, **subvol)
+            else:
+                write_data(outfile=sweepfile, first=(i==0), writer=writer,
+                           extra_params_names=output.get('extra_params_names'),
+                           extra_params_labels=output.get('extra_params_labels'),
+                           line_layout=output.get('line_layout', 'separate'),
+                           **names, **subvol)
+            writer.checkpoint(i, infile[i], len(subvol['lms']))
+            del inputs, subvol
+        writer.write_header({u'Sweep configuration': json.dumps(config)})
+
+    if shared is not None:
+        # No view of the blocks can be left before closing them
+        del inputs_all
+        close_arrays(shared)
+
+def get_read_cols(m_sfr_z, cutcols):
+    '''
+    Get the columns read by get_data from the input files.
+
+    Parameters
+    ----------
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    cutcols : list
+     Parameters to look for cutting the data.
+
+    Returns
+    -------
+    cols : list
+    '''
+
+    if not isinstance(m_sfr_z[0], (list, tuple)):
+        m_sfr_z = [m_sfr_z]
+    return [col for comp in m_sfr_z for col in comp] + list(cutcols or [])
+
+def profile_subvolume(*args, **kwargs):
+    '''
+    Calculate a subvolume timing its stages, in a worker process.
+    The parameters are those of calculate_subvolume.
+
+    Returns
+    -------
+    subvol : dictionary
+     Output of calculate_subvolume.
+    profile : Profile
+     Time of each stage.
+    '''
+
+    profile = Profile()
+    subvol = calculate_subvolume(*args, profile=profile, **kwargs)
+    return subvol, profile
+
+def calculate_subvolume(i, infile, m_sfr_z, inputformat='HDF5', infile_z0=[None],
+                        h0=None, redshift=0, cutcols=[None], mincuts=[None], maxcuts=[None],
+                        att=False, att_params=None, att_ratio_lines=None, flux=False, flag=0,
+                        IMF_i=['Kroupa', 'Kroupa'], IMF_f=['Kroupa', 'Kroupa'],
+                        q0=const.q0_orsi, z0=const.Z0_orsi, gamma=1.3, T=10000,
+                        AGN=False, AGNinputs='Lagn', Lagn_params=None, Z_central_cor=False,
+                        epsilon_params=None, extra_params=None, attmod='cardelli89',
+                        unemod_sfr=const.unemod_sfr, unemod_agn='panuzzo03',
+                        photmod_sfr='gutkin16', photmod_agn='feltre16',
+                        LC2sfr=False, mtot2mdisk=True, verbose=True, testing=False,
+                        xid_feltre=0.5, alpha_feltre=-1.7,
+                        xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100, window=None,
+                        profile=None, read_size=None, n_threads=1):
+    '''
+    Calculate the emission lines of one subvolume, from reading
+    its input file to the fluxes. The subvolumes are independent,
+    so they can be calculated in parallel (see n_workers in eml).
+    The parameters are those of eml.
+
+    Parameters
+    ----------
+    i : integer
+     Index of the subvolume.
+    infile : strings
+     List with the name of the input files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    window : list
+     If not None, [start, stop) range of rows of the input file to be calculated.
+    profile : Profile
+     If not None, the time of each stage is added to it.
+    read_size : tuple
+     Rows and bytes read of the whole subvolume (see eml_plan.get_read_size),
+     of which the row window is charged its share in the profile.
+     If None and profile is given, they are found here.
+
+    Returns
+    -------
+    subvol : dictionary
+     Arguments for write_data (or write_data_AGN if AGN is True)
+     with the quantities calculated for the subvolume.
+     None if no galaxy is selected within the row window.
+    '''
+
+    # Read the input data and correct it to the adequate units, etc.
+    nrows, nbytes = 0, 0
+    if profile is not None:
+        if read_size is None:
+            read_size = get_read_size(infile[i], get_read_cols(m_sfr_z, cutcols),
+                                      inputformat=inputformat)
+        nrows, nbytes = read_size
+        start, stop = [0, nrows] if window is None else window
+        if testing:
+            stop = min(stop, 50)
+        nwin = max(0, min(stop, nrows) - start)
+        nbytes = int(nbytes*nwin/max(nrows, 1))
+        nrows = nwin
+    with stage(profile, 'get_data', rows_in=nrows, bytes_read=nbytes) as counts:
         lms, lssfr, loh12, cut = get_data(i, infile, m_sfr_z, h0=h0,
                                       cutcols=cutcols, mincuts=mincuts, maxcuts=maxcuts,
                                       inputformat=inputformat, LC2sfr=LC2sfr, 
                                       mtot2mdisk=mtot2mdisk,
                                       IMF_i=IMF_i, IMF_f=IMF_f, verbose=verbose, 
-                                      testing=testing)
-        
+                                      testing=testing, window=window)
+        counts['rows_out'] = len(cut)
+
+    if window is not None and len(cut) == 0:
+        # No galaxy selected within the row window
+        return None
+    
+    ngal = len(cut)
+    with stage(profile, 'get_secondary_data', rows_in=ngal):
         epsilon_param, epsilon_param_z0, Lagn_param, att_param, extra_param = get_secondary_data(i, infile, 
                                cut, infile_z0=infile_z0, 
                                epsilon_params=epsilon_params, extra_params=extra_params,
                                Lagn_params=Lagn_params, att_params=att_params, 
                                inputformat=inputformat, attmod=attmod, verbose=verbose) 
+    
+    if verbose:
+        print('Data read.')
+
+    return calculate_lines(lms, lssfr, loh12, cut=cut, epsilon_param=epsilon_param,
+                           epsilon_param_z0=epsilon_param_z0, Lagn_param=Lagn_param,
+                           att_param=att_param, extra_param=extra_param,
+                           h0=h0, redshift=redshift, att=att, att_ratio_lines=att_ratio_lines,
+                           flux=flux, flag=flag, IMF_f=IMF_f, q0=q0, z0=z0, gamma=gamma, T=T,
+                           AGN=AGN, AGNinputs=AGNinputs, Z_central_cor=Z_central_cor,
+                           attmod=attmod, unemod_sfr=unemod_sfr, unemod_agn=unemod_agn,
+                           photmod_sfr=photmod_sfr, photmod_agn=photmod_agn, verbose=verbose,
+                           xid_feltre=xid_feltre, alpha_feltre=alpha_feltre,
+                           xid_gutkin=xid_gutkin, co_gutkin=co_gutkin,
+                           imf_cut_gutkin=imf_cut_gutkin, profile=profile,
+                           n_threads=n_threads)
+
+def calculate_lines(lms, lssfr, loh12, cut=None, epsilon_param=[[None]],
+                    epsilon_param_z0=[[None]], Lagn_param=[[None]], att_param=[[None]],
+                    extra_param=[[None]], h0=None, redshift=0,
+                    att=False, att_ratio_lines=None, flux=False, flag=0,
+                    IMF_f=['Kroupa', 'Kroupa'],
+                    q0=const.q0_orsi, z0=const.Z0_orsi, gamma=1.3, T=10000,
+                    AGN=False, AGNinputs='Lagn', Z_central_cor=False,
+                    attmod='cardelli89', unemod_sfr=const.unemod_sfr, unemod_agn='panuzzo03',
+                    photmod_sfr='gutkin16', photmod_agn='feltre16', verbose=True,
+                    xid_feltre=0.5, alpha_feltre=-1.7,
+                    xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100, profile=None,
+                    n_threads=1):
+    '''
+    Calculate the emission lines of a set of galaxies from their properties
+    in the adequate units (see eml_io.get_data and eml_io.get_secondary_data).
+    The parameters are those of eml.
+
+    Parameters
+    ----------
+    lms, lssfr, loh12 : floats
+     log10(M*) (Msun), log10(sSFR) (1/yr) and log10(Z) per component,
+     with shape (ngal, ncomp). They are modified.
+    cut : integers
+     Index of the galaxies in the input file.
+    epsilon_param, epsilon_param_z0, Lagn_param, att_param, extra_param : floats
+     Secondary parameters with shape (nparams, ngal).
+    profile : Profile
+     If not None, the time of each stage is added to it.
+    n_threads : integer
+     Number of threads interpolating the emission lines (see eml_photio.get_lines).
+
+    Returns
+    -------
+    subvol : dictionary
+     Arguments for write_data (or write_data_AGN if AGN is True).
+    '''
+
+    ngal = len(lms)
+    if cut is None:
+        cut = np.arange(ngal)
         
-        if verbose:
-            print('Data read.')
-            
-        if flag==1:
-            loh12 = Z_tremonti(lms,loh12,Lagn_param)[1]
-        elif flag==2:
-            minZ, maxZ = get_limits(propname='Z', photmod=photmod_sfr)
-            loh12 = Z_tremonti2(lms,loh12,minZ,maxZ,Lagn_param)
-            
+    if flag==1:
+        loh12 = Z_tremonti(lms,loh12,Lagn_param)[1]
+    elif flag==2:
+        minZ, maxZ = get_limits(propname='Z', photmod=photmod_sfr)
+        loh12 = Z_tremonti2(lms,loh12,minZ,maxZ,Lagn_param)
+        
+    with stage(profile, 'get_une_sfr', rows_in=ngal):
         Q_sfr, lu_sfr, lne_sfr, loh12_sfr, epsilon_sfr, ng_ratio = get_une(lms, lssfr, loh12, q0, z0,
                             T=T, IMF_f=IMF_f, h0=h0, redshift=redshift,
                             epsilon_param=epsilon_param, epsilon_param_z0=epsilon_param_z0,
                             origin='sfr',
                             unemod=unemod_sfr, gamma=gamma, verbose=verbose)
+    
+    if verbose:
+        print('SF:')
+        print(' U and ne calculated.')
         
-        if verbose:
-            print('SF:')
-            print(' U and ne calculated.')
-            
-        lu_o_sfr = np.copy(lu_sfr)
-        lne_o_sfr = np.copy(lne_sfr)
-        loh12_o_sfr = np.copy(loh12_sfr)
-        
+    lu_o_sfr = np.copy(lu_sfr)
+    lne_o_sfr = np.copy(lne_sfr)
+    loh12_o_sfr = np.copy(loh12_sfr)
+    
+    with stage(profile, 'clean_photarray_sfr', rows_in=ngal):
         clean_photarray(lms, lssfr, lu_sfr, lne_sfr, loh12_sfr, photmod=photmod_sfr)
-        
+    
+    with stage(profile, 'get_lines_sfr', rows_in=ngal):
         nebline_sfr = get_lines(lu_sfr,lne_sfr,loh12_sfr,photmod=photmod_sfr,
                                 verbose=verbose,
-                                xid_gutkin=xid_gutkin,co_gutkin=co_gutkin,imf_cut_gutkin=imf_cut_gutkin)
+                                xid_gutkin=xid_gutkin,co_gutkin=co_gutkin,imf_cut_gutkin=imf_cut_gutkin,
+                                n_threads=n_threads)
         
-        for comp in range(len(m_sfr_z)):
+        for comp in range(lms.shape[1]):
             nebline_sfr[comp] = nebline_sfr[comp]*3.826e33*10**(lms[:,comp]+lssfr[:,comp])
+    
+    if verbose:
+        print(' Emission calculated.')
         
-        if verbose:
-            print(' Emission calculated.')
-            
-        if att:
+    if att:
+        with stage(profile, 'attenuation_sfr', rows_in=ngal):
             nebline_sfr_att, coef_sfr_att = attenuation(nebline_sfr, att_param=att_param, 
                                       att_ratio_lines=att_ratio_lines,redshift=redshift,
                                       origin='sfr',
                                       cut=cut, attmod=attmod, photmod=photmod_sfr,verbose=verbose)
+    
+        if verbose:
+            print(' Attenuation calculated.')
+    else:
+        nebline_sfr_att = np.array(None)
         
-            if verbose:
-                print(' Attenuation calculated.')
-        else:
-            nebline_sfr_att = np.array(None)
-            
-        if flux:
+    if flux:
+        with stage(profile, 'calculate_flux_sfr', rows_in=ngal):
             fluxes_sfr = calculate_flux(nebline_sfr,redshift,h0=const.h,origin='sfr')
             fluxes_sfr_att = calculate_flux(nebline_sfr_att,redshift,h0=const.h,origin='sfr')
-            if verbose:
-                print(' Flux calculated.')
-        else:
-            fluxes_sfr = np.array(None)
-            fluxes_sfr_att = np.array(None)
-            
-        if AGN:
+        if verbose:
+            print(' Flux calculated.')
+    else:
+        fluxes_sfr = np.array(None)
+        fluxes_sfr_att = np.array(None)
+        
+    if AGN:
+        with stage(profile, 'get_une_agn', rows_in=ngal):
             bursttobulge(lms, Lagn_param)
-            
+        
             Lagn = L_agn(Lagn_param,AGNinputs=AGNinputs,
                          verbose=verbose)
-            
+        
             Q_agn, lu_agn, lne_agn, loh12_agn, epsilon_agn, ng_ratio = get_une(lms, 
                                 lssfr, loh12, q0, z0,
                                 Z_central_cor=Z_central_cor,
                                 Lagn=Lagn, T=T, epsilon_param=epsilon_param, 
                                 h0=h0, IMF_f=IMF_f, origin='agn',
                                 unemod=unemod_agn, gamma=gamma, verbose=verbose)
+        
+        if verbose:
+            print('AGN:')
+            print(' U and ne calculated.')
+        
+        lu_o_agn = np.copy(lu_agn)
+        lne_o_agn = np.copy(lne_agn)
+        loh12_o_agn = np.copy(loh12_agn) 
             
-            if verbose:
-                print('AGN:')
-                print(' U and ne calculated.')
-            
-            lu_o_agn = np.copy(lu_agn)
-            lne_o_agn = np.copy(lne_agn)
-            loh12_o_agn = np.copy(loh12_agn) 
-                
+        with stage(profile, 'clean_photarray_agn', rows_in=ngal):
             clean_photarray(lms, lssfr, lu_agn, lne_agn, loh12_agn, photmod=photmod_agn)
-                
+            
+        with stage(profile, 'get_lines_agn', rows_in=ngal):
             nebline_agn = get_lines(lu_agn,lne_agn,loh12_agn,photmod=photmod_agn,verbose=verbose,
-                                xid_feltre=xid_feltre,alpha_feltre=alpha_feltre)
+                                xid_feltre=xid_feltre,alpha_feltre=alpha_feltre,
+                                n_threads=n_threads)
             nebline_agn[0] = nebline_agn[0]*Lagn/1e45
-            
-            if verbose:
-                print(' Emission calculated.')
-            
-            if att:
+        
+        if verbose:
+            print(' Emission calculated.')
+        
+        if att:
+            with stage(profile, 'attenuation_agn', rows_in=ngal):
                 nebline_agn_att, coef_agn_att = attenuation(nebline_agn, att_param=att_param, 
                                               att_ratio_lines=att_ratio_lines,redshift=redshift,
                                               origin='agn',
                                               cut=cut, attmod=attmod, photmod=photmod_agn,verbose=verbose)
-                if verbose:
-                    print(' Attenuation calculated.')     
-            else:
-                nebline_agn_att = np.array(None)
-                
-            if flux:
+            if verbose:
+                print(' Attenuation calculated.')     
+        else:
+            nebline_agn_att = np.array(None)
+            
+        if flux:
+            with stage(profile, 'calculate_flux_agn', rows_in=ngal):
                 fluxes_agn = calculate_flux(nebline_agn,redshift,h0=const.h,origin='sfr')
                 fluxes_agn_att = calculate_flux(nebline_agn_att,redshift,h0=const.h,origin='sfr')
-                if verbose:
-                    print(' Flux calculated.')
-            else:
-                fluxes_agn = np.array(None)
-                fluxes_agn_att = np.array(None)
-
-            write_data_AGN(lms,lssfr,lu_o_sfr,lne_o_sfr,loh12_o_sfr,lu_o_agn,lne_o_agn,loh12_o_agn,
-                       nebline_sfr,nebline_agn,nebline_sfr_att,nebline_agn_att,
-                       fluxes_sfr,fluxes_agn,fluxes_sfr_att,fluxes_agn_att,
-                       epsilon_sfr,epsilon_agn,
-                       extra_param=extra_param, extra_params_names=extra_params_names,
-                       extra_params_labels=extra_params_labels,
-                       outfile=outfile,attmod=attmod,unemod_agn=unemod_agn,unemod_sfr=unemod_sfr,
-                       photmod_agn=photmod_agn,photmod_sfr=photmod_sfr,first=first)             
-            del lms, lssfr
-            del lu_sfr, lne_sfr, loh12_sfr, lu_agn, lne_agn, loh12_agn 
-            del lu_o_sfr, lne_o_sfr, loh12_o_sfr,  lu_o_agn, lne_o_agn, loh12_o_agn
-            del nebline_sfr, nebline_sfr_att, nebline_agn, nebline_agn_att, cut
+            if verbose:
+                print(' Flux calculated.')
         else:
-            write_data(lms,lssfr,lu_o_sfr,lne_o_sfr,loh12_o_sfr,
-                       nebline_sfr,nebline_sfr_att,
-                       fluxes_sfr,fluxes_sfr_att,
-                       extra_param=extra_param, extra_params_names=extra_params_names,
-                       extra_params_labels=extra_params_labels,
-                       outfile=outfile,attmod=attmod,unemod_sfr=unemod_sfr,
-                       photmod_sfr=photmod_sfr,first=first)             
-            del lms, lssfr
-            del lu_sfr, lne_sfr, loh12_sfr
-            del lu_o_sfr, lne_o_sfr, loh12_o_sfr
-            del nebline_sfr, nebline_sfr_att, cut
-        
-        time.sleep(1)
-        
-        if first:
-            first = False
-            
-        if verbose:
-            print()
-            print('Subvolume', i+1, 'of', len(infile))
-            print('Time:', round(time.perf_counter() - start_time,2), 's.')
-            print()         
-    
-    if verbose:
-        print('Total time: ', round(time.perf_counter() - start_total_time,2), 's.')
\ No newline at end of file
+            fluxes_agn = np.array(None)
+            fluxes_agn_att = np.array(None)
+
+    subvol = {'lms': lms, 'lssfr': lssfr,
+              'lu_sfr': lu_o_sfr, 'lne_sfr': lne_o_sfr, 'loh12_sfr': loh12_o_sfr,
+              'nebline_sfr': nebline_sfr, 'nebline_sfr_att': nebline_sfr_att,
+              'fluxes_sfr': fluxes_sfr, 'fluxes_sfr_att': fluxes_sfr_att,
+              'extra_param': extra_param}
+    if AGN:
+        subvol.update({'lu_agn': lu_o_agn, 'lne_agn': lne_o_agn, 'loh12_agn': loh12_o_agn,
+                       'nebline_agn': nebline_agn, 'nebline_agn_att': nebline_agn_att,
+                       'fluxes_agn': fluxes_agn, 'fluxes_agn_att': fluxes_agn_att,
+                       'epsilon_sfr': epsilon_sfr, 'epsilon_agn': epsilon_agn,
+                       'Lagn': Lagn})
+
+    return subvol
\ No newline at end of file
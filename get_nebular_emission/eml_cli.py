@@ -0,0 +1,381 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import socket
+import inspect
+import argparse
+import platform
+import traceback
+import h5py
+import numpy as np
+import get_nebular_emission.eml as eml
+from get_nebular_emission.eml_io import get_checkpoint, get_shard_name
+
+# Command line: get-nebular-emission run config.yaml [--jobs N] [--resume] [--dry-run] [--profile]
+
+# Options of eml.eml with input file names, given as glob patterns in the configuration
+glob_keys = ['infile', 'infile_z0']
+
+# Floats in the configuration files, with or without a decimal point and exponent sign
+float_pattern = re.compile(r'''^[-+]?(?:[0-9][0-9_]*\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+                           |[0-9][0-9_]*[eE][-+]?[0-9]+
+                           |\.[0-9_]+(?:[eE][-+]?[0-9]+)?)$''', re.X)
+
+def read_config(config_file):
+    '''
+    Read the options of eml.eml from a YAML configuration file.
+
+    Parameters
+    ----------
+    config_file : string
+     YAML file with one entry per eml.eml argument, at least
+     infile, outfile and m_sfr_z.
+
+    Returns
+    -------
+    config : dictionary
+    '''
+
+    try:
+        import yaml
+    except ImportError:
+        print('STOP (eml_cli.read_config): ',
+              'PyYAML is needed to read configuration files.')
+        sys.exit()
+
+    if not os.path.isfile(config_file):
+        print('STOP (eml_cli.read_config): Configuration file not found, {}'.format(config_file))
+        sys.exit()
+
+    # Numbers such as 1e10, read as strings by the YAML 1.1 rules of PyYAML
+    class Loader(yaml.SafeLoader):
+        pass
+    Loader.add_implicit_resolver('tag:yaml.org,2002:float', float_pattern,
+                                 list('-+0123456789.'))
+
+    with open(config_file, 'r') as ff:
+        config = yaml.load(ff, Loader=Loader)
+
+    if not isinstance(config, dict):
+        print('STOP (eml_cli.read_config): {} is not a list of options.'.format(config_file))
+        sys.exit()
+
+    allowed = inspect.signature(eml.eml).parameters
+    for key in config:
+        if key not in allowed:
+            print('STOP (eml_cli.read_config): Unrecognised option {} in {}.'.format(
+                key, config_file))
+            sys.exit()
+    for key in ['infile', 'outfile', 'm_sfr_z']:
+        if key not in config:
+            print('STOP (eml_cli.read_config): {} missing in {}.'.format(key, config_file))
+            sys.exit()
+
+    return config
+
+def expand_infiles(patterns):
+    '''
+    Expand the glob patterns of the input files.
+
+    Parameters
+    ----------
+    patterns : string or strings
+     Names of the input files, or glob patterns (e.g. 'ivol*/galaxies.hdf5').
+
+    Returns
+    -------
+    infile : strings
+     Input files, in the order of the patterns and sorted for each pattern.
+    '''
+
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    infile = []
+    for pattern in patterns:
+        if pattern is None:
+            infile.append(None)
+            continue
+        found = sorted(glob.glob(os.path.expanduser(str(pattern))))
+        if not found:
+            print('STOP (eml_cli.expand_infiles): No input file matches {}'.format(pattern))
+            sys.exit()
+        for ff in found:
+            if ff not in infile:
+                infile.append(ff)
+
+    return infile
+
+def get_run_options(config, jobs=None, resume=False, dry_run=False, profile=False):
+    '''
+    Get the arguments of eml.eml from a configuration and the command line flags.
+
+    Parameters
+    ----------
+    config : dictionary
+     Options read from the configuration file.
+    jobs : integer
+     If not None, number of processes (n_workers of eml.eml).
+    resume : boolean
+     If True, continue a previous run from its checkpoint.
+    dry_run : boolean
+     If True, only estimate the memory and time of the run.
+    profile : boolean
+     If True, write the timing report of the run.
+
+    Returns
+    -------
+    options : dictionary
+     Arguments of eml.eml, with the input files expanded.
+    '''
+
+    options = dict(config)
+    for key in glob_keys:
+        if key in options and options[key] is not None:
+            options[key] = expand_infiles(options[key])
+
+    if jobs is not None:
+        options['n_workers'] = jobs
+    if resume:
+        options['resume'] = True
+    if dry_run:
+        options['dry_run'] = True
+    if profile:
+        options['profile'] = True
+
+    return options
+
+def get_manifest_name(outfile):
+    '''
+    Get the name of the manifest of a run, <outfile>_manifest.json.
+
+    Parameters
+    ----------
+    outfile : string
+     Output file of the run.
+
+    Returns
+    -------
+    manifest_file : string
+    '''
+
+    return os.path.splitext(outfile)[0] + '_manifest.json'
+
+def write_manifest(manifest_file, manifest):
+    '''
+    Write the manifest of a run, replacing any previous one at once.
+
+    Parameters
+    ----------
+    manifest_file : string
+     Name of the JSON file.
+    manifest : dictionary
+     Description of the run.
+    '''
+
+    tmpfile = manifest_file + '.tmp'
+    with open(tmpfile, 'w') as ff:
+        json.dump(manifest, ff, indent=1, default=str)
+    os.replace(tmpfile, manifest_file)
+
+def run(config_file, jobs=None, resume=False, dry_run=False, profile=False,
+        manifest_file=None):
+    '''
+    Run eml.eml with the options in a configuration file, writing
+    a manifest of the run (<outfile>_manifest.json by default).
+    The manifest records the options, the input files, the software
+    versions, the status of the run ('running', 'completed' or 'failed'),
+    its start and end times, for each completed subvolume, the number
+    of galaxies and, if profile is True, its wall time, and the plan and
+    observed peak memory if max_memory is set.
+
+    Parameters
+    ----------
+    config_file : string
+     YAML file with the options of eml.eml.
+    jobs : integer
+     If not None, number of processes calculating subvolumes in parallel.
+    resume : boolean
+     If True, continue a previous run from its checkpoint.
+    dry_run : boolean
+     If True, only estimate the memory and time needed for each subvolume.
+    profile : boolean
+     If True, print out and write the timing report of each stage.
+    manifest_file : string
+     JSON file for the manifest.
+
+    Returns
+    -------
+    manifest : dictionary
+    '''
+
+    options = get_run_options(read_config(config_file), jobs=jobs, resume=resume,
+                              dry_run=dry_run, profile=profile)
+    outfile = options['outfile']
+    if manifest_file is None:
+        manifest_file = get_manifest_name(outfile)
+
+    manifest = {'command': 'dry-run' if dry_run else 'run',
+                'config_file': os.path.abspath(config_file),
+                'options': options,
+                'infile': options['infile'],
+                'outfile': outfile,
+                'host': socket.gethostname(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'status': 'running',
+                'start': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'end': None,
+                'wall': None}
+    write_manifest(manifest_file, manifest)
+
+    start = time.perf_counter()
+    try:
+        result = eml.eml(**options)
+    except BaseException:
+        manifest['status'] = 'failed'
+        raise
+    else:
+        manifest['status'] = 'completed'
+    finally:
+        manifest['end'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        manifest['wall'] = time.perf_counter() - start
+        if dry_run:
+            manifest['plan_file'] = options.get('plan_file') or \
+                os.path.splitext(outfile)[0] + '_plan.json'
+        else:
+            manifest['subvolumes'] = get_manifest_subvolumes(options)
+            manifest['memory_plan'] = get_manifest_memory(outfile)
+        write_manifest(manifest_file, manifest)
+
+    if options.get('verbose', True):
+        print('Manifest written in ' + manifest_file)
+
+    if dry_run:
+        manifest['plan'] = result
+    return manifest
+
+def get_manifest_subvolumes(options):
+    '''
+    Get the completed subvolumes of a run from the checkpoint records
+    of its output and, if profiled, the timing report.
+
+    Parameters
+    ----------
+    options : dictionary
+     Arguments of eml.eml.
+
+    Returns
+    -------
+    subvolumes : list
+     Dictionaries with the input file, offset and number of galaxies
+     ('infile', 'offset', 'ngal') and, if profiled, the wall time ('wall').
+    '''
+
+    outfile = options['outfile']
+    if options.get('shards', False):
+        # One record per shard, with the offsets of the stitched output
+        records = {'infile': [], 'offset': [], 'ngal': []}
+        for i in range(len(options['infile'])):
+            shard = get_checkpoint(get_shard_name(outfile, i))
+            if shard:
+                records['infile'] += shard['infile']
+                records['offset'].append(sum(records['ngal']))
+                records['ngal'] += shard['ngal']
+    else:
+        records = get_checkpoint(outfile)
+    if not records:
+        return []
+
+    subvolumes = [{'infile': records['infile'][k], 'offset': records['offset'][k],
+                   'ngal': records['ngal'][k]} for k in range(len(records['infile']))]
+
+    if options.get('profile', False):
+        profile_file = options.get('profile_file') or \
+            os.path.splitext(outfile)[0] + '_profile.json'
+        if os.path.isfile(profile_file):
+            with open(profile_file, 'r') as ff:
+                walls = {sub['infile']: sub['wall'] for sub in json.load(ff)['subvolumes']}
+            for sub in subvolumes:
+                if sub['infile'] in walls:
+                    sub['wall'] = walls[sub['infile']]
+
+    return subvolumes
+
+def get_manifest_memory(outfile):
+    '''
+    Get the memory plan of a run with max_memory, stored in its output header.
+
+    Parameters
+    ----------
+    outfile : string
+     Output file of the run.
+
+    Returns
+    -------
+    memory_plan : dictionary
+     None if the run had no memory budget.
+    '''
+
+    if not os.path.isfile(outfile):
+        return None
+    with h5py.File(outfile, 'r') as hf:
+        if 'header' not in hf or 'Memory plan' not in hf['header'].attrs:
+            return None
+        return json.loads(hf['header'].attrs['Memory plan'])
+
+def main(argv=None):
+    '''
+    Command line interface, get-nebular-emission.
+
+    Parameters
+    ----------
+    argv : strings
+     Command line arguments, by default sys.argv[1:].
+
+    Returns
+    -------
+    status : integer
+     0 if the run is completed, 1 if it stopped or failed.
+    '''
+
+    parser = argparse.ArgumentParser(prog='get-nebular-emission',
+                description='Calculate emission lines given the properties of model galaxies.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='Run with the options in a YAML configuration file.')
+    run_parser.add_argument('config', help='YAML file with the options of eml.eml.')
+    run_parser.add_argument('--jobs', '-j', type=int, default=None,
+                            help='Number of processes calculating subvolumes in parallel.')
+    run_parser.add_argument('--resume', action='store_true',
+                            help='Continue a previous run from its checkpoint.')
+    run_parser.add_argument('--dry-run', action='store_true',
+                            help='Only estimate the memory and time needed for each subvolume.')
+    run_parser.add_argument('--profile', action='store_true',
+                            help='Write the timing report of each stage of the calculation.')
+    run_parser.add_argument('--manifest', default=None,
+                            help='JSON file for the run manifest, by default <outfile>_manifest.json.')
+
+    args = parser.parse_args(argv)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs should be at least 1')
+
+    try:
+        run(args.config, jobs=args.jobs, resume=args.resume, dry_run=args.dry_run,
+            profile=args.profile, manifest_file=args.manifest)
+    except SystemExit as e:
+        # The STOP messages exit without a status code
+        if e.code not in (None, 0):
+            print('STOP (eml_cli.main): {}'.format(e.code))
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -38,10 +38,55 @@ mod_lim = {'gutkin16': r"nebular_data/gutkin16_tables/limits_gutkin.txt",
            'feltre16': r"nebular_data/feltre16_tables/limits_feltre.txt"}
 
 unemods = ['kashino20', 'orsi14', 'panuzzo03']
+unemod_sfr = 'kashino20' # Default model for the star-forming regions
 
 attmods = ['ratios', 'cardelli89']
 
-inputformats = ['txt','hdf5']
+inputformats = ['txt','hdf5','npy','parquet','galform']
+
+# Output storage: compression filters and number of galaxies per chunk
+# (32768 galaxies are 256 KB per component in double precision)
+compressions = [None,'gzip','lzf']
+chunk_size = 32768
+
+# Threads interpolating the emission lines: minimum number of galaxies per block,
+# and environment variables limiting the threads of OpenMP and BLAS libraries
+thread_block = 8192
+thread_limits = ['OMP_NUM_THREADS','OPENBLAS_NUM_THREADS','MKL_NUM_THREADS',
+                 'BLIS_NUM_THREADS','VECLIB_MAXIMUM_THREADS','NUMEXPR_NUM_THREADS']
+
+# Memory budget (max_memory in eml): units accepted, and minimum number of
+# input rows per task before the number of parallel workers is reduced
+memory_units = {'B':1,'KB':1e3,'MB':1e6,'GB':1e9,'TB':1e12,
+                'KIB':2**10,'MIB':2**20,'GIB':2**30,'TIB':2**40}
+min_window_rows = 10000
+
+# Output layout of the emission lines: one dataset per line ('separate'),
+# or one (ncomp, nlines, ngal) dataset per kind of line ('stacked')
+line_layouts = ['separate','stacked']
+
+# Output layout of the AGN quantities: for all the galaxies ('dense'),
+# or only for those with Lagn>0, listed in the agn_index dataset ('sparse')
+agn_layouts = ['dense','sparse']
+
+# Floating point types of the output, for each group of datasets
+precisions = ['float64','float32']
+precision_groups = ['props','lines','fluxes','extra']
+
+# Version of the output layout, in the 'Format version' attribute of the header:
+# 1 (no attribute), galaxies along the first axis, e.g. (ngal, ncomp);
+# 2, galaxies along the last axis, e.g. (ncomp, ngal)
+format_version = 2
+# Units of the lines (erg/s) and fluxes (erg/s/cm^2) stored in float32,
+# whose maximum (~3.4e38) is below typical luminosities (~1e42 erg/s)
+float32_scales = {'lines': 1e40, 'fluxes': 1e-17}
+
+# Parameters that can change between the configurations of a sweep,
+# those not used to read and correct the input data
+sweep_params = ['redshift','att','att_ratio_lines','flux','flag',
+                'q0','z0','gamma','T','AGN','AGNinputs','Z_central_cor',
+                'attmod','unemod_sfr','unemod_agn','photmod_sfr','photmod_agn',
+                'xid_feltre','alpha_feltre','xid_gutkin','co_gutkin','imf_cut_gutkin']
 
 # For Kennicut IMF -> M(Kenn) = corr * M(IMF)
 # ---------------------------
@@ -291,6 +336,27 @@ def coef_att_line_model_func(z=0):
 line_headers = ['L_tot_', 'L_disk_', 'L_bulge_']
 att_ext = '_ext'
 
+# Group with the galaxies in GALFORM HDF5 outputs (one file per ivol subvolume).
+# If it is not found and the file has a single Output group, that one is used.
+galform_group = 'Output001'
+
+# Default datasets for the disk and bulge (burst) components:
+# [[M*, SFR, Z]] or, when LC2sfr=True, [[M*, m_LC, Z]]
+galform_m_sfr_z = [['mstars_total', 'mstardot', 'zcold'],
+                   ['mstars_bulge', 'mstardot_burst', 'zcold_burst']]
+galform_m_lc_z = [['mstars_total', 'mag_LC_r_disk', 'zcold'],
+                  ['mstars_bulge', 'mag_LC_r_bulge', 'zcold_burst']]
+
+# GALFORM line names for the lines of the photoionisation models,
+# attenuation coefficients are calculated as L_tot_line_ext/L_tot_line
+galform_lines = {'Halpha': 'Halpha',
+                 'Hbeta': 'Hbeta',
+                 'NII6584': 'NII6583',
+                 'OII3727': 'OII3727',
+                 'OIII5007': 'OIII5007',
+                 'SII6717': 'SII6716',
+                 'SII6731': 'SII6731'}
+
 gal_headers = ['mag_LC_r_disk', 'mag_LC_r_bulge', 'zcold', 'mcold', 
            'zcold_burst', 'mcold_burst', 'mstardot_average', 'L_tot_Halpha',
            'L_tot_NII6583', 'L_tot_Hbeta', 'L_tot_OIII5007', 'mstars_total', 'is_central',
@@ -8,6 +8,11 @@ import os
 import numpy as np
 import get_nebular_emission.eml_const as const
 import math
+import zipfile
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
 from pathlib import Path
 
 homedir = Path.home()
@@ -55,15 +60,25 @@ def check_file(infile,verbose=False):
     return file_fine
 
 
-def get_nheader(infile,firstchar=None):
+# Number of header lines per (file, modification time, firstchar)
+_nheader_cache = {}
+
+def get_nheader(infile,firstchar=None,blocksize=65536):
     '''
     Given a text file with a structure: header+data, 
-    counts the number of header lines
+    counts the number of header lines.
+
+    Only the beginning of the file, up to the first data line, is read,
+    and the result is kept until the file is modified.
 
     Parameters
     -------
     infile : string
         Input file
+    firstchar : string
+        If given, header lines are those starting with this character
+    blocksize : integer
+        Number of bytes read at a time
 
     Returns
     -------
@@ -71,34 +86,56 @@ def get_nheader(infile,firstchar=None):
         Number of lines with the header text
     '''
 
+    key = (os.path.abspath(infile), os.stat(infile).st_mtime_ns, firstchar)
+    if key in _nheader_cache:
+        return _nheader_cache[key]
+
+    if firstchar:
+        firstchar = firstchar.encode()
 
     ih = 0
-    with open(infile,'r') as ff:
-        for line in ff:
-            if not line.strip():
-                # Count any empty lines in the header
-                ih += 1
-            else:
+    tail = b''
+    with open(infile,'rb') as ff:
+        while True:
+            block = ff.read(blocksize)
+            if not block and not tail:
+                break
+
+            lines = (tail + block).split(b'\n')
+            if block:
+                # The last line might continue in the next block
+                tail = lines.pop()
+
+            for line in lines:
                 sline = line.strip()
-                
+                if not sline:
+                    # Count any empty lines in the header
+                    ih += 1
+                    continue
+
                 # Check that the first character is not a digit
-                char1 = sline[0]
-                word1 = sline.split()[0]
-                if not firstchar:
-                    if (not char1.isdigit()):
-                        if (char1 != '-'):
-                            ih += 1
-                        else:
-                            try:
-                                float(word1)
-                                return ih
-                            except:
-                                ih += 1
-                    else:
-                        return ih
-                else:
+                char1 = sline[:1]
+                if firstchar:
                     if char1 == firstchar:
-                        ih+=1
+                        ih += 1
+                        continue
+                elif not char1.isdigit():
+                    if char1 != b'-':
+                        ih += 1
+                        continue
+                    try:
+                        float(sline.split()[0])
+                    except ValueError:
+                        ih += 1
+                        continue
+
+                _nheader_cache[key] = ih
+                return ih
+
+            if not block:
+                break
+
+    _nheader_cache[key] = ih
     return ih
         
 
@@ -170,8 +207,438 @@ def locate_interval(val, edges):
 
     return ind
 
+def get_nthreads(n_threads=1):
+    '''
+    Get the number of threads to be used, limited by the CPUs available
+    to the process and by any limit set for OpenMP or BLAS libraries
+    through the environment (e.g. OMP_NUM_THREADS=1 in a batch job).
+
+    Parameters
+    ----------
+    n_threads : integer
+     Number of threads requested. If 0 or None, as many as the CPUs available.
+
+    Returns
+    -------
+    n_threads : integer
+    '''
+
+    if hasattr(os, 'sched_getaffinity'):
+        ncpu = len(os.sched_getaffinity(0))
+    else:
+        ncpu = os.cpu_count() or 1
+
+    if not n_threads:
+        n_threads = ncpu
+    n_threads = min(int(n_threads), ncpu)
+
+    for name in const.thread_limits:
+        try:
+            limit = int(os.environ.get(name, ''))
+        except ValueError:
+            continue
+        if limit > 0:
+            n_threads = min(n_threads, limit)
+
+    return max(n_threads, 1)
+
+def get_mp_context():
+    '''
+    Get the multiprocessing context for the parallel workers.
+    The workers are forked, so they inherit the input data and the
+    photoionisation grids already loaded. Fork is not available on
+    Windows and it is not safe on macOS, where None is returned.
+
+    Returns
+    -------
+    context : multiprocessing context
+     None if the workers cannot be forked (then the work is done serially).
+    '''
+
+    if sys.platform=='darwin' or 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
+
+def get_npy_column(infile, name):
+    '''
+    Get a read-only memory map of a column from a NumPy input subvolume.
+
+    Parameters
+    ----------
+    infile : string
+     Directory with one <name>.npy file per column, or a .npz file.
+    name : string
+     Name of the column.
+
+    Returns
+    -------
+    col : array of floats
+     Column values, memory mapped whenever the storage allows it.
+    '''
+
+    if os.path.isdir(infile):
+        colfile = os.path.join(infile, name + '.npy')
+        if not os.path.isfile(colfile):
+            print('STOP (eml_io.get_npy_column): ',
+                  'column {} not found in {}'.format(name,infile))
+            sys.exit()
+        return np.load(colfile, mmap_mode='r')
+
+    with zipfile.ZipFile(infile) as zf:
+        try:
+            info = zf.getinfo(name + '.npy')
+        except KeyError:
+            print('STOP (eml_io.get_npy_column): ',
+                  'column {} not found in {}'.format(name,infile))
+            sys.exit()
+
+        if info.compress_type != zipfile.ZIP_STORED:
+            # Compressed members can not be mapped, decompress them
+            with zf.open(info) as ff:
+                return np.lib.format.read_array(ff)
+
+    # Stored members are raw .npy files inside the archive:
+    # map them after the local file header (30 bytes + name + extra)
+    with open(infile, 'rb') as ff:
+        ff.seek(info.header_offset + 26)
+        nname, nextra = np.frombuffer(ff.read(4), dtype='<u2')
+        ff.seek(info.header_offset + 30 + int(nname) + int(nextra))
+        version = np.lib.format.read_magic(ff)
+        if version == (1,0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(ff)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(ff)
+        offset = ff.tell()
+
+    return np.memmap(infile, dtype=dtype, mode='r', offset=offset,
+                     shape=shape, order='F' if fortran else 'C')
+
+def get_parquet_file(infile):
+    '''
+    Open a Parquet file for reading, without loading any data.
+
+    Parameters
+    ----------
+    infile : string
+     Name of the Parquet file.
+
+    Returns
+    -------
+    pf : pyarrow.parquet.ParquetFile
+    '''
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        print('STOP (eml_io.get_parquet_file): ',
+              'pyarrow is needed to read Parquet input files.')
+        sys.exit()
+
+    return pq.ParquetFile(infile)
+
+def get_parquet_rowgroups(pf, cutcols=[None], mincuts=[None], maxcuts=[None],
+                          limit=None, start=0):
+    '''
+    Get the row groups of a Parquet file that can have selected galaxies,
+    using the minimum and maximum values stored for each row group.
+
+    Parameters
+    ----------
+    pf : pyarrow.parquet.ParquetFile
+     Input file.
+    cutcols : list
+     Names of the parameters to look for cutting the data.
+    mincuts : list
+     Minimum value of the parameter of cutcols in the same index.
+    maxcuts : list
+     Maximum value of the parameter of cutcols in the same index.
+    limit : integer
+     If not None, only the first limit rows are considered.
+    start : integer
+     Row groups ending before this row are not considered.
+
+    Returns
+    -------
+    rowgroups : list of integers
+     Index of the row groups to be read.
+    rowstart : array of integers
+     Index of the first row of each row group in the file.
+    '''
+
+    meta = pf.metadata
+    nrows = np.array([meta.row_group(rg).num_rows for rg in range(meta.num_row_groups)],
+                     dtype=int)
+    rowstart = np.concatenate(([0],np.cumsum(nrows)[:-1])).astype(int)
+
+    icols = [None]*len(cutcols)
+    for i in range(len(cutcols)):
+        if cutcols[i]:
+            icols[i] = pf.schema_arrow.get_field_index(cutcols[i])
+            if icols[i] == -1:
+                print('STOP (eml_io.get_parquet_rowgroups): ',
+                      'Column {} not found in the Parquet file.'.format(cutcols[i]))
+                sys.exit()
+
+    rowgroups = []
+    for rg in range(meta.num_row_groups):
+        if limit is not None and rowstart[rg] >= limit:
+            break
+        if rowstart[rg] + nrows[rg] <= start:
+            continue
+
+        keep = True
+        for i in range(len(cutcols)):
+            if not cutcols[i]:
+                continue
+            stats = meta.row_group(rg).column(icols[i]).statistics
+            if stats is None or not stats.has_min_max:
+                continue
+
+            # The selection keeps mincut < param < maxcut
+            if mincuts[i] and stats.max <= mincuts[i]:
+                keep = False
+            if maxcuts[i] and stats.min >= maxcuts[i]:
+                keep = False
+        if keep:
+            rowgroups.append(rg)
+
+    return rowgroups, rowstart
+
+def read_parquet(pf, names, rowgroups, rowstart):
+    '''
+    Read only the given columns and row groups of a Parquet file.
+
+    Parameters
+    ----------
+    pf : pyarrow.parquet.ParquetFile
+     Input file.
+    names : list of strings
+     Names of the columns to be read.
+    rowgroups : list of integers
+     Index of the row groups to be read.
+    rowstart : array of integers
+     Index of the first row of each row group in the file.
+
+    Returns
+    -------
+    data : dictionary
+     Arrays with the values of each column.
+    rows : array of integers
+     Index in the file of the rows that have been read.
+    '''
+
+    meta = pf.metadata
+    rows = [np.arange(rowstart[rg], rowstart[rg] + meta.row_group(rg).num_rows)
+            for rg in rowgroups]
+    rows = np.concatenate(rows).astype(int) if rows else np.zeros(0, dtype=int)
+
+    names = list(dict.fromkeys(names))
+    table = pf.read_row_groups(rowgroups, columns=names)
+
+    # Single chunk columns without nulls are handed over without copies
+    data = {}
+    for name in names:
+        data[name] = table.column(name).to_numpy()
+
+    return data, rows
+
+def read_parquet_rows(pf, names, rows):
+    '''
+    Read the given rows of some columns of a Parquet file,
+    reading only the row groups that contain them.
+
+    Parameters
+    ----------
+    pf : pyarrow.parquet.ParquetFile
+     Input file.
+    names : list of strings
+     Names of the columns to be read.
+    rows : array of integers
+     Sorted index in the file of the rows to be read.
+
+    Returns
+    -------
+    data : dictionary
+     Arrays with the values of each column for the given rows.
+    '''
+
+    # Row groups of this file, which can differ from those of other files
+    rowstart = get_parquet_rowgroups(pf)[1]
+    rowgroups = [int(rg) for rg in np.unique(np.searchsorted(rowstart, rows, side='right') - 1)]
+    data, read = read_parquet(pf, names, rowgroups, rowstart)
+    ind = np.searchsorted(read, rows)
+
+    return {name: data[name][ind] for name in data}
+
+def read_txt_rows(infile, usecols, rows, skip=0):
+    '''
+    Read some rows of a text file, parsing only the lines
+    from the first to the last of them.
+
+    Parameters
+    ----------
+    infile : string
+     Name of the text file.
+    usecols : list of integers
+     Position of the columns to be read.
+    rows : array of integers
+     Sorted index of the rows to be read, after the header.
+    skip : integer
+     Number of header lines.
+
+    Returns
+    -------
+    data : array of floats
+     Values of the rows, as np.loadtxt(infile,skiprows=skip,usecols=usecols)[rows].
+    '''
+
+    ncols = np.size(usecols)
+    if len(rows) == 0:
+        data = np.zeros((0, ncols))
+    else:
+        data = np.loadtxt(infile,skiprows=skip+rows[0],usecols=usecols,
+                          max_rows=rows[-1]-rows[0]+1,ndmin=2)[rows-rows[0]]
+
+    if ncols == 1:
+        return data[:,0]
+    return data
+
+def read_hdf5_rows(dset, rows, maxslabs=1000):
+    '''
+    Read the given rows of a 1D HDF5 dataset with a single hyperslab selection.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+     Dataset to be read.
+    rows : array of integers
+     Sorted index of the rows to be read.
+    maxslabs : integer
+     Maximum number of contiguous blocks in the selection. Above it,
+     the block containing all the rows is read and indexed in memory.
+
+    Returns
+    -------
+    data : array
+     Values of the dataset in the given rows.
+    '''
+
+    rows = np.asarray(rows, dtype=int)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=dset.dtype)
+
+    blocks = np.split(rows, np.where(np.diff(rows) != 1)[0] + 1)
+    if len(blocks) > maxslabs:
+        return dset[rows[0]:rows[-1]+1][rows - rows[0]]
+
+    fspace = dset.id.get_space()
+    fspace.select_none()
+    for block in blocks:
+        fspace.select_hyperslab((int(block[0]),), (len(block),),
+                                op=h5py.h5s.SELECT_OR)
+    mspace = h5py.h5s.create_simple((len(rows),))
+
+    data = np.empty(len(rows), dtype=dset.dtype)
+    dset.id.read(mspace, fspace, data)
+
+    return data
+
+def get_galform_group(hf, infile=''):
+    '''
+    Get the group with the galaxy properties from a GALFORM HDF5 output.
+
+    Parameters
+    ----------
+    hf : h5py.File
+     Opened GALFORM output file.
+    infile : string
+     Name of the file, for messages.
+
+    Returns
+    -------
+    group : h5py.Group
+    '''
+
+    if const.galform_group in hf:
+        return hf[const.galform_group]
+
+    outputs = [key for key in hf.keys() if key.startswith('Output')]
+    if len(outputs) != 1:
+        print('STOP (eml_io.get_galform_group): ',
+              'group {} not found in {}'.format(const.galform_group,infile))
+        sys.exit()
+
+    return hf[outputs[0]]
+
+def get_galform_params(m_sfr_z=None, att=False, att_params=None, att_ratio_lines=None,
+                       LC2sfr=False, attmod='ratios'):
+    '''
+    Map the standard GALFORM datasets to the input parameters
+    that have not been given.
+
+    Parameters
+    ----------
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],...] If None, disk and bulge GALFORM datasets.
+    att : boolean
+     If True attenuation is calculated.
+    att_params : list
+     Attenuation parameters. If None and attmod='ratios', GALFORM line names.
+    att_ratio_lines : strings
+     Lines of the photoionisation model corresponding to att_params.
+    LC2sfr : boolean
+     If True magnitude of Lyman Continuum photons expected as input for SFR.
+    attmod : string
+     Attenuation model.
+
+    Returns
+    -------
+    m_sfr_z, att_params, att_ratio_lines : lists
+    '''
+
+    if m_sfr_z is None:
+        if LC2sfr:
+            m_sfr_z = const.galform_m_lc_z
+        else:
+            m_sfr_z = const.galform_m_sfr_z
+
+    if att and att_params is None and attmod=='ratios':
+        att_ratio_lines = list(const.galform_lines.keys())
+        att_params = list(const.galform_lines.values())
+
+    return m_sfr_z, att_params, att_ratio_lines
+
+def get_galform_att_ratio(hf, line, rows):
+    '''
+    Get the attenuation coefficient of a line from the attenuated and
+    intrinsic total luminosities in a GALFORM output.
+
+    Parameters
+    ----------
+    hf : h5py.Group
+     Group with the galaxy properties.
+    line : string
+     GALFORM name of the line.
+    rows : array of integers
+     Index of the selected galaxies.
+
+    Returns
+    -------
+    coef : array of floats
+     L_ext/L, set to 1 for galaxies without emission.
+    '''
+
+    lum = read_hdf5_rows(hf[const.line_headers[0] + line], rows)
+    lum_att = read_hdf5_rows(hf[const.line_headers[0] + line + const.att_ext], rows)
+
+    coef = np.ones(len(rows))
+    ind = np.where(lum > 0)
+    coef[ind] = lum_att[ind]/lum[ind]
+
+    return coef
+
 def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
-              inputformat='hdf5',testing=False, verbose=True):
+              inputformat='hdf5',testing=False, verbose=True, window=None):
     '''
     It reads star masses, star formation rates and metallicities from a file.
 
@@ -181,17 +648,20 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
      - Name of the input file. 
      - In text files (*.dat, *txt, *.cat), columns separated by ' '.
      - In csv files (*.csv), columns separated by ','.
+     - In npy format, a directory with one <name>.npy file per column or a .npz file.
+     - In parquet format, a Parquet file with named columns.
+     - In galform format, a GALFORM HDF5 output (for example ivol0/galaxies.hdf5).
     inputformat : string
      Format of the input file.
     cols : list
      - [[component1_stellar_mass,sfr,Z],[component2_stellar_mass,sfr,Z],...]
      - Expected : component1 = total or disk, component2 = bulge
      - For text or csv files: list of integers with column position.
-     - For hdf5 files: list of data names.
+     - For hdf5, npy, parquet or galform files: list of data names.
     cutcols : list
      Parameters to look for cutting the data.
      - For text or csv files: list of integers with column position.
-     - For hdf5 files: list of data names.
+     - For hdf5, npy, parquet or galform files: list of data names.
     mincuts : list
      Minimum value of the parameter of cutcols in the same index. All the galaxies below won't be considered.
     maxcuts : list
@@ -202,6 +672,9 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
       If True print out messages
     testing : boolean
       If True only run over few entries for testing purposes
+    window : list
+      If not None, [start, stop) range of rows of the input file:
+      only these rows are read.
 
     Returns
     -------
@@ -209,7 +682,14 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
     cut : integers
     '''
     
-    check_file(infile, verbose=verbose)
+    if inputformat=='npy':
+        # A directory or a .npz file
+        file_fine = os.path.exists(infile)
+    else:
+        file_fine = check_file(infile, verbose=verbose)
+    if not file_fine:
+        print('STOP (eml_io.read_data): Input file not found {}'.format(infile))
+        sys.exit()
 
     ncomp = get_ncomponents(cols)
     
@@ -217,6 +697,15 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
         limit = 50
     else:
         limit = None
+
+    # Range of rows to be read, [start, stop)
+    start, stop = 0, limit
+    if window is not None:
+        start = window[0]
+        stop = window[1] if limit is None else max(min(window[1], limit), start)
+
+    # Position in the file of the read rows, if not all of them are read
+    rows = None
         
     if inputformat not in const.inputformats:
         if verbose:
@@ -227,11 +716,11 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
         with h5py.File(infile, 'r') as f:
             hf = f['data']
             
-            cut = np.arange(len(hf[cols[0][0]][:limit]))
+            cut = np.arange(len(range(hf[cols[0][0]].shape[0])[start:stop]))
             
             for i in range(len(cutcols)):
                 if cutcols[i]:
-                    param = hf[cutcols[i]][:limit]
+                    param = hf[cutcols[i]][start:stop]
                     mincut = mincuts[i]
                     maxcut = maxcuts[i]
                     if mincut and maxcut:
@@ -243,22 +732,99 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
                 
             for i in range(ncomp):
                 if i==0:
-                    lms = np.array([hf[cols[i][0]][:limit]])
-                    lssfr = np.array([hf[cols[i][1]][:limit]])
-                    loh12 = np.array([hf[cols[i][2]][:limit]])
+                    lms = np.array([hf[cols[i][0]][start:stop]])
+                    lssfr = np.array([hf[cols[i][1]][start:stop]])
+                    loh12 = np.array([hf[cols[i][2]][start:stop]])
                 else:
-                    lms = np.append(lms,[hf[cols[i][0]][:limit]],axis=0)
-                    lssfr = np.append(lssfr,[hf[cols[i][1]][:limit]],axis=0)
-                    loh12 = np.append(loh12,[hf[cols[i][2]][:limit]],axis=0)
+                    lms = np.append(lms,[hf[cols[i][0]][start:stop]],axis=0)
+                    lssfr = np.append(lssfr,[hf[cols[i][1]][start:stop]],axis=0)
+                    loh12 = np.append(loh12,[hf[cols[i][2]][start:stop]],axis=0)
+    elif inputformat=='galform':
+        with h5py.File(infile, 'r') as f:
+            hf = get_galform_group(f, infile)
+
+            rows = np.array(range(hf[cols[0][0]].shape[0])[start:stop], dtype=int)
+
+            # Only the cut parameters are read for all the galaxies in the range
+            for i in range(len(cutcols)):
+                if cutcols[i]:
+                    param = hf[cutcols[i]][start:stop]
+                    mincut = mincuts[i]
+                    maxcut = maxcuts[i]
+                    if mincut and maxcut:
+                        rows = np.intersect1d(rows,start+np.where((mincut<param)&(param<maxcut))[0])
+                    elif mincut:
+                        rows = np.intersect1d(rows,start+np.where(mincut<param)[0])
+                    elif maxcut:
+                        rows = np.intersect1d(rows,start+np.where(param<maxcut)[0])
+            cut = np.arange(len(rows))
+
+            lms = np.array([read_hdf5_rows(hf[cols[i][0]],rows) for i in range(ncomp)])
+            lssfr = np.array([read_hdf5_rows(hf[cols[i][1]],rows) for i in range(ncomp)])
+            loh12 = np.array([read_hdf5_rows(hf[cols[i][2]],rows) for i in range(ncomp)])
+    elif inputformat=='npy':
+        cut = np.arange(len(get_npy_column(infile,cols[0][0])[start:stop]))
+
+        for i in range(len(cutcols)):
+            if cutcols[i]:
+                param = get_npy_column(infile,cutcols[i])[start:stop]
+                mincut = mincuts[i]
+                maxcut = maxcuts[i]
+                if mincut and maxcut:
+                    cut = np.intersect1d(cut,np.where((mincut<param)&(param<maxcut))[0])
+                elif mincut:
+                    cut = np.intersect1d(cut,np.where(mincut<param)[0])
+                elif maxcut:
+                    cut = np.intersect1d(cut,np.where(param<maxcut)[0])
+
+        lms = np.array([get_npy_column(infile,cols[i][0])[start:stop] for i in range(ncomp)])
+        lssfr = np.array([get_npy_column(infile,cols[i][1])[start:stop] for i in range(ncomp)])
+        loh12 = np.array([get_npy_column(infile,cols[i][2])[start:stop] for i in range(ncomp)])
+    elif inputformat=='parquet':
+        pf = get_parquet_file(infile)
+        rowgroups, rowstart = get_parquet_rowgroups(pf, cutcols=cutcols,
+                                                    mincuts=mincuts, maxcuts=maxcuts,
+                                                    limit=stop, start=start)
+        names = [col for comp in cols for col in comp] + [col for col in cutcols if col]
+        data, rows = read_parquet(pf, names, rowgroups, rowstart)
+
+        # Rows of the first and last row groups outside the range
+        sel = rows >= start
+        if stop is not None:
+            sel &= rows < stop
+        rows = rows[sel]
+        cut = np.arange(len(rows))
+
+        for i in range(len(cutcols)):
+            if cutcols[i]:
+                param = data[cutcols[i]][sel]
+                mincut = mincuts[i]
+                maxcut = maxcuts[i]
+                if mincut and maxcut:
+                    cut = np.intersect1d(cut,np.where((mincut<param)&(param<maxcut))[0])
+                elif mincut:
+                    cut = np.intersect1d(cut,np.where(mincut<param)[0])
+                elif maxcut:
+                    cut = np.intersect1d(cut,np.where(param<maxcut)[0])
+
+        lms = np.array([data[cols[i][0]][sel] for i in range(ncomp)])
+        lssfr = np.array([data[cols[i][1]][sel] for i in range(ncomp)])
+        loh12 = np.array([data[cols[i][2]][sel] for i in range(ncomp)])
     elif inputformat=='txt':
         ih = get_nheader(infile)
+
+        # Only the lines within the range are parsed
+        skip = ih + start
+        max_rows = None if stop is None else stop - start
         
-        cut = np.arange(len(np.loadtxt(infile,usecols=cols[0],skiprows=ih)[:limit]))
+        cut = np.arange(len(np.loadtxt(infile,usecols=cols[0],skiprows=skip,
+                                       max_rows=max_rows,ndmin=2)))
         
         if cutcols[0]:
             for i in range(len(cutcols)):
                 
-                param = np.loadtxt(infile,usecols=cutcols[i],skiprows=ih)[:limit]
+                param = np.loadtxt(infile,usecols=cutcols[i],skiprows=skip,
+                                   max_rows=max_rows,ndmin=1)
                 mincut = mincuts[i]
                 maxcut = maxcuts[i]
                 
@@ -271,7 +837,8 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
                     
         
         for i in range(ncomp):
-            X = np.loadtxt(infile,usecols=cols[i],skiprows=ih).T[:,:limit]
+            X = np.loadtxt(infile,usecols=cols[i],skiprows=skip,
+                           max_rows=max_rows,ndmin=2).T
             
             if i==0:
                 lms = np.array([X[0]])
@@ -290,8 +857,12 @@ def read_data(infile, cols, cutcols=[None], mincuts=[None], maxcuts=[None],
     lms = lms.T
     lssfr = lssfr.T
     loh12 = loh12.T
+
+    if rows is not None:
+        # Not all the rows have been read: return the position in the file
+        return lms[cut], lssfr[cut], loh12[cut], rows[cut]
             
-    return lms[cut], lssfr[cut], loh12[cut], cut
+    return lms[cut], lssfr[cut], loh12[cut], start + cut
 
 def get_secondary_data(i, infile, cut, infile_z0=None, epsilon_params=None, 
                        Lagn_params=None, att_params=None, extra_params=None,
@@ -305,12 +876,16 @@ def get_secondary_data(i, infile, cut, infile_z0=None, epsilon_params=None,
      - Name of the input file. 
      - In text files (*.dat, *txt, *.cat), columns separated by ' '.
      - In csv files (*.csv), columns separated by ','.
+     - In npy format, a directory with one <name>.npy file per column or a .npz file.
+     - In parquet format, a Parquet file with named columns.
+     - In galform format, a GALFORM HDF5 output (for example ivol0/galaxies.hdf5).
     infile_z0 : string
      Name of the files with the galaxies at redshift 0. 
      - In text files (*.dat, *txt, *.cat), columns separated by ' '.
      - In csv files (*.csv), columns separated by ','.
     cut : strings
      List of indexes of the selected galaxies from the samples.
+     For parquet and galform files, position of the selected galaxies in the file.
     inputformat : string
      Format of the input file.
     epsilon_params : list
@@ -338,6 +913,7 @@ def get_secondary_data(i, infile, cut, infile_z0=None, epsilon_params=None,
     epsilon_param = [[None]]
     epsilon_param_z0 = [[None]]
     Lagn_param = [[None]]
+    att_param = [[None]]
     extra_param = [[None]]
     
     if inputformat not in const.inputformats:
@@ -345,29 +921,93 @@ def get_secondary_data(i, infile, cut, infile_z0=None, epsilon_params=None,
             print('STOP (eml_io): Unrecognised input format.',
                   'Possible input formats = {}'.format(const.inputformats))
         sys.exit()
-    elif inputformat=='hdf5':
-        if verbose:
-            print('HDF5 not implemented yet for secondary params.')
-        sys.exit()
+    elif inputformat=='hdf5' or inputformat=='galform':
+        with h5py.File(infile[i], 'r') as f:
+            if inputformat=='galform':
+                hf = get_galform_group(f, infile[i])
+            else:
+                hf = f['data']
+
+            if epsilon_params:
+                epsilon_param = np.array([read_hdf5_rows(hf[col],cut) for col in epsilon_params])
+
+            if Lagn_params:
+                Lagn_param = np.array([read_hdf5_rows(hf[col],cut) for col in Lagn_params])
+
+            if extra_params:
+                extra_param = np.array([read_hdf5_rows(hf[col],cut) for col in extra_params])
+
+            if att_params:
+                if inputformat=='galform' and attmod=='ratios':
+                    att_param = np.array([get_galform_att_ratio(hf,line,cut) for line in att_params])
+                else:
+                    att_param = np.array([read_hdf5_rows(hf[col],cut) for col in att_params])
+
+        if infile_z0[0]:
+            with h5py.File(infile_z0[i], 'r') as f:
+                if inputformat=='galform':
+                    hf = get_galform_group(f, infile_z0[i])
+                else:
+                    hf = f['data']
+                epsilon_param_z0 = np.array([read_hdf5_rows(hf[col],cut) for col in epsilon_params])
+    elif inputformat=='npy':
+        if epsilon_params:
+            epsilon_param = np.array([get_npy_column(infile[i],col)[cut] for col in epsilon_params])
+
+        if infile_z0[0]:
+            epsilon_param_z0 = np.array([get_npy_column(infile_z0[i],col)[cut] for col in epsilon_params])
+
+        if Lagn_params:
+            Lagn_param = np.array([get_npy_column(infile[i],col)[cut] for col in Lagn_params])
+
+        if extra_params:
+            extra_param = np.array([get_npy_column(infile[i],col)[cut] for col in extra_params])
+
+        if att_params:
+            att_param = np.array([get_npy_column(infile[i],col)[cut] for col in att_params])
+    elif inputformat=='parquet':
+        names = []
+        for params in [epsilon_params, Lagn_params, extra_params, att_params]:
+            if params:
+                names.extend(params)
+
+        # Read only the row groups with selected galaxies
+        data = read_parquet_rows(get_parquet_file(infile[i]), names, cut)
+
+        if epsilon_params:
+            epsilon_param = np.array([data[col] for col in epsilon_params])
+
+        if infile_z0[0]:
+            data_z0 = read_parquet_rows(get_parquet_file(infile_z0[i]), epsilon_params, cut)
+            epsilon_param_z0 = np.array([data_z0[col] for col in epsilon_params])
+
+        if Lagn_params:
+            Lagn_param = np.array([data[col] for col in Lagn_params])
+
+        if extra_params:
+            extra_param = np.array([data[col] for col in extra_params])
+
+        if att_params:
+            att_param = np.array([data[col] for col in att_params])
     elif inputformat=='txt':
         ih = get_nheader(infile[i])
         
         if epsilon_params:
-            epsilon_param = np.loadtxt(infile[i],skiprows=ih,usecols=epsilon_params)[cut].T
+            epsilon_param = read_txt_rows(infile[i],epsilon_params,cut,skip=ih).T
             
         if infile_z0[0]:
-            epsilon_param_z0 = np.loadtxt(infile_z0[i],skiprows=ih,usecols=epsilon_params)[cut].T
+            epsilon_param_z0 = read_txt_rows(infile_z0[i],epsilon_params,cut,skip=ih).T
 
         if Lagn_params:
-            Lagn_param = np.loadtxt(infile[i],skiprows=ih,usecols=Lagn_params)[cut].T
+            Lagn_param = read_txt_rows(infile[i],Lagn_params,cut,skip=ih).T
             
         if extra_params:
-            extra_param = np.loadtxt(infile[i],skiprows=ih,usecols=extra_params)[cut].T
+            extra_param = read_txt_rows(infile[i],extra_params,cut,skip=ih).T
             if len(extra_params)==1:
                 extra_param = np.array([extra_param])
         
         if att_params:
-                att_param = np.loadtxt(infile[i],skiprows=ih,usecols=att_params)[cut].T
+                att_param = read_txt_rows(infile[i],att_params,cut,skip=ih).T
                 
     return epsilon_param, epsilon_param_z0, Lagn_param, att_param, extra_param
 
@@ -375,7 +1015,7 @@ def get_data(i, infile, cols, h0=None, inputformat='hdf5',
              IMF_i=['Chabrier', 'Chabrier'], IMF_f=['Kroupa', 'Kroupa'], 
              cutcols=None, mincuts=[None], maxcuts=[None],
              attmod='GALFORM', LC2sfr=False, mtot2mdisk=True, 
-             verbose=False, testing=False):
+             verbose=False, testing=False, window=None):
     '''
     Get Mstars, sSFR and (12+log(O/H)) in the adecuate units.
 
@@ -420,6 +1060,8 @@ def get_data(i, infile, cols, h0=None, inputformat='hdf5',
       If True print out messages
     testing : boolean
       If True only run over few entries for testing purposes
+    window : list
+      If not None, [start, stop) range of rows of the input file to be used.
 
     Returns
     -------
@@ -429,33 +1071,76 @@ def get_data(i, infile, cols, h0=None, inputformat='hdf5',
     
     lms,lssfr,loh12,cut = read_data(infile[i], cols=cols, cutcols=cutcols,
                                 maxcuts=maxcuts, mincuts=mincuts, inputformat=inputformat, 
-                                testing=testing, verbose=verbose)
-
-    ncomp = get_ncomponents(cols)
-
-    # Set to a default value if negative stellar masses
-    ind = np.where(lms<=1.)
-    lms[ind] = const.notnum
-    lssfr[ind] = const.notnum
-    loh12[ind] = const.notnum
+                                testing=testing, verbose=verbose, window=window)
 
-    if LC2sfr: # Avoid positives magnitudes of LC photons
-        ind = np.where(lssfr>0)
-        lssfr[ind] = const.notnum ; loh12[ind] = const.notnum
-
-
-    else: # Avoid other negative SFR
-        ind = np.where(lssfr<=0)
-        lssfr[ind] = const.notnum ; loh12[ind] = const.notnum
+    lms,lssfr,loh12 = correct_units(lms, lssfr, loh12, h0=h0, IMF_i=IMF_i, IMF_f=IMF_f,
+                                    LC2sfr=LC2sfr, mtot2mdisk=mtot2mdisk,
+                                    verbose=verbose, testing=testing)
 
+    return lms,lssfr,loh12,cut
 
+def correct_units(lms, lssfr, loh12, h0=None,
+                  IMF_i=['Chabrier', 'Chabrier'], IMF_f=['Kroupa', 'Kroupa'],
+                  LC2sfr=False, mtot2mdisk=True, verbose=False, testing=False):
+    '''
+    Given the stellar mass, SFR (or magnitude of Lyman Continuum photons)
+    and metallicity per component, as read from the input files,
+    get Mstars, sSFR and (12+log(O/H)) in the adecuate units.
+    The input arrays are modified.
 
-    ind = np.where(loh12<=0) # Avoid other negative Z
-    loh12[ind] = const.notnum
-
-    # Calculate the disk mass if we have only the total and bulge mass
-
-    if mtot2mdisk:
+    Parameters
+    ----------
+    lms : floats
+     Stellar mass of the galaxies per component (Msun), with shape (ngal, ncomp).
+    lssfr : floats
+     SFR of the galaxies per component (Msun/yr), or magnitude of LC photons if LC2sfr.
+    loh12 : floats
+     Metallicity of the galaxies per component (Z).
+    h0 : float
+      If not None: value of h, H0=100h km/s/Mpc.
+    IMF_i : strings
+     Assumed IMF in the input data.
+    IMF_f : strings
+     Assumed IMF for the luminosity calculation.
+    LC2sfr : boolean
+      If True magnitude of Lyman Continuum photons expected as input for SFR.
+    mtot2mdisk : boolean
+      If True transform the total mass into the disk mass. disk mass = total mass - bulge mass.
+    verbose : boolean
+      If True print out messages
+    testing : boolean
+      If True the corrected data is written in example_data/
+
+    Returns
+    -------
+    lms, lssfr, loh12 : floats
+    '''
+
+    ncomp = lms.shape[1]
+
+    # Set to a default value if negative stellar masses
+    ind = np.where(lms<=1.)
+    lms[ind] = const.notnum
+    lssfr[ind] = const.notnum
+    loh12[ind] = const.notnum
+
+    if LC2sfr: # Avoid positives magnitudes of LC photons
+        ind = np.where(lssfr>0)
+        lssfr[ind] = const.notnum ; loh12[ind] = const.notnum
+
+
+    else: # Avoid other negative SFR
+        ind = np.where(lssfr<=0)
+        lssfr[ind] = const.notnum ; loh12[ind] = const.notnum
+
+
+
+    ind = np.where(loh12<=0) # Avoid other negative Z
+    loh12[ind] = const.notnum
+
+    # Calculate the disk mass if we have only the total and bulge mass
+
+    if mtot2mdisk:
         if ncomp!=2:
             if verbose:
                 print('STOP (eml_io.get_data): ',
@@ -590,13 +1275,1099 @@ def get_data(i, infile, cols, h0=None, inputformat='hdf5',
 
 
                     
-    return lms,lssfr,loh12,cut
+    return lms,lssfr,loh12
+
+def get_precision(precision='float64'):
+    '''
+    Get the floating point type of each group of output datasets:
+    'props' (M*, sSFR, U, ne, Z and epsilon), 'lines' (luminosities),
+    'fluxes' and 'extra' (extra parameters).
+
+    In float32, the values keep about 7 significant digits, well below
+    the accuracy of the photoionisation models. Line luminosities
+    (~1e42 erg/s) would overflow float32 (maximum ~3.4e38), so lines and
+    fluxes in float32 are stored in the units of const.float32_scales
+    (1e40 erg/s and 1e-17 erg/s/cm^2), given by the 'scale' attribute of
+    each dataset; read_sparse and read_line return them in erg/s.
+    Extra parameters are kept as float64 unless requested explicitly,
+    as they may contain galaxy identifiers larger than 2**24, which
+    float32 cannot represent exactly.
+
+    Parameters
+    ----------
+    precision : string or dictionary
+     'float64', 'float32', or a dictionary with the type for some groups.
+
+    Returns
+    -------
+    dtypes : dictionary
+     Floating point type for each group.
+    '''
+
+    dtypes = {group: 'float64' for group in const.precision_groups}
+    if isinstance(precision, dict):
+        dtypes.update(precision)
+    elif precision=='float32':
+        dtypes['props'] = 'float32'
+        dtypes['lines'] = 'float32'
+        dtypes['fluxes'] = 'float32'
+    else:
+        dtypes['props'] = precision
+
+    for group in dtypes:
+        if group not in const.precision_groups or dtypes[group] not in const.precisions:
+            print('STOP (eml_io.get_precision): Unrecognised precision {} for {}.'.format(
+                dtypes[group], group),
+                  'Possible precisions = {}'.format(const.precisions),
+                  'for the groups = {}'.format(const.precision_groups))
+            sys.exit()
+
+    return dtypes
+
+class Writer():
+    '''
+    Output HDF5 file kept open while the subvolumes are written,
+    with the handles of its datasets.
+
+    Parameters
+    ----------
+    outfile : string
+     Name of the output file.
+    mode : string
+     'w' to create the file, 'a' to add subvolumes to an existing one.
+    chunk_size : integer
+     Maximum number of galaxies per chunk of the datasets.
+    compression : string
+     Compression filter: None, 'gzip' or 'lzf'.
+    compression_opts : integer
+     Compression level for gzip (0-9).
+    shuffle : boolean
+     If True the shuffle filter is applied before compression.
+    fletcher32 : boolean
+     If True a checksum is stored for each chunk.
+    precision : string or dictionary
+     Floating point type of the output, 'float64' or 'float32',
+     or a dictionary with the type for each group of datasets (see get_precision).
+    '''
+
+    def __init__(self, outfile, mode='w', chunk_size=const.chunk_size,
+                 compression=None, compression_opts=None,
+                 shuffle=False, fletcher32=False, precision='float64'):
+        if compression not in const.compressions:
+            print('STOP (eml_io.Writer): Unrecognised compression {}.'.format(compression),
+                  'Possible compressions = {}'.format(const.compressions))
+            sys.exit()
+        self.outfile = outfile
+        self.chunk_size = chunk_size
+        self.dtypes = get_precision(precision)
+        self.storage = {'compression': compression, 'shuffle': shuffle,
+                        'fletcher32': fletcher32}
+        if compression=='gzip':
+            self.storage['compression_opts'] = compression_opts
+        self.hf = h5py.File(outfile, mode)
+        if 'data' in self.hf:
+            self.hfdat = self.hf['data']
+        else:
+            self.hfdat = self.hf.create_group('data')
+        self.dsets = {}
+        self.scales = {}
+
+        # Total number of galaxies and position of the current subvolume,
+        # if the datasets are preallocated
+        self.ntot = None
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.dsets or name in self.hfdat
+
+    def write_header(self, attrs):
+        '''
+        Write the attributes of the header.
+
+        Parameters
+        ----------
+        attrs : dictionary
+         Names and values of the attributes.
+        '''
+
+        if 'header' in self.hf:
+            head = self.hf['header']
+        else:
+            head = self.hf.create_dataset('header',(1,),dtype='f4')
+        for key in attrs:
+            head.attrs[key] = attrs[key]
+
+    def prealloc(self, ntot):
+        '''
+        Create the datasets with their final size, ntot galaxies.
+        The subvolumes are then written at the position given by offset,
+        instead of being appended.
+
+        Parameters
+        ----------
+        ntot : integer
+         Total number of galaxies to be written.
+        '''
+
+        self.ntot = int(ntot)
+
+    def write(self, name, data, axis=0, label=None, attrs=None, group='props', index=None):
+        '''
+        Create a dataset or append data to it along the galaxy axis.
+        If the datasets are preallocated, data is written from offset.
+        Sparse datasets, with values only for the galaxies listed in an
+        index dataset, are always appended.
+
+        Parameters
+        ----------
+        name : string
+         Name of the dataset in the data group.
+        data : floats
+         Array with the values of the subvolume.
+        axis : integer
+         Axis running over galaxies.
+        label : string
+         Description label of the dataset.
+        attrs : dictionary
+         Attributes of the dataset, set when it is created.
+        group : string
+         Group of datasets, setting the floating point type: 'props', 'lines', 'fluxes' or 'extra'.
+         Integer data are written as they are.
+        index : string
+         For sparse datasets, name of the index dataset (its own name for the index itself).
+        '''
+
+        append = self.ntot is None or index is not None
+
+        data = np.asarray(data)
+        axis = axis % data.ndim
+        if np.issubdtype(data.dtype, np.floating):
+            scale = self.get_scale(name, group)
+            if scale is not None:
+                data = np.where(data==const.notnum, data, data/scale)
+            data = data.astype(self.dtypes[group], copy=False)
+
+        if name not in self.dsets:
+            if name in self.hfdat:
+                self.dsets[name] = self.hfdat[name]
+            else:
+                shape = list(data.shape)
+                if not append:
+                    shape[axis] = self.ntot
+
+                # Chunks of chunk_size galaxies, whatever the size of the
+                # first subvolume, or the whole output if preallocated and smaller
+                chunks = list(shape)
+                chunks[axis] = self.chunk_size if append else min(self.chunk_size, self.ntot)
+                chunks = tuple([max(nn, 1) for nn in chunks])
+
+                maxshape = (None,)*data.ndim
+                if append:
+                    self.dsets[name] = self.hfdat.create_dataset(name, data=data, maxshape=maxshape,
+                                                                 chunks=chunks, **self.storage)
+                else:
+                    self.dsets[name] = self.hfdat.create_dataset(name, shape=tuple(shape), dtype=data.dtype,
+                                                                 maxshape=maxshape,
+                                                                 chunks=chunks, **self.storage)
+                self.dsets[name].attrs['galaxy_axis'] = axis
+                if index is not None:
+                    self.dsets[name].attrs['index'] = index
+                if label:
+                    self.dsets[name].dims[0].label = label
+                if attrs:
+                    for key in attrs:
+                        self.dsets[name].attrs[key] = attrs[key]
+                if self.scales.get(name) is not None:
+                    self.dsets[name].attrs['scale'] = self.scales[name]
+                if append:
+                    return
+
+        dset = self.dsets[name]
+        nadd = data.shape[axis]
+        if append:
+            start = dset.shape[axis]
+            dset.resize(start + nadd, axis=axis)
+        else:
+            start = self.offset
+            if start + nadd > dset.shape[axis]:
+                print('STOP (eml_io.Writer): {} galaxies do not fit in {} from position {}.'.format(
+                    nadd, name, start))
+                sys.exit()
+        ind = [slice(None)]*data.ndim
+        ind[axis] = slice(start, start+nadd)
+        dset[tuple(ind)] = data
+
+    def get_scale(self, name, group):
+        '''
+        Get the units in which a dataset is stored: those of an existing
+        dataset, or const.float32_scales for new float32 lines and fluxes.
+
+        Parameters
+        ----------
+        name : string
+         Name of the dataset in the data group.
+        group : string
+         Group of datasets, setting the floating point type.
+
+        Returns
+        -------
+        scale : float
+         None if the values are stored as they are.
+        '''
+
+        if name not in self.scales:
+            if name in self.hfdat:
+                self.scales[name] = self.hfdat[name].attrs.get('scale')
+            elif self.dtypes[group]=='float32':
+                self.scales[name] = const.float32_scales.get(group)
+            else:
+                self.scales[name] = None
+        return self.scales[name]
+
+    def set_offset(self, offset):
+        '''
+        Set the position where the next subvolume is written, for preallocated datasets.
+
+        Parameters
+        ----------
+        offset : integer
+         Position along the galaxy axis.
+        '''
+
+        self.offset = int(offset)
+
+    def position(self):
+        '''
+        Get the position along the galaxy axis where the next subvolume is written.
+
+        Returns
+        -------
+        position : integer
+        '''
+
+        if self.ntot is not None:
+            return self.offset
+        return get_ngal(self.hfdat)
+
+    def checkpoint(self, isub, infile, ngal, offset=None):
+        '''
+        Record a completed subvolume in the checkpoint group of the output file.
+        The file is flushed, so the record is only kept once the data is written.
+
+        Parameters
+        ----------
+        isub : integer
+         Index of the subvolume.
+        infile : string
+         Input file of the subvolume.
+        ngal : integer
+         Number of galaxies written.
+        offset : integer
+         Position of the subvolume along the galaxy axis. If None, it follows
+         the previous record. With preallocated datasets it should be given,
+         as the subvolume can be written in several windows.
+        '''
+
+        records = get_checkpoint(self.hf)
+        if records is None:
+            records = {'subvolume': [], 'infile': [], 'offset': [], 'ngal': []}
+            grp = self.hf.create_group('checkpoint')
+        else:
+            grp = self.hf['checkpoint']
+
+        if offset is not None:
+            pass
+        elif records['offset']:
+            offset = records['offset'][-1] + records['ngal'][-1]
+        else:
+            offset = 0
+
+        records['subvolume'].append(int(isub))
+        records['infile'].append(str(infile))
+        records['offset'].append(int(offset))
+        records['ngal'].append(int(ngal))
+        for key in records:
+            grp.attrs[key] = records[key]
+        self.hf.flush()
+
+    def truncate(self, ngal):
+        '''
+        Resize the datasets to ngal galaxies along their galaxy axis,
+        removing any partially written subvolume. Sparse datasets keep the
+        values of the indexed galaxies below ngal. Preallocated datasets
+        are not resized.
+
+        Parameters
+        ----------
+        ngal : integer
+         Number of galaxies kept.
+        '''
+
+        # Number of values kept for each index, before resizing any dataset
+        nkeep = {}
+        for name in self.hfdat:
+            index = self.hfdat[name].attrs.get('index')
+            if index is not None and index not in nkeep:
+                nkeep[index] = np.count_nonzero(self.hfdat[index][:] < ngal)
+
+        for name in self.hfdat:
+            dset = self.hfdat[name]
+            axis = int(dset.attrs['galaxy_axis'])
+            index = dset.attrs.get('index')
+            if index is None:
+                if self.ntot is not None:
+                    continue
+                nn = ngal
+            else:
+                nn = nkeep[index]
+            if dset.shape[axis] > nn:
+                dset.resize(nn, axis=axis)
+
+    def flush(self):
+        self.hf.flush()
+
+    def close(self):
+        if self.hf:
+            self.hf.close()
+            self.hf = None
+
+def get_ngal(hfdat):
+    '''
+    Get the number of galaxies in the data group of an output file,
+    from its first dense (not sparse) dataset.
+
+    Parameters
+    ----------
+    hfdat : h5py Group
+     Data group of the output file.
+
+    Returns
+    -------
+    ngal : integer
+    '''
+
+    for name in hfdat:
+        dset = hfdat[name]
+        if 'index' not in dset.attrs:
+            return dset.shape[int(dset.attrs['galaxy_axis'])]
+    return 0
+
+def get_checkpoint(outfile):
+    '''
+    Get the completed subvolumes recorded in an output file.
+
+    Parameters
+    ----------
+    outfile : string or h5py File
+     Output file.
+
+    Returns
+    -------
+    records : dictionary
+     Lists with the index ('subvolume'), input file ('infile'), position
+     along the galaxy axis ('offset') and number of galaxies ('ngal') of
+     each completed subvolume. None if there is no checkpoint.
+    '''
+
+    if isinstance(outfile, h5py.File):
+        hf = outfile
+    elif os.path.isfile(outfile):
+        with h5py.File(outfile, 'r') as hf:
+            return get_checkpoint(hf)
+    else:
+        return None
+
+    if 'checkpoint' not in hf:
+        return None
+    attrs = hf['checkpoint'].attrs
+    records = {'subvolume': [int(x) for x in attrs['subvolume']],
+               'infile': [str(x) for x in attrs['infile']],
+               'offset': [int(x) for x in attrs['offset']],
+               'ngal': [int(x) for x in attrs['ngal']]}
+    return records
+
+def get_resume(outfile, infile, line_layout='separate', nsel=None):
+    '''
+    Check the completed subvolumes of an output file to resume a run.
+
+    Parameters
+    ----------
+    outfile : string
+     Output file.
+    infile : strings
+     Input files of the run.
+    line_layout : string
+     Line layout of the run.
+    nsel : integers
+     If not None, expected number of galaxies in each subvolume.
+
+    Returns
+    -------
+    ndone : integer
+     Number of completed subvolumes, 0 if the run starts from the beginning.
+    ngal : integer
+     Number of galaxies written by the completed subvolumes.
+    '''
+
+    records = get_checkpoint(outfile)
+    if not records or not records['subvolume']:
+        return 0, 0
+
+    ndone = len(records['subvolume'])
+    with h5py.File(outfile, 'r') as hf:
+        layout = hf['header'].attrs.get('Line layout', 'separate')
+    if layout != line_layout:
+        print('STOP (eml_io.get_resume): {} written with line layout {}, not {}.'.format(
+            outfile, layout, line_layout))
+        sys.exit()
+
+    if ndone > len(infile) or records['subvolume'] != list(range(ndone)):
+        print('STOP (eml_io.get_resume): Subvolumes {} in {} do not match the {} input files.'.format(
+            records['subvolume'], outfile, len(infile)))
+        sys.exit()
+    for i in range(ndone):
+        if records['infile'][i] != str(infile[i]):
+            print('STOP (eml_io.get_resume): Subvolume {} of {} was read from {}, not {}.'.format(
+                i, outfile, records['infile'][i], infile[i]))
+            sys.exit()
+        if nsel is not None and records['ngal'][i] != nsel[i]:
+            print('STOP (eml_io.get_resume): {} galaxies written for {}, {} expected.'.format(
+                records['ngal'][i], infile[i], nsel[i]))
+            sys.exit()
+
+    ngal = records['offset'][-1] + records['ngal'][-1]
+    return ndone, ngal
+
+class WriterThread():
+    '''
+    Thread writing the output in the background, while the next subvolume
+    is calculated. The writing tasks are run in order from a bounded queue,
+    so at most maxsize subvolumes are kept in memory waiting to be written.
+
+    Parameters
+    ----------
+    maxsize : integer
+     Maximum number of writing tasks in the queue.
+    '''
+
+    def __init__(self, maxsize=2):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.discard = False
+        # Time the calculation has been waiting for the writer (s)
+        self.wait_time = 0.
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            # After an error, the remaining tasks are discarded
+            if self.error is None and not self.discard:
+                func, args, kwargs = task
+                try:
+                    func(*args, **kwargs)
+                except BaseException as err:
+                    self.error = err
+
+    def check(self):
+        '''
+        Raise in the calling thread any error found while writing.
+        '''
+
+        if self.error is not None:
+            print('STOP (eml_io.WriterThread): Error writing the output.')
+            raise self.error
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Add a writing task to the queue, waiting if it is full.
+
+        Parameters
+        ----------
+        func : function
+         Writing function, called as func(*args, **kwargs).
+        '''
+
+        self.check()
+        start = time.perf_counter()
+        self.queue.put((func, args, kwargs))
+        self.wait_time += time.perf_counter() - start
+
+    def close(self, discard=False):
+        '''
+        Wait until all the tasks have been written, if not done already.
+
+        Parameters
+        ----------
+        discard : boolean
+         If True, the tasks not yet started are discarded and no
+         writing error is raised (used after an error elsewhere).
+        '''
+
+        if self.thread.is_alive():
+            self.discard = discard
+            start = time.perf_counter()
+            self.queue.put(None)
+            self.thread.join()
+            self.wait_time += time.perf_counter() - start
+        if not discard:
+            self.check()
+
+class SharedArray():
+    '''
+    Copy of an array in a shared memory block, which can be passed
+    to worker processes and viewed there without copying it.
+    '''
+
+    def __init__(self, array):
+        '''
+        Parameters
+        ----------
+        array : numpy array
+         Array to be copied into a new shared memory block.
+        '''
+
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.view()[...] = array
+
+    def view(self):
+        '''
+        Get a numpy array using the shared memory block as buffer.
+
+        Returns
+        -------
+        array : numpy array
+        '''
+
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.block.buf)
+
+    def close(self, unlink=False):
+        '''
+        Close the shared memory block, once no view of it is in use.
+
+        Parameters
+        ----------
+        unlink : boolean
+         If True the block is also freed. Only done by the process that created it.
+        '''
+
+        self.block.close()
+        if unlink:
+            self.block.unlink()
+
+def share_arrays(values):
+    '''
+    Copy the arrays in a list of dictionaries to shared memory blocks.
+
+    Parameters
+    ----------
+    values : list of dictionaries
+     Arrays (and any other values, which are kept as they are).
+
+    Returns
+    -------
+    shared : list of dictionaries
+     As values, with a SharedArray instead of each numerical array.
+    '''
+
+    shared = []
+    for vals in values:
+        shared.append({})
+        for key in vals:
+            val = vals[key]
+            if isinstance(val, np.ndarray) and val.dtype != object:
+                shared[-1][key] = SharedArray(val)
+            else:
+                shared[-1][key] = val
+    return shared
+
+def view_arrays(shared):
+    '''
+    Get views of the shared arrays in a list of dictionaries.
+
+    Parameters
+    ----------
+    shared : list of dictionaries
+     Output of share_arrays.
+
+    Returns
+    -------
+    values : list of dictionaries
+     As shared, with a numpy array viewing each SharedArray.
+    '''
+
+    values = []
+    for vals in shared:
+        values.append({})
+        for key in vals:
+            val = vals[key]
+            values[-1][key] = val.view() if isinstance(val, SharedArray) else val
+    return values
+
+def close_arrays(shared, unlink=False):
+    '''
+    Close the shared memory blocks in a list of dictionaries.
+
+    Parameters
+    ----------
+    shared : list of dictionaries
+     Output of share_arrays.
+    unlink : boolean
+     If True the blocks are also freed.
+    '''
+
+    for vals in shared:
+        for key in vals:
+            if isinstance(vals[key], SharedArray):
+                vals[key].close(unlink=unlink)
+
+def get_shard_name(outfile, i):
+    '''
+    Get the name of the shard file with the subvolume i of an output file.
+
+    Parameters
+    ----------
+    outfile : string
+     Name of the output file.
+    i : integer
+     Subvolume index.
+
+    Returns
+    -------
+    shardfile : string
+    '''
+
+    base, ext = os.path.splitext(outfile)
+    return base + '_shard{}'.format(i) + ext
+
+def get_sweep_name(outfile, k):
+    '''
+    Get the name of the output file for the configuration k of a sweep.
+
+    Parameters
+    ----------
+    outfile : string
+     Name of the output file.
+    k : integer
+     Configuration index.
+
+    Returns
+    -------
+    sweepfile : string
+    '''
+
+    base, ext = os.path.splitext(outfile)
+    return base + '_sweep{}'.format(k) + ext
+
+def stitch_shards(outfile, shardfiles, verbose=True):
+    '''
+    Create an output file with HDF5 virtual datasets joining, in order,
+    the datasets of the shard files along their galaxy axis.
+    Nothing is copied: the shard files must be kept next to the output file.
+
+    Parameters
+    ----------
+    outfile : string
+     Name of the output file.
+    shardfiles : strings
+     Names of the shard files, in subvolume order.
+    verbose : boolean
+     If True print out messages.
+    '''
+
+    # Source files relative to the output file, so the directory can be moved
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    sources = [os.path.relpath(os.path.abspath(ff), outdir) for ff in shardfiles]
+
+    shards = [h5py.File(ff, 'r') for ff in shardfiles]
+    try:
+        with h5py.File(outfile, 'w') as hf:
+            head = hf.create_dataset('header',(1,),dtype='f4')
+            for key in shards[0]['header'].attrs:
+                head.attrs[key] = shards[0]['header'].attrs[key]
+            hfdat = hf.create_group('data')
+
+            # Position of each shard along the galaxy axis
+            starts = np.append(0, np.cumsum([get_ngal(shard['data']) for shard in shards]))
+
+            for name in shards[0]['data']:
+                dset0 = shards[0]['data'][name]
+                axis = int(dset0.attrs['galaxy_axis'])
+
+                if dset0.attrs.get('index') == name:
+                    # Indexes of sparse datasets are shifted to the stitched
+                    # positions, so they are copied instead of being virtual
+                    index = np.concatenate([shard['data'][name][:] + starts[j]
+                                            for j, shard in enumerate(shards)])
+                    vdset = hfdat.create_dataset(name, data=index)
+                    for key in dset0.attrs:
+                        if key not in ['DIMENSION_LIST', 'REFERENCE_LIST']:
+                            vdset.attrs[key] = dset0.attrs[key]
+                    continue
+
+                shape = list(dset0.shape)
+                shape[axis] = 0
+                for shard in shards:
+                    if name not in shard['data']:
+                        print('STOP (eml_io.stitch_shards): {} not found in {}.'.format(
+                            name, shard.filename))
+                        sys.exit()
+                    shape[axis] += shard['data'][name].shape[axis]
+
+                layout = h5py.VirtualLayout(shape=tuple(shape), dtype=dset0.dtype)
+                start = 0
+                for shard, source in zip(shards, sources):
+                    dset = shard['data'][name]
+                    nadd = dset.shape[axis]
+                    if nadd > 0:
+                        ind = [slice(None)]*len(shape)
+                        ind[axis] = slice(start, start+nadd)
+                        layout[tuple(ind)] = h5py.VirtualSource(source, 'data/' + name,
+                                                                shape=dset.shape)
+                    start += nadd
+
+                vdset = hfdat.create_virtual_dataset(name, layout)
+                for key in dset0.attrs:
+                    if key not in ['DIMENSION_LIST', 'REFERENCE_LIST']:
+                        vdset.attrs[key] = dset0.attrs[key]
+    finally:
+        for shard in shards:
+            shard.close()
+
+    if verbose:
+        print('Output file with virtual datasets: ' + outfile)
+
+def get_results(lms, lssfr, lu_sfr, lne_sfr, loh12_sfr,
+                nebline_sfr, nebline_sfr_att=None, fluxes_sfr=None, fluxes_sfr_att=None,
+                lu_agn=None, lne_agn=None, loh12_agn=None, epsilon_agn=None,
+                nebline_agn=None, nebline_agn_att=None, fluxes_agn=None, fluxes_agn_att=None,
+                Lagn=None, extra_param=[[None]], extra_params_names=None):
+    '''
+    Collect the quantities calculated for a subvolume,
+    with the galaxies along the last axis.
+
+    Parameters
+    ----------
+    lms : floats
+     Masses of the galaxies per component (log10(M*) (Msun)), (ngal, ncomp).
+    lssfr : floats
+     sSFR of the galaxies per component (log10(SFR/M*) (1/yr)), (ngal, ncomp).
+    lu_sfr, lne_sfr, loh12_sfr : floats
+     U, ne and Z of the galaxies per component, (ngal, ncomp).
+    nebline_sfr : floats
+     Luminosity of the lines per component, (ncomp, nlines, ngal).
+    nebline_sfr_att, fluxes_sfr, fluxes_sfr_att : floats
+     Attenuated luminosities, fluxes and attenuated fluxes, if calculated.
+    lu_agn, lne_agn, loh12_agn : floats
+     U, ne and Z for the AGN, (ngal, ncomp).
+    epsilon_agn : floats
+     Volume filling factor of the AGN NLRs, (ngal).
+    nebline_agn, nebline_agn_att, fluxes_agn, fluxes_agn_att : floats
+     Luminosities and fluxes of the AGN lines. Only the first component is kept.
+    Lagn : floats
+     If not None, bolometric luminosity of the AGNs (erg/s), (ngal),
+     to index the galaxies hosting an AGN (Lagn>0) for the sparse AGN layout.
+    extra_param : list
+     Values of the extra parameters, each (ngal).
+    extra_params_names : strings
+     Names of the extra parameters.
+
+    Returns
+    -------
+    results : dictionary
+     Arrays with the galaxies along the last axis. Quantities not calculated
+     (att or flux False) are missing, whatever the values of the calculated ones.
+    '''
+
+    results = {'lms': lms.T, 'lssfr': lssfr.T,
+               'lu_sfr': lu_sfr.T, 'lne_sfr': lne_sfr.T, 'lz_sfr': loh12_sfr.T,
+               'nebline_sfr': nebline_sfr}
+
+    optional = {'nebline_sfr_att': nebline_sfr_att, 'fluxes_sfr': fluxes_sfr,
+                'fluxes_sfr_att': fluxes_sfr_att}
+    if nebline_agn is not None:
+        results['lu_agn'] = lu_agn.T
+        results['lne_agn'] = lne_agn.T
+        results['lz_agn'] = loh12_agn.T
+        results['epsilon_agn'] = epsilon_agn[None,:]
+        results['nebline_agn'] = nebline_agn[:1]
+        if Lagn is not None:
+            results['agn_index'] = np.flatnonzero(Lagn > 0)
+        optional.update({'nebline_agn_att': nebline_agn_att, 'fluxes_agn': fluxes_agn,
+                         'fluxes_agn_att': fluxes_agn_att})
+
+    # Quantities not calculated are None (or np.array(None)), while
+    # calculated ones are kept even if they are all zero for this batch,
+    # so all the batches of a run have the same datasets
+    for key in optional:
+        if optional[key] is not None and np.ndim(optional[key]) > 0:
+            if key.endswith('agn') or key.endswith('agn_att'):
+                results[key] = optional[key][:1]
+            else:
+                results[key] = optional[key]
+
+    if extra_param[0][0] is not None:
+        for i in range(len(extra_param)):
+            results[extra_params_names[i]] = extra_param[i][None,:]
+
+    return results
+
+def get_schema(photmod_sfr='gutkin16', photmod_agn='feltre16', AGN=False,
+               line_layout='separate', agn_layout='dense',
+               extra_params_names=None, extra_params_labels=None):
+    '''
+    Get the description of the output datasets. Each entry is a dictionary with:
+    name (of the dataset), key (in the results dictionary), line (index of the line,
+    or None), label (units), group (for the precision, see get_precision),
+    attrs (attributes of the dataset) and cond (function deciding from the first
+    subvolume whether the dataset is written, or None) and index (for sparse
+    datasets, name of the index dataset, which has itself as index).
+
+    All the datasets have the galaxies along their last axis:
+    (ncomp, ngal) for properties and lines, (1, ngal) for AGN lines, epsilon
+    and extra parameters, and (ncomp, nlines, ngal) for stacked lines.
+    In the sparse AGN layout, the AGN datasets only have values for the
+    galaxies listed in agn_index, and their 'fill' attribute is the value
+    for the rest (see read_sparse).
+
+    Parameters
+    ----------
+    photmod_sfr : string
+     Photoionisation model for star-forming regions.
+    photmod_agn : string
+     Photoionisation model for AGNs.
+    AGN : boolean
+     If True AGN emission is included.
+    line_layout : string
+     'separate' for one dataset per line, 'stacked' for one (ncomp, nlines, ngal) dataset per kind.
+    agn_layout : string
+     'dense' for AGN datasets with all the galaxies, 'sparse' for only those with Lagn>0.
+    extra_params_names : strings
+     Names of the datasets in the output files for the extra parameters.
+    extra_params_labels : strings
+     Description labels of the datasets in the output files for the extra parameters.
+
+    Returns
+    -------
+    schema : list of dictionaries
+    '''
+
+    schema = []
+    def add(name, key, label, group='props', line=None, attrs=None, cond=None,
+            index=None, fill=const.notnum):
+        if index is not None and index != name:
+            attrs = dict(attrs or {}, fill=fill)
+        schema.append({'name': name, 'key': key, 'line': line, 'label': label,
+                       'group': group, 'attrs': attrs, 'cond': cond, 'index': index})
+
+    origins = ['sfr']
+    if AGN:
+        origins.append('agn')
+    index = {'sfr': None, 'agn': None}
+    if AGN and agn_layout=='sparse':
+        index['agn'] = 'agn_index'
+        add('agn_index', 'agn_index', 'Position of the galaxies with Lagn>0', index='agn_index')
+
+    for origin in origins:
+        add('lu_' + origin, 'lu_' + origin, 'log10(U) (dimensionless)', index=index[origin])
+        add('lne_' + origin, 'lne_' + origin, 'log10(nH) (cm**-3)', index=index[origin])
+        add('lz_' + origin, 'lz_' + origin, 'log10(Z)', index=index[origin])
+    add('lms', 'lms', 'log10(M*) (Msun)')
+    add('lssfr', 'lssfr', 'log10(SFR/M*) (1/yr)')
+    if AGN:
+        add('epsilon_agn', 'epsilon_agn', 'NLRs volume filling factor (dimensionless)',
+            index=index['agn'])
+
+    # Lines without attenuation, const.notnum for all the galaxies
+    # (see eml_att.attenuation), are not written
+    def attenuated(data):
+        return np.any(data != const.notnum)
+
+    kinds = [('', 'nebline_', 'lines', 'Lines units: erg s^-1', None),
+             ('_att', 'nebline_{}_att', 'lines', 'Lines units: erg s^-1', attenuated),
+             ('_flux', 'fluxes_', 'fluxes', 'Lines units: erg s^-1 cm^-2', None),
+             ('_flux_att', 'fluxes_{}_att', 'fluxes', 'Lines units: erg s^-1 cm^-2', attenuated)]
+
+    for origin in origins:
+        photmod = photmod_sfr if origin=='sfr' else photmod_agn
+        lines = [str(line) for line in const.lines_model[photmod]]
+        for suffix, key, group, label, cond in kinds:
+            if '{}' in key:
+                key = key.format(origin)
+            else:
+                key = key + origin
+            if line_layout=='stacked':
+                add('nebline_' + origin + suffix, key, label, group=group,
+                    attrs={'lines': lines}, index=index[origin], fill=0.)
+            else:
+                for i in range(len(lines)):
+                    add(lines[i] + '_' + origin + suffix, key, label, group=group,
+                        line=i, cond=cond, index=index[origin], fill=0.)
+
+    if extra_params_names:
+        for i in range(len(extra_params_names)):
+            label = None
+            if extra_params_labels:
+                label = extra_params_labels[i]
+            add(extra_params_names[i], extra_params_names[i], label, group='extra')
+
+    return schema
+
+def write_results(writer, results, schema, first=True):
+    '''
+    Write the results of a subvolume following the output schema.
+
+    Parameters
+    ----------
+    writer : Writer
+     Output file.
+    results : dictionary
+     Arrays with the galaxies along the last axis (see get_results).
+    schema : list of dictionaries
+     Description of the output datasets (see get_schema).
+    first : boolean
+     If True, datasets not yet in the file are created (first subvolume).
+    '''
+
+    position = writer.position()
+
+    for entry in schema:
+        data = results.get(entry['key'])
+        if data is None:
+            continue
+        if entry['line'] is not None:
+            data = data[:,entry['line']]
+
+        if entry['name'] not in writer:
+            if not first:
+                continue
+            if entry['cond'] is not None and not entry['cond'](data):
+                continue
+
+        if entry['index'] == entry['name']:
+            # Position of the indexed galaxies in the whole output
+            data = data + position
+        elif entry['index'] is not None:
+            data = data[..., results[entry['index']]]
+
+        writer.write(entry['name'], data, axis=-1, label=entry['label'],
+                     attrs=entry['attrs'], group=entry['group'], index=entry['index'])
+
+def get_format_version(hf):
+    '''
+    Get the version of the layout of an output file (see const.format_version).
+    Files without the 'Format version' attribute have the galaxies
+    along the first axis of the datasets, e.g. (ngal, ncomp).
+
+    Parameters
+    ----------
+    hf : h5py File
+      Output file.
+
+    Returns
+    -------
+    version : integer
+    '''
+
+    if 'header' not in hf:
+        return 1
+    return int(hf['header'].attrs.get('Format version', 1))
+
+def read_sparse(hfdat, name, fill=None, line=None):
+    '''
+    Read a dataset from the data group of an output file, expanding it
+    to all the galaxies if it is sparse (only stored for the galaxies
+    listed in its index dataset). Values stored in the units of a 'scale'
+    attribute (float32 lines and fluxes, see get_precision) are converted back.
+
+    Parameters
+    ----------
+    hfdat : h5py Group
+      Data group of the output file.
+    name : string
+      Name of the dataset.
+    fill : float
+      Value for the galaxies not in the index. By default, the 'fill' attribute
+      of the dataset (const.notnum for U, ne, Z and epsilon, 0 for lines).
+    line : integer
+      If not None, index of the line read from a stacked dataset.
+
+    Returns
+    -------
+    data : floats
+      Array with the values for all the galaxies along the last axis.
+    '''
+
+    dset = hfdat[name]
+    if line is None:
+        values = dset[:]
+    else:
+        values = dset[:,line,:]
+
+    scale = dset.attrs.get('scale')
+    if scale is not None:
+        values = np.where(values==const.notnum, const.notnum, values*np.float64(scale))
+
+    index = dset.attrs.get('index')
+    if index is None or index == name:
+        return values
+
+    if fill is None:
+        fill = dset.attrs.get('fill', const.notnum)
+    data = np.full(values.shape[:-1] + (get_ngal(hfdat),), fill, dtype=values.dtype)
+    data[..., hfdat[index][:]] = values
+    return data
+
+def read_line(hfdat, name):
+    '''
+    Read an emission line from the data group of an output file,
+    with either of the line layouts. Sparse AGN lines are expanded
+    to all the galaxies.
+
+    Parameters
+    ----------
+    hfdat : h5py Group
+      Data group of the output file.
+    name : string
+      Name of the line dataset in the separate layout, e.g. 'Halpha_sfr_att'.
+
+    Returns
+    -------
+    line : floats
+      Array with the values of the line per component, (ncomp, ngal).
+    '''
+
+    if name in hfdat:
+        return read_sparse(hfdat, name)
+
+    for origin in ['_sfr', '_agn']:
+        if origin in name:
+            line, kind = name.split(origin, 1)
+            dset = hfdat['nebline' + origin + kind]
+            lines = [str(ll) for ll in dset.attrs['lines']]
+            if line in lines:
+                return read_sparse(hfdat, 'nebline' + origin + kind, line=lines.index(line))
+
+    print('STOP (eml_io.read_line): {} not found.'.format(name))
+    sys.exit()
 
 def write_data(lms,lssfr,lu_sfr,lne_sfr,loh12_sfr,
                nebline_sfr,nebline_sfr_att=None,fluxes_sfr=None,fluxes_sfr_att=None,
                extra_param=[[None]],extra_params_names=None,extra_params_labels=None,
                outfile='output.hdf5',attmod='ratios',
-               unemod_sfr='kashino20',photmod_sfr='gutkin16',first=True):
+               unemod_sfr=const.unemod_sfr,photmod_sfr='gutkin16',first=True,writer=None,
+               line_layout='separate'):
     '''
     Create a .hdf5 file from a .dat file.
 
@@ -634,103 +2405,33 @@ def write_data(lms,lssfr,lu_sfr,lne_sfr,loh12_sfr,
       Photoionisation model to be used for look up tables.
     first : boolean
       If True it creates the HDF5 file (first subvolume). If false, it adds elements to the existing one.
+    writer : Writer
+      If not None, output file kept open across subvolumes. Otherwise outfile is opened and closed.
+    line_layout : string
+      'separate' for one dataset per line, 'stacked' for one (ncomp, nlines, ngal) dataset per kind.
     '''
-    
-    if first: 
-        with h5py.File(outfile,'w') as hf:
-            head = hf.create_dataset('header',(1,))
-            head.attrs[u'HII model'] = unemod_sfr
-            head.attrs[u'Lines model for SF'] = photmod_sfr
-            head.attrs[u'Attenuation model'] = attmod
-    
-            # Data
-            hfdat = hf.create_group('data')
-            
-            hfdat.create_dataset('lms', data=lms, maxshape=(None,None))
-            hfdat['lms'].dims[0].label = 'log10(M*) (Msun)'
-            
-            hfdat.create_dataset('lssfr', data=lssfr, maxshape=(None,None))
-            hfdat['lssfr'].dims[0].label = 'log10(SFR/M*) (1/yr)'
-    
-            hfdat.create_dataset('lu_sfr', data=lu_sfr, maxshape=(None,None))
-            hfdat['lu_sfr'].dims[0].label = 'log10(U) (dimensionless)'
-    
-            hfdat.create_dataset('lne_sfr',data=lne_sfr, maxshape=(None,None))
-            hfdat['lne_sfr'].dims[0].label = 'log10(nH) (cm**-3)'
-    
-            hfdat.create_dataset('lz_sfr', data=loh12_sfr, maxshape=(None,None))
-            hfdat['lz_sfr'].dims[0].label = 'log10(Z)'
-            
-            for i in range(len(const.lines_model[photmod_sfr])):           
-                hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr', 
-                                     data=nebline_sfr[:,i], maxshape=(None,None))
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].dims[0].label = 'Lines units: [Lsun = 3.826E+33egr s^-1 per unit SFR(Mo/yr) for 10^8yr]'
-                
-                if fluxes_sfr.any():
-                    hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_flux', 
-                                         data=fluxes_sfr[:,i], maxshape=(None,None))
-                    hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
-                    
-                if fluxes_sfr_att.any():
-                    hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_flux_att', 
-                                         data=fluxes_sfr_att[:,i], maxshape=(None,None))
-                    hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
 
-                
-                if nebline_sfr_att.any():
-                    if nebline_sfr_att[0,i,0] > 0:
-                        hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_att', 
-                                             data=nebline_sfr_att[:,i], maxshape=(None,None))
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].dims[0].label = 'Lines units: [Lsun = 3.826E+33egr s^-1 per unit SFR(Mo/yr) for 10^8yr]'
-    
-            if extra_param[0][0] != None:
-                for i in range(len(extra_param)):
-                    hfdat.create_dataset(extra_params_names[i], data=extra_param[i][:,None], maxshape=(None,None))
-                    if extra_params_labels:
-                        hfdat[extra_params_names[i]].dims[0].label = extra_params_labels[i]
-    
-    else:
-        with h5py.File(outfile,'a') as hf:
-            hfdat = hf['data']
-            
-            hfdat['lms'].resize((hfdat['lms'].shape[0] + lms.shape[0]),axis=0)
-            hfdat['lms'][-lms.shape[0]:] = lms
-            
-            hfdat['lssfr'].resize((hfdat['lssfr'].shape[0] + lssfr.shape[0]),axis=0)
-            hfdat['lssfr'][-lssfr.shape[0]:] = lssfr
-            
-            hfdat['lu_sfr'].resize((hfdat['lu_sfr'].shape[0] + lu_sfr.shape[0]),axis=0)
-            hfdat['lu_sfr'][-lu_sfr.shape[0]:] = lu_sfr
-            
-            hfdat['lne_sfr'].resize((hfdat['lne_sfr'].shape[0] + lne_sfr.shape[0]),axis=0)
-            hfdat['lne_sfr'][-lne_sfr.shape[0]:] = lne_sfr
-            
-            hfdat['lz_sfr'].resize((hfdat['lz_sfr'].shape[0] + loh12_sfr.shape[0]),axis=0)
-            hfdat['lz_sfr'][-loh12_sfr.shape[0]:] = loh12_sfr
-            
-            
-            for i in range(len(const.lines_model[photmod_sfr])): 
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'][:,-nebline_sfr.shape[2]:] = nebline_sfr[:,i]
-                
-                if fluxes_sfr.any():
-                    hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                    hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'][:,-nebline_sfr.shape[2]:] = fluxes_sfr[:,i]
-                
-                if fluxes_sfr_att.any():
-                     hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                     hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'][:,-nebline_sfr.shape[2]:] = fluxes_sfr_att[:,i]
-                
-                if nebline_sfr_att.any():
-                    if nebline_sfr_att[0,i,0] > 0:
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].shape[1] + nebline_sfr_att.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'][:,-nebline_sfr_att.shape[2]:] = nebline_sfr_att[:,i]
-
-            if extra_param[0][0] != None:
-                for i in range(len(extra_param)):
-                    hfdat[extra_params_names[i]].resize((hfdat[extra_params_names[i]].shape[0] + extra_param[i][:,None].shape[0]),axis=0)
-                    hfdat[extra_params_names[i]][-extra_param[i][:,None].shape[0]:] = extra_param[i][:,None]
-        
+    close = writer is None
+    if close:
+        writer = Writer(outfile, mode='w' if first else 'a')
+
+    if first:
+        writer.write_header({u'HII model': unemod_sfr,
+                             u'Lines model for SF': photmod_sfr,
+                             u'Attenuation model': attmod,
+                             u'Line layout': line_layout,
+                             u'Format version': const.format_version})
+
+    results = get_results(lms, lssfr, lu_sfr, lne_sfr, loh12_sfr,
+                          nebline_sfr, nebline_sfr_att, fluxes_sfr, fluxes_sfr_att,
+                          extra_param=extra_param, extra_params_names=extra_params_names)
+    schema = get_schema(photmod_sfr=photmod_sfr, line_layout=line_layout,
+                        extra_params_names=extra_params_names,
+                        extra_params_labels=extra_params_labels)
+    write_results(writer, results, schema, first=first)
+
+    if close:
+        writer.close()
 
 def write_data_AGN(lms,lssfr,lu_sfr,lne_sfr,loh12_sfr,lu_agn,lne_agn,loh12_agn,
                nebline_sfr,nebline_agn,nebline_sfr_att=None,nebline_agn_att=None,
@@ -738,8 +2439,9 @@ def write_data_AGN(lms,lssfr,lu_sfr,lne_sfr,loh12_sfr,lu_agn,lne_agn,loh12_agn,
                epsilon_sfr=None,epsilon_agn=None,
                extra_param=[[None]],extra_params_names=None,extra_params_labels=None,
                ew_notatt=None,ew_att=None,outfile='output.hdf5',attmod='ratios',
-               unemod_sfr='kashino20',unemod_agn='panuzzo03',photmod_sfr='gutkin16',
-               photmod_agn='feltre16',first=True):
+               unemod_sfr=const.unemod_sfr,unemod_agn='panuzzo03',photmod_sfr='gutkin16',
+               photmod_agn='feltre16',first=True,writer=None,
+               line_layout='separate',Lagn=None,agn_layout='dense'):
     '''
     Create a .hdf5 file from a .dat file.
 
@@ -795,166 +2497,46 @@ def write_data_AGN(lms,lssfr,lu_sfr,lne_sfr,loh12_sfr,lu_agn,lne_agn,loh12_agn,
       Photoionisation model to be used for look up tables.
     first : boolean
       If True it creates the HDF5 file (first subvolume). If false, it adds elements to the existing one.
+    writer : Writer
+      If not None, output file kept open across subvolumes. Otherwise outfile is opened and closed.
+    line_layout : string
+      'separate' for one dataset per line, 'stacked' for one (ncomp, nlines, ngal) dataset per kind.
+    Lagn : floats
+      Bolometric luminosity of the AGNs (erg/s), needed for the sparse AGN layout.
+    agn_layout : string
+      'dense' for AGN datasets with all the galaxies, 'sparse' for only those with Lagn>0.
     '''
-    
-    if first: 
-        with h5py.File(outfile,'w') as hf:
-            head = hf.create_dataset('header',(1,))
-            head.attrs[u'HII model'] = unemod_sfr
-            head.attrs[u'AGN model'] = unemod_agn
-            head.attrs[u'Lines model for SF'] = photmod_sfr
-            head.attrs[u'Lines model for AGN'] = photmod_agn
-            head.attrs[u'Attenuation model'] = attmod
-    
-            # Data
-            hfdat = hf.create_group('data')
-            
-            hfdat.create_dataset('lms', data=lms, maxshape=(None,None))
-            hfdat['lms'].dims[0].label = 'log10(M*) (Msun)'
-            
-            hfdat.create_dataset('lssfr', data=lssfr, maxshape=(None,None))
-            hfdat['lssfr'].dims[0].label = 'log10(SFR/M*) (1/yr)'
-    
-            hfdat.create_dataset('lu_sfr', data=lu_sfr, maxshape=(None,None))
-            hfdat['lu_sfr'].dims[0].label = 'log10(U) (dimensionless)'
-    
-            hfdat.create_dataset('lne_sfr',data=lne_sfr, maxshape=(None,None))
-            hfdat['lne_sfr'].dims[0].label = 'log10(nH) (cm**-3)'
-    
-            hfdat.create_dataset('lz_sfr', data=loh12_sfr, maxshape=(None,None))
-            hfdat['lz_sfr'].dims[0].label = 'log10(Z)'
-            
-            hfdat.create_dataset('lu_agn', data=lu_agn, maxshape=(None,None))
-            hfdat['lu_agn'].dims[0].label = 'log10(U) (dimensionless)'
-    
-            hfdat.create_dataset('lne_agn',data=lne_agn, maxshape=(None,None))
-            hfdat['lne_agn'].dims[0].label = 'log10(nH) (cm**-3)'
-    
-            hfdat.create_dataset('lz_agn', data=loh12_agn, maxshape=(None,None))
-            hfdat['lz_agn'].dims[0].label = 'log10(Z)'
-            
-            hfdat.create_dataset('epsilon_agn', data=epsilon_agn[None,:], maxshape=(None,None))
-            hfdat['epsilon_agn'].dims[0].label = 'NLRs volume filling factor (dimensionless)'
 
-            for i in range(len(const.lines_model[photmod_sfr])):           
-                hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr', 
-                                     data=nebline_sfr[:,i], maxshape=(None,None))
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].dims[0].label = 'Lines units: erg s^-1'
-                
-                if fluxes_sfr.any():
-                    hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_flux', 
-                                         data=fluxes_sfr[:,i], maxshape=(None,None))
-                    hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
-                    
-                if fluxes_sfr_att.any():
-                    if fluxes_sfr_att[0,i,0] >= 0:
-                        hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_flux_att', 
-                                             data=fluxes_sfr_att[:,i], maxshape=(None,None))
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
-                
-                if nebline_sfr_att.any():
-                    if nebline_sfr_att[0,i,0] >= 0:
-                        hfdat.create_dataset(const.lines_model[photmod_sfr][i] + '_sfr_att', 
-                                             data=nebline_sfr_att[:,i], maxshape=(None,None))
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].dims[0].label = 'Lines units: erg s^-1'
-
-            for i in range(len(const.lines_model[photmod_agn])):
-                hfdat.create_dataset(const.lines_model[photmod_agn][i] + '_agn', 
-                                     data=nebline_agn[0,i][None,:], maxshape=(None,None))
-                hfdat[const.lines_model[photmod_agn][i] + '_agn'].dims[0].label = 'Lines units: egr s^-1'
-                
-                if fluxes_agn.any():
-                    hfdat.create_dataset(const.lines_model[photmod_agn][i] + '_agn_flux', 
-                                         data=fluxes_agn[0,i][None,:], maxshape=(None,None))
-                    hfdat[const.lines_model[photmod_agn][i] + '_agn_flux'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
-                    
-                if fluxes_agn_att.any():
-                    if fluxes_agn_att[0,i,0] >= 0:
-                        hfdat.create_dataset(const.lines_model[photmod_agn][i] + '_agn_flux_att', 
-                                             data=fluxes_agn_att[0,i][None,:], maxshape=(None,None))
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_flux_att'].dims[0].label = 'Lines units: egr s^-1 cm^-2'
-                
-                if nebline_agn_att.any():
-                    if nebline_agn_att[0,i,0] >= 0:
-                        hfdat.create_dataset(const.lines_model[photmod_agn][i] + '_agn_att', 
-                                             data=nebline_agn_att[0,i][None,:], maxshape=(None,None))
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_att'].dims[0].label = 'Lines units: egr s^-1'
-
-            if extra_param[0][0] != None:
-                for i in range(len(extra_param)):
-                    hfdat.create_dataset(extra_params_names[i], data=extra_param[i][None,:], maxshape=(None,None))
-                    if extra_params_labels:
-                        hfdat[extra_params_names[i]].dims[0].label = extra_params_labels[i]
-    else:
-        with h5py.File(outfile,'a') as hf:
-            hfdat = hf['data']
-            
-            hfdat['lms'].resize((hfdat['lms'].shape[0] + lms.shape[0]),axis=0)
-            hfdat['lms'][-lms.shape[0]:] = lms
-            
-            hfdat['lssfr'].resize((hfdat['lssfr'].shape[0] + lssfr.shape[0]),axis=0)
-            hfdat['lssfr'][-lssfr.shape[0]:] = lssfr
-            
-            hfdat['lu_sfr'].resize((hfdat['lu_sfr'].shape[0] + lu_sfr.shape[0]),axis=0)
-            hfdat['lu_sfr'][-lu_sfr.shape[0]:] = lu_sfr
-            
-            hfdat['lne_sfr'].resize((hfdat['lne_sfr'].shape[0] + lne_sfr.shape[0]),axis=0)
-            hfdat['lne_sfr'][-lne_sfr.shape[0]:] = lne_sfr
-            
-            hfdat['lz_sfr'].resize((hfdat['lz_sfr'].shape[0] + loh12_sfr.shape[0]),axis=0)
-            hfdat['lz_sfr'][-loh12_sfr.shape[0]:] = loh12_sfr
-            
-            hfdat['lu_agn'].resize((hfdat['lu_agn'].shape[0] + lu_agn.shape[0]),axis=0)
-            hfdat['lu_agn'][-lu_agn.shape[0]:] = lu_agn
-            
-            hfdat['lne_agn'].resize((hfdat['lne_agn'].shape[0] + lne_agn.shape[0]),axis=0)
-            hfdat['lne_agn'][-lne_agn.shape[0]:] = lne_agn
-            
-            hfdat['lz_agn'].resize((hfdat['lz_agn'].shape[0] + loh12_agn.shape[0]),axis=0)
-            hfdat['lz_agn'][-loh12_agn.shape[0]:] = loh12_agn
-            
-            hfdat['epsilon_agn'].resize((hfdat['epsilon_agn'].shape[1] + epsilon_agn[None,:].shape[1]),axis=1)
-            hfdat['epsilon_agn'][0,-epsilon_agn[None,:].shape[1]:] = epsilon_agn[None,:]
-            
-            for i in range(len(const.lines_model[photmod_sfr])): 
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                hfdat[const.lines_model[photmod_sfr][i] + '_sfr'][:,-nebline_sfr.shape[2]:] = nebline_sfr[:,i]
-                
-                if fluxes_sfr.any():
-                    if fluxes_sfr[0,i,0] >= 0:
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux'][:,-nebline_sfr.shape[2]:] = fluxes_sfr[:,i]
-                
-                if fluxes_sfr_att.any():
-                    if fluxes_sfr_att[0,i,0] >= 0:
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'].shape[1] + nebline_sfr.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_flux_att'][:,-nebline_sfr.shape[2]:] = fluxes_sfr_att[:,i]
-                
-                if nebline_sfr_att.any():
-                    if nebline_sfr_att[0,i,0] >= 0:
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].resize((hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'].shape[1] + nebline_sfr_att.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_sfr][i] + '_sfr_att'][:,-nebline_sfr_att.shape[2]:] = nebline_sfr_att[:,i]
-                        
-            for i in range(len(const.lines_model[photmod_agn])):
-                hfdat[const.lines_model[photmod_agn][i] + '_agn'].resize((hfdat[const.lines_model[photmod_agn][i] + '_agn'].shape[1] + nebline_agn.shape[2]),axis=1)
-                hfdat[const.lines_model[photmod_agn][i] + '_agn'][:,-nebline_agn.shape[2]:] = nebline_agn[0,i][None,:]
-                
-                if fluxes_agn.any():
-                    hfdat[const.lines_model[photmod_agn][i] + '_agn_flux'].resize((hfdat[const.lines_model[photmod_agn][i] + '_agn_flux'].shape[1] + nebline_agn.shape[2]),axis=1)
-                    hfdat[const.lines_model[photmod_agn][i] + '_agn_flux'][:,-nebline_agn.shape[2]:] = fluxes_agn[0,i][None,:]
-                
-                if fluxes_agn_att.any():
-                    if fluxes_agn_att[0,i,0] >= 0:
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_flux_att'].resize((hfdat[const.lines_model[photmod_agn][i] + '_agn_flux_att'].shape[1] + nebline_agn.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_flux_att'][:,-nebline_agn.shape[2]:] = fluxes_agn_att[0,i][None,:]
-                
-                if nebline_agn_att.any():
-                    if nebline_agn_att[0,i,0] >= 0:
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_att'].resize((hfdat[const.lines_model[photmod_agn][i] + '_agn_att'].shape[1] + nebline_agn_att.shape[2]),axis=1)
-                        hfdat[const.lines_model[photmod_agn][i] + '_agn_att'][:,-nebline_agn_att.shape[2]:] = nebline_agn_att[0,i][None,:]
-            
-            if extra_param[0][0] != None:
-                for i in range(len(extra_param)):
-                    hfdat[extra_params_names[i]].resize((hfdat[extra_params_names[i]].shape[1] + extra_param[i][None,:].shape[1]),axis=1)
-                    hfdat[extra_params_names[i]][0,-extra_param[i][None,:].shape[1]:] = extra_param[i][None,:]
-        
\ No newline at end of file
+    if agn_layout=='sparse' and Lagn is None:
+        print('STOP (eml_io.write_data_AGN): Lagn is needed for the sparse AGN layout.')
+        sys.exit()
+
+    close = writer is None
+    if close:
+        writer = Writer(outfile, mode='w' if first else 'a')
+
+    if first:
+        writer.write_header({u'HII model': unemod_sfr,
+                             u'AGN model': unemod_agn,
+                             u'Lines model for SF': photmod_sfr,
+                             u'Lines model for AGN': photmod_agn,
+                             u'Attenuation model': attmod,
+                             u'Line layout': line_layout,
+                             u'AGN layout': agn_layout,
+                             u'Format version': const.format_version})
+
+    results = get_results(lms, lssfr, lu_sfr, lne_sfr, loh12_sfr,
+                          nebline_sfr, nebline_sfr_att, fluxes_sfr, fluxes_sfr_att,
+                          lu_agn=lu_agn, lne_agn=lne_agn, loh12_agn=loh12_agn,
+                          epsilon_agn=epsilon_agn, nebline_agn=nebline_agn,
+                          nebline_agn_att=nebline_agn_att, fluxes_agn=fluxes_agn,
+                          fluxes_agn_att=fluxes_agn_att, Lagn=Lagn,
+                          extra_param=extra_param, extra_params_names=extra_params_names)
+    schema = get_schema(photmod_sfr=photmod_sfr, photmod_agn=photmod_agn, AGN=True,
+                        line_layout=line_layout, agn_layout=agn_layout,
+                        extra_params_names=extra_params_names,
+                        extra_params_labels=extra_params_labels)
+    write_results(writer, results, schema, first=first)
+
+    if close:
+        writer.close()
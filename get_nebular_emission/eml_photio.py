@@ -2,12 +2,13 @@ import h5py
 import numpy as np
 from get_nebular_emission.eml_io import get_nheader, homedir, locate_interval
 import get_nebular_emission.eml_const as const
-from get_nebular_emission.eml_io import check_file
+from get_nebular_emission.eml_io import check_file, get_nthreads
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from cosmology import emission_line_flux
 
-from cosmology import logL2flux, set_cosmology
+from cosmology import logL2flux, set_cosmology, luminosity_distance, Mpc2cm
 
 def get_zfile(zmet_str, photmod='gutkin16'):
 
@@ -85,10 +86,14 @@ def clean_photarray(lms, lssfr, lu, lne, loh12, photmod='gutkin16', verbose=True
                 
     return lms, lssfr, lu, lne, loh12
 
+# Limits of the photoionisation models per (photmod, propname)
+_limits_cache = {}
+
 def get_limits(propname, photmod='gutkin16',verbose=True):
     '''
     Given a file with a structure: property + lower limit + upper limit,
     gets the limits of the parameters of the photoionization model.
+    The limits file is read only the first time a property is requested.
 
     In the file we must find the properties well specified i.e U, Z and nH.
     The header lines have to start with '#'
@@ -129,6 +134,10 @@ def get_limits(propname, photmod='gutkin16',verbose=True):
         print('                  Possible photmod= {}'.format(const.mod_lim.keys()))
         exit()
 
+    key = (photmod, propname)
+    if key in _limits_cache:
+        return _limits_cache[key]
+
     # Check if the limits file exists:
     check_file(infile, verbose=verbose)
     # print(infile)
@@ -145,8 +154,30 @@ def get_limits(propname, photmod='gutkin16',verbose=True):
         ih = get_nheader(infile,firstchar='#')
         lower_limit = np.loadtxt(infile, skiprows=ind+ih, max_rows=1, usecols=(1),unpack=True)
         upper_limit = np.loadtxt(infile,skiprows=ind+ih, max_rows=1,usecols=(2),unpack=True)
+        _limits_cache[key] = (lower_limit, upper_limit)
         return lower_limit,upper_limit
     
+# Cosmological parameters last passed to set_cosmology
+_cosmology = {}
+
+def use_cosmology(h0=const.h):
+    '''
+    Set the cosmology for the flux calculation, evaluating the
+    comoving distances only if the parameters have changed.
+
+    Parameters
+    ----------
+    h0 : float
+      Value of h, H0=100h km/s/Mpc.
+    '''
+
+    params = {'omega0': const.omega0, 'omegab': const.omegab,
+              'lambda0': const.lambda0, 'h0': h0}
+    if params != _cosmology:
+        set_cosmology(**params)
+        _cosmology.clear()
+        _cosmology.update(params)
+
 def calculate_flux(nebline,redshift,h0=const.h,origin='sfr'):
     '''
     Get the fluxes for the emission lines given the luminosity and redshift.
@@ -166,64 +197,180 @@ def calculate_flux(nebline,redshift,h0=const.h,origin='sfr'):
     '''
     
     if nebline.any():
-        set_cosmology(omega0=const.omega0, omegab=const.omegab,lambda0=const.lambda0,h0=h0)
+        use_cosmology(h0=h0)
         
         luminosities = np.zeros(nebline.shape)
         luminosities[nebline>0] = np.log10(nebline[nebline>0]*h0**2)
         if (origin=='agn') and (luminosities.shape[0]==2):
             luminosities[1] = 0
             
+        # As logL2flux, for all the lines at once
         fluxes = np.zeros(luminosities.shape)
-        for comp in range(luminosities.shape[0]):
-            for i in range(luminosities.shape[1]):
-                for j in range(luminosities.shape[2]):
-                    if luminosities[comp,i,j] == 0:  
-                        fluxes[comp,i,j] = 0
-                    else:
-                        fluxes[comp,i,j] = logL2flux(luminosities[comp,i,j],redshift)
+        ind = np.where((luminosities != 0) & (luminosities > -9.))
+        if len(ind[0]) > 0:
+            # Luminosity distance in cm/h
+            d_L = max(luminosity_distance(redshift),10.**-5)*Mpc2cm
+            den = 4.0*np.pi*(d_L**2)
+            fluxes[ind] = 10**(luminosities[ind] - np.log10(den))
     else:
         fluxes = np.copy(nebline)
             
     return fluxes
             
-def get_lines_Feltre(lu, lne, loh12, verbose=True, 
-                     xid_feltre=0.5,alpha_feltre=-1.7):
+# Grids of the photoionisation models per (photmod, model parameters)
+_grid_cache = {}
+
+def get_interval(vals, edges, minval):
     '''
-    Get the interpolations for the emission lines,
-    using the tables
-    from Feltre et al. (2016) (https://arxiv.org/pdf/1511.08217utkingalaxies per component.
-    lne : floats
-     ne of the galaxies per component (cm^-3).
-    loh12 : floats
-     Metallicity of the galaxies per component (log10(Z))
+    Given values and the edges of the bins of a grid, get the index of
+    the lower edge of the bin used for a linear interpolation and the
+    fractional distance of the values from it (see locate_interval).
+
+    Parameters
+    ----------
+    vals : floats
+     Values to be interpolated.
+    edges : floats
+     Edges of the grid bins.
+    minval : float
+     Values below it take the lower edge of the grid.
+
+    Returns
+    -------
+    ind : integers
+     Index of the lower edge of the bin.
+    d : floats
+     Fractional distance of the values from the lower edge.
+    '''
+
+    edges = np.asarray(edges)
+    nbins = len(edges)
+
+    ind = np.searchsorted(edges, vals, side='right') - 1
+    ind[ind < 0] = 0
+
+    # Values above the last edge take the upper edge of the grid
+    d = np.ones(len(vals))
+    upper = ind >= nbins - 1
+    ind[upper] = nbins - 2
+
+    mid = np.where(~upper)[0]
+    d[mid] = (vals[mid] - edges[ind[mid]]) / (edges[ind[mid] + 1] - edges[ind[mid]])
+
+    low = vals < minval
+    ind[low] = 0
+    d[low] = 0.
+
+    return ind, d
+
+def interpolate_grid(grid, i, dz, j, du):
+    '''
+    Bilinear interpolation of the emission lines in metallicity and U.
+
+    Parameters
+    ----------
+    grid : floats
+     Luminosity of the lines with shape (metallicity, U, line).
+    i, j : integers
+     Index of the lower metallicity and U edges.
+    dz, du : floats
+     Fractional distances from the lower metallicity and U edges.
+
+    Returns
+    -------
+    emline_int : floats
+     Interpolated luminosity of the lines with shape (line, galaxy).
+    '''
+
+    # Weights per galaxy, applied to all the lines
+    w00 = ((1.-dz)*(1.-du))[:,None]
+    w10 = (dz*(1-du))[:,None]
+    w01 = ((1.-dz)*du)[:,None]
+    w11 = (dz*du)[:,None]
+
+    emline_int = (w00*grid[i,j] + w10*grid[i+1,j] +
+                  w01*grid[i,j+1] + w11*grid[i+1,j+1])
+    return emline_int.T
+
+def get_blocks(lu, n_threads=1):
+    '''
+    Split the galaxies with U of each component into blocks,
+    to be interpolated in parallel.
+
+    Parameters
+    ----------
+    lu : floats
+     U of the galaxies per component.
+    n_threads : integer
+     Number of threads.
+
+    Returns
+    -------
+    blocks : list
+     (component, index of the galaxies) for each block.
+    '''
+
+    blocks = []
+    for comp in range(lu.shape[1]):
+        ind = np.where(lu[:,comp] != const.notnum)[0]
+        nblocks = max(1, min(n_threads, len(ind)//const.thread_block))
+        for block in np.array_split(ind, nblocks):
+            blocks.append((comp, block))
+    return blocks
+
+def run_blocks(func, blocks, n_threads=1):
+    '''
+    Call func(comp, ind) for each block, with a pool of threads if n_threads > 1.
+    The interpolation is done by NumPy, which releases the GIL.
+
+    Parameters
+    ----------
+    func : function
+     Function interpolating a block.
+    blocks : list
+     (component, index of the galaxies) for each block (see get_blocks).
+    n_threads : integer
+     Number of threads.
+    '''
+
+    if n_threads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            for result in pool.map(lambda block: func(*block), blocks):
+                pass
+    else:
+        for comp, ind in blocks:
+            func(comp, ind)
+
+def get_grid_Feltre(xid_feltre=0.5, alpha_feltre=-1.7, verbose=True):
+    '''
+    Get the grids of emission lines from the tables of
+    Feltre et al. (2016) (https://arxiv.org/pdf/1511.08217.pdf).
+    The tables are read only the first time a set of parameters is requested.
+
+    Parameters
+    ----------
     xid_feltre : float
      Dust-to-metal ratio for the Feltre et. al. photoionisation model.
     alpha_feltre : float
      Alpha value for the Feltre et. al. photoionisation model.
     verbose : boolean
       If True print out messages
-      
+
     Returns
     -------
-    nebline : floats
-     Array with the luminosity of the lines per component. (Lsun for L_AGN = 10^45 erg/s)
+    emline_grid1, emline_grid2, emline_grid3 : floats
+     Luminosity of the lines for nH = 100, 1000 and 10000 cm^-3,
+     with shape (metallicity, U, line).
     '''
-    
-    minU, maxU = get_limits(propname='U', photmod='feltre16')
-    minnH, maxnH = get_limits(propname='nH', photmod='feltre16')
-    minZ, maxZ = get_limits(propname='Z', photmod='feltre16')
-    minZ, maxZ = np.log10(minZ), np.log10(maxZ)
-    
+
+    key = ('feltre16', xid_feltre, alpha_feltre)
+    if key in _grid_cache:
+        return _grid_cache[key]
+
     zmet_str = const.zmet_str['feltre16']
-    zmets = np.full(len(zmet_str),const.notnum)
     zmets = np.array([float('0.' + zmet) for zmet in zmet_str])
 
-    logubins = [-5., -4.5, -4., -3.5, -3., -2.5, -2., -1.5, -1.]
-    
     nemline = 20
-    ndat = lu.shape[0]
-    ncomp = lu.shape[1]
-
     nzmet = 16
     nu = 9
 
@@ -282,6 +429,52 @@ def get_lines_Feltre(lu, lne, loh12, verbose=True,
                                 emline_grid3[k,l,j] = float(data[j+4])
         ff.close()
 
+    _grid_cache[key] = (emline_grid1, emline_grid2, emline_grid3)
+    return _grid_cache[key]
+
+def get_lines_Feltre(lu, lne, loh12, verbose=True, 
+                     xid_feltre=0.5,alpha_feltre=-1.7,n_threads=1):
+    '''
+    Get the interpolations for the emission lines,
+    using the tables
+    from Feltre et al. (2016) (https://arxiv.org/pdf/1511.08217utkingalaxies per component.
+    lne : floats
+     ne of the galaxies per component (cm^-3).
+    loh12 : floats
+     Metallicity of the galaxies per component (log10(Z))
+    xid_feltre : float
+     Dust-to-metal ratio for the Feltre et. al. photoionisation model.
+    alpha_feltre : float
+     Alpha value for the Feltre et. al. photoionisation model.
+    n_threads : integer
+     Number of threads interpolating blocks of galaxies.
+    verbose : boolean
+      If True print out messages
+      
+    Returns
+    -------
+    nebline : floats
+     Array with the luminosity of the lines per component. (Lsun for L_AGN = 10^45 erg/s)
+    '''
+    
+    minU, maxU = get_limits(propname='U', photmod='feltre16')
+    minnH, maxnH = get_limits(propname='nH', photmod='feltre16')
+    minZ, maxZ = get_limits(propname='Z', photmod='feltre16')
+    minZ, maxZ = np.log10(minZ), np.log10(maxZ)
+    
+    zmet_str = const.zmet_str['feltre16']
+    zmets = np.array([float('0.' + zmet) for zmet in zmet_str])
+
+    logubins = [-5., -4.5, -4., -3.5, -3., -2.5, -2., -1.5, -1.]
+    
+    nemline = 20
+    ndat = lu.shape[0]
+    ncomp = lu.shape[1]
+
+    emline_grid1, emline_grid2, emline_grid3 = get_grid_Feltre(xid_feltre=xid_feltre,
+                                                               alpha_feltre=alpha_feltre,
+                                                               verbose=verbose)
+
     # log metallicity bins ready for interpolation:
 
     lzmets = np.full(len(zmets), const.notnum)
@@ -292,113 +485,55 @@ def get_lines_Feltre(lu, lne, loh12, verbose=True,
     nebline = np.zeros((ncomp,nemline,ndat))
 
     # Interpolate in all three ne grids to start with u-grid first, since the same for all grids
+    # (for each component and block of galaxies, ind, in parallel if n_threads > 1)
     
-    for comp in range(ncomp):
-        
-        ind = np.where(lu[:,comp] != const.notnum)[0]
-
-        emline_int1 = np.zeros((nemline,ndat))
-        emline_int2 = np.zeros((nemline, ndat))
-        emline_int3 = np.zeros((nemline, ndat))
-    
-        # Interpolate over ionisation parameter
-        du = []
-        j = []
-        for logu in lu[:,comp]:
-            j1 = locate_interval(logu,logubins)
-            if logu<minU:
-                du.append(0.0)
-                j.append(0)
-                #du = 0.0
-                j1 = 0
-            elif j1 == nu - 1:
-                du.append(1.0)
-                j.append(nu-2)
-                #du = 1.0
-                j1 = nu - 2
-            else:
-                d = (logu - logubins[j1]) / (logubins[j1 + 1] - logubins[j1])
-                du.append(d)
-                j.append(j1)
-
-        dz = []
-        i = []
-    
-        for logz in loh12[:,comp]:
-            i1 = locate_interval(logz, lzmets)
-            if logz<minZ:
-                dz.append(0.0)
-                # dz = 0.0
-                i1 = 0
-                i.append(0)
-            elif i1 == nzmet - 1:
-                dz.append(1.0)
-                # dz = 1.0
-                i1 = nzmet - 2
-                i.append(nzmet - 2)
-            else:
-                d = (logz - lzmets[i1]) / (lzmets[i1 + 1] - lzmets[i1])
-                dz.append(d)
-                i.append(i1)
-    
+    def interpolate(comp, ind):
     
-        for k in range(nemline):
-            for ii in ind:
-                emline_int1[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid1[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid1[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid1[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid1[i[ii]+1][j[ii]+1][k]
-                                     
-                emline_int2[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid2[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid2[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid2[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid2[i[ii]+1][j[ii]+1][k]
-    
-                emline_int3[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid3[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid3[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid3[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid3[i[ii]+1][j[ii]+1][k]
+        # Interpolate over ionisation parameter and metallicity
+        j, du = get_interval(lu[ind,comp], logubins, minU)
+        i, dz = get_interval(loh12[ind,comp], lzmets, minZ)
+
+        emline_int1 = interpolate_grid(emline_grid1, i, dz, j, du)
+        emline_int2 = interpolate_grid(emline_grid2, i, dz, j, du)
+        emline_int3 = interpolate_grid(emline_grid3, i, dz, j, du)
     
         # Interpolate over ne
         # use gas density in disk logned
-        for n in ind:
-            if (lne[:,comp][n] > 2. and lne[:,comp][n] <= 3.):
-                dn = (lne[:,comp][n] -2.)/(3. - 2.)
-                for k in range(nemline):
-                    nebline[comp][k][n] = (1.-dn)*emline_int1[k][n] + (dn)*emline_int2[k][n]
-    
-            elif (lne[:,comp][n] > 3. and lne[:,comp][n] <= 4.):
-                dn = (lne[:,comp][n] - 3.)/(4. - 3.)
-                for k in range(nemline):
-                    nebline[comp][k][n] = (1. - dn) * emline_int2[k][n] + (dn) * emline_int3[k][n]
-                # print('hay mayor que 3')
-    
-            elif (lne[:,comp][n] <= 2.):
-                for k in range(nemline):
-                    nebline[comp][k][n] = emline_int1[k][n]
-            elif (lne[:,comp][n] > 4.):
-                for k in range(nemline):
-                    nebline[comp][k][n] = emline_int3[k][n]
-            else:
-                print('log(ne)disk out of limits','log(ne)disk = {}'.format(lne[:,comp][n]))
+        ne = lne[ind,comp]
+        nebcomp = np.zeros((nemline,len(ind)))
+
+        sel = (ne > 2.) & (ne <= 3.)
+        dn = (ne[sel] - 2.)/(3. - 2.)
+        nebcomp[:,sel] = (1.-dn)*emline_int1[:,sel] + (dn)*emline_int2[:,sel]
+
+        sel = (ne > 3.) & (ne <= 4.)
+        dn = (ne[sel] - 3.)/(4. - 3.)
+        nebcomp[:,sel] = (1. - dn) * emline_int2[:,sel] + (dn) * emline_int3[:,sel]
+
+        sel = (ne <= 2.)
+        nebcomp[:,sel] = emline_int1[:,sel]
+
+        sel = (ne > 4.)
+        nebcomp[:,sel] = emline_int3[:,sel]
+
+        sel = ~((ne <= 4.) | (ne > 4.))
+        if sel.any():
+            print('log(ne)disk out of limits','log(ne)disk = {}'.format(ne[sel]))
+
+        nebline[comp][:,ind] = nebcomp
+
+    run_blocks(interpolate, get_blocks(lu, n_threads=n_threads), n_threads=n_threads)
                 
     return nebline
 
-def get_lines_Gutkin(lu, lne, loh12, verbose=True,
-                     xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100):
+def get_grid_Gutkin(xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100, verbose=True):
     '''
-    Get the interpolations for the emission lines,
-    using the tables
-    from Gutkin et al. (2016) (https://arxiv.org/pdf/1607.06086.pdf)
+    Get the grids of emission lines from the tables of
+    Gutkin et al. (2016) (https://arxiv.org/pdf/1607.06086.pdf).
+    The tables are read only the first time a set of parameters is requested.
 
     Parameters
     ----------
-    lu : floats
-     U of the galaxies per component.
-    lne : floats
-     ne of the galaxies per component (cm^-3).
-    loh12 : floats
-     Metallicity of the galaxies per component (log10(Z))
     xid_gutkin : float
      Dust-to-metal ratio for the Gutkin et. al. photoionisation model.
     co_gutkin : float
@@ -407,32 +542,26 @@ def get_lines_Gutkin(lu, lne, loh12, verbose=True,
      Solar mass high limit for the IMF for the Gutkin et. al. photoionisation model.
     verbose : boolean
       If True print out messages
-      
+
     Returns
     -------
-    nebline : floats
-     Array with the luminosity of the lines per component. (Lsun per unit SFR(Mo/yr) for 10^8yr)
+    emline_grid1, emline_grid2, emline_grid3, emline_grid4 : floats
+     Luminosity of the lines for nH = 10, 100, 1000 and 10000 cm^-3,
+     with shape (metallicity, U, line). The grids for nH = 10 and 10000 cm^-3
+     only have the reduced set of metallicities.
     '''
-    
-    minU, maxU = get_limits(propname='U', photmod='feltre16')
-    minnH, maxnH = get_limits(propname='nH', photmod='feltre16')
-    minZ, maxZ = get_limits(propname='Z', photmod='feltre16')
-    minZ, maxZ = np.log10(minZ), np.log10(maxZ)
-    
+
+    key = ('gutkin16', xid_gutkin, co_gutkin, imf_cut_gutkin)
+    if key in _grid_cache:
+        return _grid_cache[key]
+
     zmet_str = const.zmet_str['gutkin16']
-    zmets = np.full(len(zmet_str),const.notnum)
     zmets = np.array([float('0.' + zmet) for zmet in zmet_str])
 
-    logubins = [-4., -3.5, -3., -2.5, -2., -1.5, -1.]
-    
     nemline = 18
-    ndat = lu.shape[0]
-    ncomp = lu.shape[1]
-
     nzmet = 14
     nu = 7
     nzmet_reduced = 4
-    zmets_reduced = const.zmet_reduced['gutkin16']
 
     emline_grid1 = np.zeros((nzmet_reduced,nu,nemline)) # From slower to faster
     emline_grid2 = np.zeros((nzmet,nu,nemline))
@@ -502,6 +631,61 @@ def get_lines_Gutkin(lu, lne, loh12, verbose=True,
                                 emline_grid4[kred,l,j] = float(data[j+5])
         ff.close()
 
+    _grid_cache[key] = (emline_grid1, emline_grid2, emline_grid3, emline_grid4)
+    return _grid_cache[key]
+
+def get_lines_Gutkin(lu, lne, loh12, verbose=True,
+                     xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100,n_threads=1):
+    '''
+    Get the interpolations for the emission lines,
+    using the tables
+    from Gutkin et al. (2016) (https://arxiv.org/pdf/1607.06086.pdf)
+
+    Parameters
+    ----------
+    lu : floats
+     U of the galaxies per component.
+    lne : floats
+     ne of the galaxies per component (cm^-3).
+    loh12 : floats
+     Metallicity of the galaxies per component (log10(Z))
+    xid_gutkin : float
+     Dust-to-metal ratio for the Gutkin et. al. photoionisation model.
+    co_gutkin : float
+     C/O ratio for the Gutkin et. al. photoionisation model.
+    imf_cut_gutkin : float
+     Solar mass high limit for the IMF for the Gutkin et. al. photoionisation model.
+    n_threads : integer
+     Number of threads interpolating blocks of galaxies.
+    verbose : boolean
+      If True print out messages
+      
+    Returns
+    -------
+    nebline : floats
+     Array with the luminosity of the lines per component. (Lsun per unit SFR(Mo/yr) for 10^8yr)
+    '''
+    
+    minU, maxU = get_limits(propname='U', photmod='feltre16')
+    minnH, maxnH = get_limits(propname='nH', photmod='feltre16')
+    minZ, maxZ = get_limits(propname='Z', photmod='feltre16')
+    minZ, maxZ = np.log10(minZ), np.log10(maxZ)
+    
+    zmet_str = const.zmet_str['gutkin16']
+    zmets = np.array([float('0.' + zmet) for zmet in zmet_str])
+
+    logubins = [-4., -3.5, -3., -2.5, -2., -1.5, -1.]
+    
+    nemline = 18
+    ndat = lu.shape[0]
+    ncomp = lu.shape[1]
+
+    zmets_reduced = const.zmet_reduced['gutkin16']
+
+    emline_grid1, emline_grid2, emline_grid3, emline_grid4 = get_grid_Gutkin(
+        xid_gutkin=xid_gutkin, co_gutkin=co_gutkin, imf_cut_gutkin=imf_cut_gutkin,
+        verbose=verbose)
+
     # log metallicity bins ready for interpolation:
 
     lzmets_reduced = np.full(len(zmets_reduced), const.notnum)
@@ -518,144 +702,99 @@ def get_lines_Gutkin(lu, lne, loh12, verbose=True,
     nebline = np.zeros((ncomp,nemline,ndat))
 
     # Interpolate in all three ne grids to start with u-grid first, since the same for all grids
+    # (for each component and block of galaxies, ind, in parallel if n_threads > 1)
     
-    for comp in range(ncomp):
-        
-        ind = np.where(lu[:,comp] != const.notnum)[0]
-
-        emline_int1 = np.zeros((nemline,ndat))
-        emline_int2 = np.zeros((nemline, ndat))
-        emline_int3 = np.zeros((nemline, ndat))
-        emline_int4 = np.zeros((nemline, ndat))
+    def interpolate(comp, ind):
     
         # Interpolate over ionisation parameter
-        du = []
-        j = []
-        for logu in lu[:,comp]:
-            j1 = locate_interval(logu,logubins)
-            if logu<minU:
-                du.append(0.0)
-                j.append(0)
-                #du = 0.0
-                j1 = 0
-            elif j1 == nu - 1:
-                du.append(1.0)
-                j.append(nu-2)
-                #du = 1.0
-                j1 = nu - 2
-            else:
-                d = (logu - logubins[j1]) / (logubins[j1 + 1] - logubins[j1])
-                du.append(d)
-                j.append(j1)
+        j, du = get_interval(lu[ind,comp], logubins, minU)
 
         # Interpolate over disk gas metallicity loh12[comp]
-        dz = []
-        i = []
-        for logz in loh12[:,comp]:
-            i1 = locate_interval(logz,lzmets_reduced)
-    
-            if logz<minZ:
-                dz.append(0.0)
-                #dz = 0.0
-                i1 = 0
-                i.append(0)
-            elif i1 == nzmet_reduced-1:
-                dz.append(1.0)
-                #dz = 1.0
-                i1 = nzmet_reduced-2
-                i.append(nzmet_reduced-2)
-            else:
-                d = (logz - lzmets_reduced[i1])/(lzmets_reduced[i1+1]-lzmets_reduced[i1])
-                dz.append(d)
-                i.append(i1)
-    
-    
-        for k in range(nemline):
-            for ii in ind:
-                #emline_grid1 = np.zeros((nzmet_reduced, nu, nemline))
-                #print(emline_grid1[i[ii]][j[ii]][k])
-                emline_int1[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid1[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid1[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid1[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid1[i[ii]+1][j[ii]+1][k]
-    
-                emline_int4[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid4[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid4[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid4[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid4[i[ii]+1][j[ii]+1][k]
-    
+        i, dz = get_interval(loh12[ind,comp], lzmets_reduced, minZ)
+        emline_int1 = interpolate_grid(emline_grid1, i, dz, j, du)
+        emline_int4 = interpolate_grid(emline_grid4, i, dz, j, du)
     
         # full metallicity grid for emlines_grid2 ne=100 and emlines_grid3 ne=1000
-    
-        dz = []
-        i = []
-    
-        for logz in loh12[:,comp]:
-            i1 = locate_interval(logz, lzmets)
-            if logz<minZ:
-                dz.append(0.0)
-                # dz = 0.0
-                i1 = 0
-                i.append(0)
-            elif i1 == nzmet - 1:
-                dz.append(1.0)
-                # dz = 1.0
-                i1 = nzmet - 2
-                i.append(nzmet - 2)
-            else:
-                d = (logz - lzmets[i1]) / (lzmets[i1 + 1] - lzmets[i1])
-                dz.append(d)
-                i.append(i1)
-    
-    
-        for k in range(nemline):
-            for ii in ind:
-                emline_int2[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid2[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid2[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid2[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid2[i[ii]+1][j[ii]+1][k]
-    
-                emline_int3[k][ii] = (1.-dz[ii])*(1.-du[ii])*emline_grid3[i[ii]][j[ii]][k]+\
-                                     dz[ii]*(1-du[ii])*emline_grid3[i[ii]+1][j[ii]][k]+\
-                                     (1.-dz[ii])*du[ii]*emline_grid3[i[ii]][j[ii]+1][k]+\
-                                     dz[ii]*du[ii]*emline_grid3[i[ii]+1][j[ii]+1][k]
+        i, dz = get_interval(loh12[ind,comp], lzmets, minZ)
+        emline_int2 = interpolate_grid(emline_grid2, i, dz, j, du)
+        emline_int3 = interpolate_grid(emline_grid3, i, dz, j, du)
     
         # Interpolate over ne
         # use gas density in disk logned
-        for n in ind:
-            if (lne[:,comp][n] > 2. and lne[:,comp][n] <= 3.):
-                dn = (lne[:,comp][n] -2.)/(3. - 2.)
-                for k in range(nemline):
-                    nebline[comp][k][n] = (1.-dn)*emline_int2[k][n] + (dn)*emline_int3[k][n]
-    
-            elif (lne[:,comp][n] > 1. and lne[:,comp][n] <= 2.):
-                dn = (lne[:,comp][n] -1.)/(2. - 1.)
-                for k in range(nemline):
-                    nebline[comp][k][n] = (1.-dn)*emline_int1[k][n] + (dn)*emline_int2[k][n]
-    
-            elif (lne[:,comp][n] > 3. and lne[:,comp][n]<=4.):
-                dn = (lne[:,comp][n] - 3.)/(4. - 3.)
-                for k in range(nemline):
-                    nebline[comp][k][n] = (1. - dn) * emline_int3[k][n] + (dn) * emline_int4[k][n]
-                # print('hay mayor que 3')
-    
-            elif (lne[:,comp][n] <= 1.):
-                for k in range(nemline):
-                    nebline[comp][k][n] = emline_int1[k][n]
-            elif (lne[:,comp][n] > 4.):
-                for k in range(nemline):
-                    nebline[comp][k][n] = emline_int4[k][n]
-            else:
-                print('log(ne)disk out of limits','log(ne)disk = {}'.format(lne[:,comp][n]))
+        ne = lne[ind,comp]
+        nebcomp = np.zeros((nemline,len(ind)))
+
+        sel = (ne > 2.) & (ne <= 3.)
+        dn = (ne[sel] - 2.)/(3. - 2.)
+        nebcomp[:,sel] = (1.-dn)*emline_int2[:,sel] + (dn)*emline_int3[:,sel]
+
+        sel = (ne > 1.) & (ne <= 2.)
+        dn = (ne[sel] - 1.)/(2. - 1.)
+        nebcomp[:,sel] = (1.-dn)*emline_int1[:,sel] + (dn)*emline_int2[:,sel]
+
+        sel = (ne > 3.) & (ne <= 4.)
+        dn = (ne[sel] - 3.)/(4. - 3.)
+        nebcomp[:,sel] = (1. - dn) * emline_int3[:,sel] + (dn) * emline_int4[:,sel]
+
+        sel = (ne <= 1.)
+        nebcomp[:,sel] = emline_int1[:,sel]
+
+        sel = (ne > 4.)
+        nebcomp[:,sel] = emline_int4[:,sel]
+
+        sel = ~((ne <= 4.) | (ne > 4.))
+        if sel.any():
+            print('log(ne)disk out of limits','log(ne)disk = {}'.format(ne[sel]))
+
+        nebline[comp][:,ind] = nebcomp
+
+    run_blocks(interpolate, get_blocks(lu, n_threads=n_threads), n_threads=n_threads)
 
     # check if there is an ongoing bulge with the masses
 
     return nebline
 
 
+def get_grid(photmod='gutkin16', verbose=True,
+             xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100,
+             xid_feltre=0.5,alpha_feltre=-1.7):
+    '''
+    Get the grids of emission lines of a photoionisation model,
+    reading its tables if they have not been read before
+    (see get_grid_Gutkin and get_grid_Feltre).
+
+    Parameters
+    ----------
+    photomod : string
+      Name of the considered photoionisation model.
+    xid_gutkin, co_gutkin, imf_cut_gutkin, xid_feltre, alpha_feltre : floats
+     Parameters of the photoionisation models (see get_lines).
+    verbose : boolean
+      If True print out messages
+
+    Returns
+    -------
+    grids : tuple of floats
+     Luminosity of the lines for each density, with shape (metallicity, U, line).
+    '''
+
+    if photmod not in const.photmods:
+        if verbose:
+            print('STOP (eml_photio.get_grid): Unrecognised model to get emission lines.')
+            print('                Possible photmod= {}'.format(const.photmods))
+        sys.exit()
+    elif (photmod == 'gutkin16'):
+        grids = get_grid_Gutkin(xid_gutkin=xid_gutkin,co_gutkin=co_gutkin,
+                                imf_cut_gutkin=imf_cut_gutkin,verbose=verbose)
+    elif (photmod == 'feltre16'):
+        grids = get_grid_Feltre(xid_feltre=xid_feltre,alpha_feltre=alpha_feltre,
+                                verbose=verbose)
+
+    return grids
+
 def get_lines(lu, lne, loh12, photmod='gutkin16', verbose=True,
               xid_gutkin=0.3,co_gutkin=1,imf_cut_gutkin=100,
-              xid_feltre=0.5,alpha_feltre=-1.7):
+              xid_feltre=0.5,alpha_feltre=-1.7,n_threads=1):
     '''
     Get the emission lines
 
@@ -679,6 +818,10 @@ def get_lines(lu, lne, loh12, photmod='gutkin16', verbose=True,
      Dust-to-metal ratio for the Feltre et. al. photoionisation model.
     alpha_feltre : float
      Alpha value for the Feltre et. al. photoionisation model.
+    n_threads : integer
+     Number of threads interpolating the lines, split by component and
+     block of galaxies. It is limited by the available CPUs and any
+     OpenMP or BLAS thread limit (see eml_io.get_nthreads).
     verbose : boolean
       If True print out messages
 
@@ -687,6 +830,8 @@ def get_lines(lu, lne, loh12, photmod='gutkin16', verbose=True,
     nebline : floats
      Array with the luminosity of the lines per component. Units depends on photmod.
     '''
+
+    n_threads = get_nthreads(n_threads)
     
     if photmod not in const.photmods:
         if verbose:
@@ -696,11 +841,13 @@ def get_lines(lu, lne, loh12, photmod='gutkin16', verbose=True,
     elif (photmod == 'gutkin16'):
         nebline = get_lines_Gutkin(lu,lne,loh12,
                 verbose=verbose,
-                xid_gutkin=xid_gutkin,co_gutkin=co_gutkin,imf_cut_gutkin=imf_cut_gutkin)
+                xid_gutkin=xid_gutkin,co_gutkin=co_gutkin,imf_cut_gutkin=imf_cut_gutkin,
+                n_threads=n_threads)
     elif (photmod == 'feltre16'):
         nebline = get_lines_Feltre(lu,lne,loh12,
                 verbose=verbose,
-                xid_feltre=xid_feltre,alpha_feltre=alpha_feltre)
+                xid_feltre=xid_feltre,alpha_feltre=alpha_feltre,
+                n_threads=n_threads)
 
     return nebline
 
@@ -0,0 +1,984 @@
+import os
+import re
+import sys
+import json
+import time
+import h5py
+import zipfile
+from itertools import islice
+import numpy as np
+import get_nebular_emission.eml_const as const
+from get_nebular_emission.eml_io import get_nheader, get_npy_column, get_parquet_file, \
+    get_parquet_rowgroups, read_parquet, get_galform_group, get_ncomponents, get_nthreads
+from get_nebular_emission.eml_photio import get_lines, get_limits, calculate_flux
+
+# Lines with only blank characters, not counted as rows
+blank_line = re.compile(rb'^[ \t\r]*\n', re.M)
+
+# Memory of the python process with numpy, h5py and the grids loaded (bytes)
+base_memory = 150e6
+
+def get_size(infile):
+    '''
+    Get the size in disk of an input subvolume.
+
+    Parameters
+    ----------
+    infile : string
+     Input file, or directory for the npy format.
+
+    Returns
+    -------
+    size : integer
+     Size in bytes.
+    '''
+
+    if os.path.isdir(infile):
+        return sum(os.path.getsize(os.path.join(infile, ff))
+                   for ff in os.listdir(infile))
+    return os.path.getsize(infile)
+
+def count_lines(infile, skip=0, blocksize=2**24):
+    '''
+    Count the lines of a text file that are not blank, reading it in blocks.
+
+    Parameters
+    ----------
+    infile : string
+     Input file.
+    skip : integer
+     Number of lines at the start of the file not counted (header).
+    blocksize : integer
+     Number of bytes read at a time.
+
+    Returns
+    -------
+    nlines : integer
+    '''
+
+    nlines = 0
+    tail = b''
+    with open(infile, 'rb') as ff:
+        for k in range(skip):
+            ff.readline()
+        while True:
+            block = ff.read(blocksize)
+            if not block:
+                break
+            # Complete lines, with the end of the previous block
+            block = tail + block
+            end = block.rfind(b'\n') + 1
+            tail = block[end:]
+            nlines += block.count(b'\n', 0, end) - len(blank_line.findall(block, 0, end))
+
+    # Last line without end of line character
+    if tail.strip():
+        nlines += 1
+
+    return nlines
+
+def count_rows(infile, col, inputformat='hdf5', testing=False):
+    '''
+    Get the number of galaxies in an input subvolume, without reading them.
+
+    Parameters
+    ----------
+    infile : string
+     Input file.
+    col : integer or string
+     Any column of the input file (position or name).
+    inputformat : string
+     Format of the input file.
+    testing : boolean
+     If True only run over few entries for testing purposes.
+
+    Returns
+    -------
+    nrows : integer
+    '''
+
+    if inputformat=='txt':
+        nrows = count_lines(infile, skip=get_nheader(infile))
+    elif inputformat=='hdf5':
+        with h5py.File(infile, 'r') as hf:
+            nrows = len(hf['data'][col])
+    elif inputformat=='galform':
+        with h5py.File(infile, 'r') as hf:
+            nrows = len(get_galform_group(hf, infile)[col])
+    elif inputformat=='npy':
+        nrows = len(get_npy_column(infile, col))
+    elif inputformat=='parquet':
+        nrows = get_parquet_file(infile).metadata.num_rows
+    else:
+        print('STOP (eml_plan): Unrecognised input format.',
+              'Possible input formats = {}'.format(const.inputformats))
+        sys.exit()
+
+    if testing:
+        nrows = min(nrows, 50)
+
+    return nrows
+
+def get_read_size(infile, cols, inputformat='hdf5'):
+    '''
+    Get the number of rows of an input subvolume and the size in disk
+    of the columns read from it (the whole file for text files).
+
+    Parameters
+    ----------
+    infile : string
+     Input file.
+    cols : list
+     Columns read (positions or names), None for unused entries.
+    inputformat : string
+     Format of the input file.
+
+    Returns
+    -------
+    nrows : integer
+     Number of rows in the file.
+    nbytes : integer
+     Size in bytes of the columns.
+    '''
+
+    cols = list(dict.fromkeys([col for col in cols if col is not None]))
+    nrows = count_rows(infile, cols[0], inputformat=inputformat)
+
+    if inputformat=='hdf5' or inputformat=='galform':
+        with h5py.File(infile, 'r') as hf:
+            if inputformat=='galform':
+                group = get_galform_group(hf, infile)
+            else:
+                group = hf['data']
+            nbytes = sum([group[col].id.get_storage_size() for col in cols])
+    elif inputformat=='npy':
+        if os.path.isdir(infile):
+            nbytes = sum([os.path.getsize(os.path.join(infile, col + '.npy')) for col in cols])
+        else:
+            with zipfile.ZipFile(infile) as zf:
+                nbytes = sum([zf.getinfo(col + '.npy').compress_size for col in cols])
+    elif inputformat=='parquet':
+        pf = get_parquet_file(infile)
+        icols = [pf.schema_arrow.get_field_index(col) for col in cols]
+        meta = pf.metadata
+        nbytes = sum([meta.row_group(rg).column(icol).total_compressed_size
+                      for rg in range(meta.num_row_groups) for icol in icols])
+    else:
+        nbytes = get_size(infile)
+
+    return nrows, int(nbytes)
+
+def get_cut(param, cut, mincut=None, maxcut=None):
+    '''
+    Apply a selection criteria to the galaxies.
+
+    Parameters
+    ----------
+    param : floats
+     Values of the parameter used for the selection.
+    cut : integers
+     Index of the galaxies selected so far.
+    mincut : float
+     All the galaxies below won't be considered.
+    maxcut : float
+     All the galaxies above won't be considered.
+
+    Returns
+    -------
+    cut : integers
+     Index of the selected galaxies.
+    '''
+
+    if mincut and maxcut:
+        cut = np.intersect1d(cut,np.where((mincut<param)&(param<maxcut))[0])
+    elif mincut:
+        cut = np.intersect1d(cut,np.where(mincut<param)[0])
+    elif maxcut:
+        cut = np.intersect1d(cut,np.where(param<maxcut)[0])
+
+    return cut
+
+def count_selected(infile, nrows, inputformat='hdf5', cutcols=[None],
+                   mincuts=[None], maxcuts=[None], exact=False, nsample=10000):
+    '''
+    Get the number of galaxies passing the selection criteria,
+    reading only the parameters used for the cuts.
+
+    Parameters
+    ----------
+    infile : string
+     Input file.
+    nrows : integer
+     Number of galaxies in the input file.
+    inputformat : string
+     Format of the input file.
+    cutcols : list
+     Parameters to look for cutting the data.
+    mincuts : floats
+     Minimum value of the parameter of cutcols in the same index.
+    maxcuts : floats
+     Maximum value of the parameter of cutcols in the same index.
+    exact : boolean
+     If False, text files are only sampled and the number of galaxies is extrapolated.
+    nsample : integer
+     Approximate number of galaxies read from text files when exact is False,
+     taken at regular intervals over the whole file.
+
+    Returns
+    -------
+    nsel : integer
+     Number of selected galaxies.
+    sampled : boolean
+     True if the number has been extrapolated from a sample.
+    '''
+
+    if not cutcols[0] and len(cutcols)==1:
+        return nrows, False
+
+    sampled = False
+    cut = np.arange(nrows)
+
+    if inputformat=='txt':
+        ih = get_nheader(infile)
+        step = 1
+        if not exact and nrows > nsample:
+            # One line every step, so sorted files are not biased
+            step = int(np.ceil(nrows/nsample))
+            sampled = True
+        cut = None
+        for i in range(len(cutcols)):
+            if cutcols[i] is not None:
+                with open(infile, 'r') as ff:
+                    param = np.loadtxt(islice(ff, ih, None, step), usecols=cutcols[i],
+                                       ndmin=1)[:nrows]
+                if cut is None:
+                    cut = np.arange(len(param))
+                cut = get_cut(param, cut, mincut=mincuts[i], maxcut=maxcuts[i])
+        if cut is None:
+            return nrows, False
+        if sampled:
+            return int(round(len(cut)*nrows/len(param))), sampled
+    elif inputformat=='hdf5' or inputformat=='galform':
+        with h5py.File(infile, 'r') as f:
+            if inputformat=='galform':
+                hf = get_galform_group(f, infile)
+            else:
+                hf = f['data']
+            for i in range(len(cutcols)):
+                if cutcols[i]:
+                    cut = get_cut(hf[cutcols[i]][:nrows], cut,
+                                  mincut=mincuts[i], maxcut=maxcuts[i])
+    elif inputformat=='npy':
+        for i in range(len(cutcols)):
+            if cutcols[i]:
+                cut = get_cut(get_npy_column(infile, cutcols[i])[:nrows], cut,
+                              mincut=mincuts[i], maxcut=maxcuts[i])
+    elif inputformat=='parquet':
+        pf = get_parquet_file(infile)
+        rowgroups, rowstart = get_parquet_rowgroups(pf, cutcols=cutcols, mincuts=mincuts,
+                                                    maxcuts=maxcuts, limit=nrows)
+        data, rows = read_parquet(pf, [col for col in cutcols if col], rowgroups, rowstart)
+        rows = rows[rows < nrows]
+        cut = np.arange(len(rows))
+        for i in range(len(cutcols)):
+            if cutcols[i]:
+                cut = get_cut(data[cutcols[i]][:len(rows)], cut,
+                              mincut=mincuts[i], maxcut=maxcuts[i])
+
+    return len(cut), sampled
+
+def get_nselected(infile, m_sfr_z, inputformat='hdf5', cutcols=[None],
+                  mincuts=[None], maxcuts=[None], testing=False):
+    '''
+    Get the number of galaxies passing the selection criteria in each subvolume,
+    reading only the parameters used for the cuts.
+
+    Parameters
+    ----------
+    infile : strings
+     List with the name of the input files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    inputformat : string
+     Format of the input file.
+    cutcols : list
+     Parameters to look for cutting the data.
+    mincuts : floats
+     Minimum value of the parameter of cutcols in the same index.
+    maxcuts : floats
+     Maximum value of the parameter of cutcols in the same index.
+    testing : boolean
+     If True only run over few entries for testing purposes.
+
+    Returns
+    -------
+    nsel : integers
+     Number of selected galaxies per subvolume.
+    '''
+
+    nsel = np.zeros(len(infile), dtype=int)
+    for i in range(len(infile)):
+        nrows = count_rows(infile[i], m_sfr_z[0][0], inputformat=inputformat, testing=testing)
+        nsel[i] = count_selected(infile[i], nrows, inputformat=inputformat, cutcols=cutcols,
+                                 mincuts=mincuts, maxcuts=maxcuts, exact=True)[0]
+
+    return nsel
+
+def get_secondary(att=False, att_params=None, Lagn_params=None, epsilon_params=None,
+                  extra_params=None, infile_z0=[None]):
+    '''
+    Get the lists of secondary parameters read from the input files.
+
+    Parameters
+    ----------
+    att : boolean
+     If True attenuation is calculated.
+    att_params : list
+     Parameters for the attenuation model.
+    Lagn_params : list
+     Inputs for AGN's bolometric luminosity calculations.
+    epsilon_params : list
+     Inputs for the calculation of the volume-filling factor.
+    extra_params : list
+     Parameters from the input files which will be saved in the output file.
+    infile_z0 : strings
+     List with the name of the input files with the galaxies at redshift 0.
+
+    Returns
+    -------
+    secondary : list
+     Non empty lists of parameters.
+    '''
+
+    secondary = [epsilon_params, Lagn_params, extra_params]
+    if att:
+        secondary.append(att_params)
+    if infile_z0[0]:
+        secondary.append(epsilon_params)
+
+    return [params for params in secondary if params]
+
+def get_nbytes_gal(ncomp, photmod_sfr='gutkin16', photmod_agn='feltre16',
+                   att=False, flux=False, AGN=False, nsecondary=0, n_threads=1):
+    '''
+    Estimate the memory needed per selected galaxy.
+
+    The galaxies are interpolated in blocks of a component at a time
+    (see eml_photio.get_blocks), with up to n_threads blocks, of
+    different components, interpolated at the same time.
+
+    Parameters
+    ----------
+    ncomp : integer
+     Number of components.
+    photmod_sfr : string
+     Photoionisation model for star-forming regions.
+    photmod_agn : string
+     Photoionisation model for AGNs.
+    att : boolean
+     If True attenuation is calculated.
+    flux : boolean
+     If True fluxes are calculated.
+    AGN : boolean
+     If True AGN emission is calculated.
+    nsecondary : integer
+     Number of secondary parameters read (epsilon, Lagn, attenuation and extra ones).
+    n_threads : integer
+     Number of threads interpolating the emission lines.
+
+    Returns
+    -------
+    nbytes : float
+     Bytes per selected galaxy at the peak of the calculation.
+    '''
+
+    # M*, sSFR, Z, and U, ne, Z (with copies) per component
+    nvals = 9*ncomp + nsecondary
+
+    # Intrinsic lines, with the attenuated ones and their coefficients,
+    # fluxes (intrinsic and attenuated) and one temporary array
+    nlines = ncomp*len(const.lines_model[photmod_sfr])
+    if AGN:
+        nvals += 7*ncomp + 1
+        nlines += ncomp*len(const.lines_model[photmod_agn])
+    nvals += nlines*(1 + 2*att + 3*flux*(1 + att))
+
+    # Interpolation of a block: the lines from the 4 grids, their
+    # combination and 2 temporary arrays, and 9 values per galaxy
+    # (grid indexes, distances, weights and ne), for as many components
+    # as blocks interpolated at the same time
+    nlines_int = 7*max(len(const.lines_model[photmod_sfr]),
+                       AGN*len(const.lines_model[photmod_agn])) + 9
+    nbytes = 8.*(nvals + min(n_threads, ncomp)*nlines_int)
+
+    return nbytes
+
+def get_nbytes_row(ncomp, inputformat='hdf5'):
+    '''
+    Estimate the memory needed per galaxy in the input file,
+    before the selection is applied.
+
+    Parameters
+    ----------
+    ncomp : integer
+     Number of components.
+    inputformat : string
+     Format of the input file.
+
+    Returns
+    -------
+    nbytes : float
+     Bytes per galaxy in the input file.
+    '''
+
+    # Index of the galaxies, one cut parameter and M*, SFR, Z per component
+    nvals = 2 + 3*ncomp
+    if inputformat=='txt':
+        # np.loadtxt reads M*, SFR, Z of one component at a time
+        nvals += 3
+
+    return 8.*nvals
+
+def calibrate(ncomp, ngal=200, photmod_sfr='gutkin16', photmod_agn='feltre16',
+              flux=False, AGN=False, redshift=0,
+              xid_feltre=0.5, alpha_feltre=-1.7,
+              xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100):
+    '''
+    Time the calculation of emission lines and fluxes for random galaxies
+    within the limits of the photoionisation models.
+
+    Parameters
+    ----------
+    ncomp : integer
+     Number of components.
+    ngal : integer
+     Number of galaxies used for the calibration.
+    photmod_sfr : string
+     Photoionisation model for star-forming regions.
+    photmod_agn : string
+     Photoionisation model for AGNs.
+    flux : boolean
+     If True fluxes are calculated.
+    AGN : boolean
+     If True AGN emission is calculated.
+    redshift : float
+     Redshift of the input data.
+
+    Returns
+    -------
+    calib : dictionary
+     Fixed time per subvolume, 'fixed' (s), and time per galaxy, 'per_gal' (s),
+     for each calibrated stage.
+    '''
+
+    rng = np.random.default_rng(0)
+
+    stages = [('lines_sfr', photmod_sfr)]
+    if AGN:
+        stages.append(('lines_agn', photmod_agn))
+
+    calib = {}
+    for stage, photmod in stages:
+        minU, maxU = get_limits(propname='U', photmod=photmod, verbose=False)
+        minnH, maxnH = get_limits(propname='nH', photmod=photmod, verbose=False)
+        minZ, maxZ = get_limits(propname='Z', photmod=photmod, verbose=False)
+
+        times = []
+        for ndat in [1, ngal]:
+            lu = rng.uniform(minU, maxU, (ndat, ncomp))
+            lne = rng.uniform(np.log10(minnH), np.log10(maxnH), (ndat, ncomp))
+            loh12 = np.log10(rng.uniform(minZ, maxZ, (ndat, ncomp)))
+
+            start = time.perf_counter()
+            nebline = get_lines(lu, lne, loh12, photmod=photmod, verbose=False,
+                                xid_gutkin=xid_gutkin, co_gutkin=co_gutkin,
+                                imf_cut_gutkin=imf_cut_gutkin,
+                                xid_feltre=xid_feltre, alpha_feltre=alpha_feltre)
+            tlines = time.perf_counter() - start
+
+            tflux = 0.
+            if flux:
+                start = time.perf_counter()
+                calculate_flux(nebline*1e40, redshift, h0=const.h, origin='sfr')
+                tflux = time.perf_counter() - start
+            times.append([tlines, tflux])
+
+        for j, name in enumerate([stage, stage.replace('lines', 'flux')]):
+            per_gal = max((times[1][j] - times[0][j])/(ngal - 1), 0.)
+            calib[name] = {'fixed': max(times[0][j] - per_gal, 0.), 'per_gal': per_gal}
+
+    return calib
+
+def get_tasks(isubs, infile, col, n_workers, inputformat='hdf5',
+              window_rows=None, testing=False):
+    '''
+    Split the subvolumes into tasks for parallel workers, ordered by
+    decreasing estimated cost (size in disk), so the largest subvolumes
+    are not left running at the end. Subvolumes larger than an even share
+    of the work per worker are split into row windows.
+
+    Parameters
+    ----------
+    isubs : integers
+     Indexes of the subvolumes to be calculated.
+    infile : strings
+     List with the name of the input files.
+    col : integer or string
+     Any column of the input files (position or name).
+    n_workers : integer
+     Number of parallel workers.
+    inputformat : string
+     Format of the input files.
+    window_rows : integer
+     If not None, maximum number of rows per task, instead of the even share.
+    testing : boolean
+     If True only run over few entries for testing purposes.
+
+    Returns
+    -------
+    windows : dictionary
+     For each subvolume, list of [start, stop) row windows, or [None] if it is not split.
+    order : list
+     (subvolume, window) pairs in the order in which they should be calculated.
+    '''
+
+    sizes = {i: float(get_size(infile[i])) for i in isubs}
+    share = sum(sizes.values())/n_workers
+
+    windows = {}
+    tasks = []
+    for i in isubs:
+        nwin = 1
+        if window_rows is not None or sizes[i] > share:
+            nrows = count_rows(infile[i], col, inputformat=inputformat, testing=testing)
+            if window_rows is not None:
+                nwin = int(np.ceil(nrows/window_rows))
+            else:
+                nwin = int(np.ceil(sizes[i]/share))
+            nwin = max(1, min(nwin, nrows))
+
+        if nwin == 1:
+            windows[i] = [None]
+        else:
+            edges = np.linspace(0, nrows, nwin+1).astype(int)
+            windows[i] = [[int(edges[j]), int(edges[j+1])] for j in range(nwin)]
+
+        for j in range(nwin):
+            tasks.append((sizes[i]/nwin, i, j))
+
+    # Largest first, in the order of infile for equal costs
+    tasks.sort(key=lambda task: -task[0])
+    order = [(i, j) for cost, i, j in tasks]
+
+    return windows, order
+
+def time_read(infile, col, nrows, inputformat='hdf5', nsample=2000):
+    '''
+    Time the reading of one column of an input subvolume.
+
+    Parameters
+    ----------
+    infile : string
+     Input file.
+    col : integer or string
+     Column to be read (position or name).
+    nrows : integer
+     Number of galaxies in the input file.
+    inputformat : string
+     Format of the input file.
+    nsample : integer
+     Number of rows read from text files.
+
+    Returns
+    -------
+    per_row : float
+     Time to read the column per galaxy (s).
+    '''
+
+    start = time.perf_counter()
+    if inputformat=='txt':
+        nrows = min(nrows, nsample)
+        np.loadtxt(infile, usecols=col, skiprows=get_nheader(infile), max_rows=nrows)
+    elif inputformat=='hdf5':
+        with h5py.File(infile, 'r') as hf:
+            hf['data'][col][:]
+    elif inputformat=='galform':
+        with h5py.File(infile, 'r') as hf:
+            get_galform_group(hf, infile)[col][:]
+    elif inputformat=='npy':
+        np.array(get_npy_column(infile, col))
+    elif inputformat=='parquet':
+        get_parquet_file(infile).read(columns=[col])
+
+    return (time.perf_counter() - start)/max(nrows, 1)
+
+def get_plan(infile, m_sfr_z, inputformat='hdf5',
+             cutcols=[None], mincuts=[None], maxcuts=[None],
+             att=False, att_params=None, flux=False, redshift=0,
+             AGN=False, Lagn_params=None, epsilon_params=None, extra_params=None,
+             infile_z0=[None], photmod_sfr='gutkin16', photmod_agn='feltre16',
+             xid_feltre=0.5, alpha_feltre=-1.7,
+             xid_gutkin=0.3, co_gutkin=1, imf_cut_gutkin=100, n_threads=1,
+             testing=False, plan_file=None, verbose=True):
+    '''
+    Estimate the peak memory and the time needed for each subvolume,
+    without calculating any emission line.
+
+    Parameters
+    ----------
+    infile : strings
+     List with the name of the input files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    inputformat : string
+     Format of the input file.
+    cutcols : list
+     Parameters to look for cutting the data.
+    mincuts : floats
+     Minimum value of the parameter of cutcols in the same index.
+    maxcuts : floats
+     Maximum value of the parameter of cutcols in the same index.
+    att : boolean
+     If True attenuation is calculated.
+    att_params : list
+     Parameters for the attenuation model.
+    flux : boolean
+     If True fluxes are calculated.
+    redshift : float
+     Redshift of the input data.
+    AGN : boolean
+     If True AGN emission is calculated.
+    Lagn_params : list
+     Inputs for AGN's bolometric luminosity calculations.
+    epsilon_params : list
+     Inputs for the calculation of the volume-filling factor.
+    extra_params : list
+     Parameters from the input files which will be saved in the output file.
+    infile_z0 : strings
+     List with the name of the input files with the galaxies at redshift 0.
+    photmod_sfr : string
+     Photoionisation model for star-forming regions.
+    photmod_agn : string
+     Photoionisation model for AGNs.
+    n_threads : integer
+     Number of threads interpolating the emission lines (0 for as many as CPUs available).
+    testing : boolean
+     If True only run over few entries for testing purposes.
+    plan_file : string
+     If not None, name of the JSON file where the plan is written.
+    verbose : boolean
+     If True print out messages.
+
+    Returns
+    -------
+    plan : dictionary
+     Calibration, estimates per subvolume and totals.
+    '''
+
+    ncomp = get_ncomponents(m_sfr_z)
+
+    secondary = get_secondary(att=att, att_params=att_params, Lagn_params=Lagn_params,
+                              epsilon_params=epsilon_params, extra_params=extra_params,
+                              infile_z0=infile_z0)
+    nsecondary = sum([len(params) for params in secondary])
+
+    # Number of times the input file is read
+    nreads = 1 + len([col for col in cutcols if col is not None]) + len(secondary)
+    if inputformat=='txt':
+        nreads += ncomp
+    else:
+        # Columns are read one by one
+        nreads += 3*ncomp - 1 + nsecondary - len(secondary)
+
+    nbytes_gal = get_nbytes_gal(ncomp, photmod_sfr=photmod_sfr, photmod_agn=photmod_agn,
+                                att=att, flux=flux, AGN=AGN, nsecondary=nsecondary,
+                                n_threads=get_nthreads(n_threads))
+    nbytes_row = get_nbytes_row(ncomp, inputformat=inputformat)
+
+    calib = calibrate(ncomp, photmod_sfr=photmod_sfr, photmod_agn=photmod_agn,
+                      flux=flux, AGN=AGN, redshift=redshift,
+                      xid_feltre=xid_feltre, alpha_feltre=alpha_feltre,
+                      xid_gutkin=xid_gutkin, co_gutkin=co_gutkin,
+                      imf_cut_gutkin=imf_cut_gutkin)
+
+    subvols = []
+    tread = None
+    for i in range(len(infile)):
+        nrows = count_rows(infile[i], m_sfr_z[0][0], inputformat=inputformat, testing=testing)
+        nsel, sampled = count_selected(infile[i], nrows, inputformat=inputformat,
+                                       cutcols=cutcols, mincuts=mincuts, maxcuts=maxcuts)
+        if tread is None:
+            tread = time_read(infile[i], m_sfr_z[0][0], nrows, inputformat=inputformat)
+
+        memory = base_memory + nrows*nbytes_row + nsel*nbytes_gal
+
+        runtime = nreads*nrows*tread
+        for stage in calib:
+            if stage.startswith('flux'):
+                # Intrinsic and attenuated fluxes
+                runtime += (1 + att)*(calib[stage]['fixed'] + nsel*calib[stage]['per_gal'])
+            else:
+                runtime += calib[stage]['fixed'] + nsel*calib[stage]['per_gal']
+
+        subvols.append({'infile': infile[i], 'size': get_size(infile[i]),
+                        'nrows': nrows, 'nselected': nsel, 'sampled': sampled,
+                        'memory': memory, 'time': runtime})
+
+    plan = {'options': {'inputformat': inputformat, 'ncomp': ncomp,
+                        'att': att, 'flux': flux, 'AGN': AGN,
+                        'nlines_sfr': len(const.lines_model[photmod_sfr]),
+                        'nlines_agn': AGN*len(const.lines_model[photmod_agn]),
+                        'nsecondary': nsecondary},
+            'calibration': calib,
+            'bytes_per_row': nbytes_row,
+            'bytes_per_galaxy': nbytes_gal,
+            'subvolumes': subvols,
+            'peak_memory': max([sub['memory'] for sub in subvols]) if subvols else 0,
+            'total_time': sum([sub['time'] for sub in subvols])}
+
+    if verbose:
+        print_plan(plan)
+
+    if plan_file:
+        with open(plan_file, 'w') as ff:
+            json.dump(plan, ff, indent=1)
+        if verbose:
+            print('Plan written in ' + plan_file)
+
+    return plan
+
+def print_plan(plan):
+    '''
+    Print out the estimates for each subvolume as a table.
+
+    Parameters
+    ----------
+    plan : dictionary
+     Output of get_plan.
+    '''
+
+    print('{:>6} {:>10} {:>12} {:>12} {:>12} {:>10}  {}'.format(
+        'Subvol', 'Size(MB)', 'Rows', 'Selected', 'Memory(MB)', 'Time(s)', 'Infile'))
+    for i, sub in enumerate(plan['subvolumes']):
+        nsel = str(sub['nselected'])
+        if sub['sampled']:
+            nsel = '~' + nsel
+        print('{:>6} {:>10.1f} {:>12} {:>12} {:>12.1f} {:>10.1f}  {}'.format(
+            i+1, sub['size']/1e6, sub['nrows'], nsel, sub['memory']/1e6,
+            sub['time'], sub['infile']))
+    print('Peak memory per worker: {:.1f} MB'.format(plan['peak_memory']/1e6))
+    print('Total time: {:.1f} s'.format(plan['total_time']))
+
+def parse_memory(memory):
+    '''
+    Get a memory size in bytes.
+
+    Parameters
+    ----------
+    memory : string or float
+     Size with units (e.g. '16GB', '512 MiB') or number of bytes.
+
+    Returns
+    -------
+    nbytes : float
+    '''
+
+    if isinstance(memory, (int, float, np.integer, np.floating)):
+        return float(memory)
+
+    value = str(memory).strip().upper()
+    units = 'B'
+    for unit in sorted(const.memory_units, key=len, reverse=True):
+        if value.endswith(unit):
+            value, units = value[:-len(unit)].strip(), unit
+            break
+    try:
+        nbytes = float(value)*const.memory_units[units]
+    except ValueError:
+        nbytes = -1.
+    if nbytes <= 0:
+        print('STOP (eml_plan.parse_memory): Unrecognised memory size {}.'.format(memory),
+              'Possible units = {}'.format(list(const.memory_units)))
+        sys.exit()
+
+    return nbytes
+
+def get_task_memory(n_workers, window_rows, nbytes_row, nbytes_gal, write_queue=0):
+    '''
+    Estimate the peak memory of a run, with all the subvolumes
+    calculated in row windows.
+
+    Each window reads only its own rows of the input file. With parallel
+    workers, the main process holds the results of up to n_workers+1
+    windows waiting to be written.
+
+    Parameters
+    ----------
+    n_workers : integer
+     Number of processes calculating windows.
+    window_rows : integer
+     Maximum number of input rows per window.
+    nbytes_row : float
+     Bytes per galaxy in the input file (see get_nbytes_row).
+    nbytes_gal : float
+     Bytes per selected galaxy (see get_nbytes_gal).
+    write_queue : integer
+     Number of windows waiting for the writer thread.
+
+    Returns
+    -------
+    memory : float
+     Estimated peak memory (bytes).
+    '''
+
+    task = window_rows*(nbytes_row + nbytes_gal)
+    waiting = write_queue*window_rows*nbytes_gal
+    if n_workers > 1:
+        waiting += (n_workers + 1)*window_rows*nbytes_gal
+        return base_memory + n_workers*(base_memory + task) + waiting
+    return base_memory + task + waiting
+
+def get_memory_plan(isubs, infile, m_sfr_z, max_memory, n_workers=1, window_rows=None,
+                    inputformat='hdf5', att=False, att_params=None, flux=False,
+                    AGN=False, Lagn_params=None, epsilon_params=None, extra_params=None,
+                    infile_z0=[None], photmod_sfr='gutkin16', photmod_agn='feltre16',
+                    write_queue=0, n_threads=1, testing=False, verbose=True):
+    '''
+    Choose the number of parallel workers and the size of the row windows
+    keeping the estimated peak memory within a budget, also for the largest
+    subvolume. The number of workers is reduced only when the windows would
+    otherwise be smaller than const.min_window_rows.
+
+    Parameters
+    ----------
+    isubs : integers
+     Indexes of the subvolumes to be calculated.
+    infile : strings
+     List with the name of the input files.
+    m_sfr_z : list
+     [[component1_stellar_mass,sfr/LC,Z],[component2_stellar_mass,sfr/LC,Z],...]
+    max_memory : string or float
+     Memory budget, with units (e.g. '16GB') or in bytes.
+    n_workers : integer
+     Maximum number of parallel workers (0 for as many as CPUs available).
+    window_rows : integer
+     If not None, maximum number of input rows per window.
+    inputformat : string
+     Format of the input file.
+    att, att_params, flux, AGN, Lagn_params, epsilon_params, extra_params, infile_z0 :
+     As in get_plan.
+    photmod_sfr : string
+     Photoionisation model for star-forming regions.
+    photmod_agn : string
+     Photoionisation model for AGNs.
+    write_queue : integer
+     Number of subvolumes waiting for the writer thread.
+    n_threads : integer
+     Number of threads interpolating the emission lines in each worker
+     (0 for as many as CPUs available).
+    testing : boolean
+     If True only run over few entries for testing purposes.
+    verbose : boolean
+     If True print out messages.
+
+    Returns
+    -------
+    memory_plan : dictionary
+     Budget ('max_memory'), number of workers ('n_workers'), maximum rows
+     per window ('window_rows', None if the subvolumes are not split),
+     largest subvolume ('max_rows'), bytes per input row and per selected
+     galaxy, and estimated peak memory ('memory'), in bytes.
+    '''
+
+    budget = parse_memory(max_memory)
+    ncomp = get_ncomponents(m_sfr_z)
+    nsecondary = sum([len(params) for params in get_secondary(
+        att=att, att_params=att_params, Lagn_params=Lagn_params,
+        epsilon_params=epsilon_params, extra_params=extra_params, infile_z0=infile_z0)])
+
+    nbytes_gal = get_nbytes_gal(ncomp, photmod_sfr=photmod_sfr, photmod_agn=photmod_agn,
+                                att=att, flux=flux, AGN=AGN, nsecondary=nsecondary,
+                                n_threads=get_nthreads(n_threads))
+    nbytes_row = get_nbytes_row(ncomp, inputformat=inputformat)
+
+    max_rows = max([count_rows(infile[i], m_sfr_z[0][0], inputformat=inputformat,
+                               testing=testing) for i in isubs] + [1])
+    max_window = max_rows if window_rows is None else min(window_rows, max_rows)
+
+    # Largest window that fits the budget with each number of workers,
+    # up to the number of rows of the largest subvolume
+    def get_rows(nwork):
+        fixed = get_task_memory(nwork, 0, nbytes_row, nbytes_gal)
+        per_row = get_task_memory(nwork, 1, nbytes_row, nbytes_gal,
+                                  write_queue=write_queue) - fixed
+        return min(int((budget - fixed)/per_row), max_window)
+
+    max_workers = get_nthreads(n_workers)
+    nwork = max_workers
+    while nwork > 1 and get_rows(nwork) < min(const.min_window_rows, max_window):
+        nwork -= 1
+    rows = get_rows(nwork)
+
+    if rows < 1:
+        print('STOP (eml_plan.get_memory_plan): The memory budget, {:.1f} MB,'.format(budget/1e6),
+              'is below the {:.1f} MB needed for windows of one row.'.format(
+                  get_task_memory(1, 1, nbytes_row, nbytes_gal)/1e6))
+        sys.exit()
+
+    memory_plan = {'max_memory': budget, 'n_workers': nwork,
+                   'window_rows': rows if rows < max_rows else None,
+                   'max_rows': max_rows, 'bytes_per_row': nbytes_row,
+                   'bytes_per_galaxy': nbytes_gal,
+                   'memory': get_task_memory(nwork, rows, nbytes_row, nbytes_gal,
+                                             write_queue=write_queue)}
+
+    if verbose:
+        print_memory_plan(memory_plan)
+
+    return memory_plan
+
+def get_peak_memory():
+    '''
+    Get the observed peak memory (maximum resident set size) of the
+    process and of its largest finished child process (the parallel workers).
+
+    Returns
+    -------
+    peak : dictionary
+     Peak memory of the main process ('main') and of the largest worker
+     ('workers'), in bytes. None if it cannot be measured in this system.
+    '''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # ru_maxrss is given in bytes in macOS and in kilobytes in Linux
+    scale = 1 if sys.platform=='darwin' else 1024
+    return {'main': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale,
+            'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale}
+
+def print_memory_plan(memory_plan):
+    '''
+    Print out the plan chosen for a memory budget and, if present,
+    the observed peak memory.
+
+    Parameters
+    ----------
+    memory_plan : dictionary
+     Output of get_memory_plan.
+    '''
+
+    window_rows = memory_plan['window_rows']
+    print('Memory budget: {:.1f} MB, {} worker(s), {} rows per window,'.format(
+        memory_plan['max_memory']/1e6, memory_plan['n_workers'],
+        'all the' if window_rows is None else window_rows),
+          'estimated peak: {:.1f} MB'.format(memory_plan['memory']/1e6))
+    peak = memory_plan.get('peak_memory')
+    if peak:
+        if memory_plan['n_workers'] > 1:
+            print('Observed peak memory: {:.1f} MB (main process),'.format(peak['main']/1e6),
+                  '{:.1f} MB (largest worker)'.format(peak['workers']/1e6))
+        else:
+            print('Observed peak memory: {:.1f} MB'.format(peak['main']/1e6))
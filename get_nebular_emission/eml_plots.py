@@ -8,7 +8,7 @@ import matplotlib.gridspec as gridspec
 import get_nebular_emission.eml_style as style
 from get_nebular_emission.stats import perc_2arrays
 import get_nebular_emission.eml_const as const
-from get_nebular_emission.eml_io import get_nheader, check_file
+from get_nebular_emission.eml_io import get_nheader, check_file, read_line, get_format_version
 from get_nebular_emission.eml_photio import get_lines_Gutkin, get_limits
 from numpy import random
 from scipy.stats import gaussian_kde
@@ -274,11 +274,11 @@ def test_sfrf(inputdata, outplot, obsSFR=None, obsGSM=None, colsSFR=[0,1,2,3],
 
         with h5py.File(inputdata[ii],'r') as file:
             data = file['data']          
-            lms = np.log10((10**data['lms'][:,0])/const.IMF_M['Chabrier']+10**data['lms'][:,1]*const.IMF_M['Top-heavy']/const.IMF_M['Chabrier']) #+ np.log10(h0)
+            lms = np.log10((10**data['lms'][0])/const.IMF_M['Chabrier']+10**data['lms'][1]*const.IMF_M['Top-heavy']/const.IMF_M['Chabrier']) #+ np.log10(h0)
             if specific:
-                lsfr = np.log10(10**data['lssfr'][:,0]+10**data['lssfr'][:,1]) + 9
+                lsfr = np.log10(10**data['lssfr'][0]+10**data['lssfr'][1]) + 9
             else: 
-                lsfr = np.log10(10**data['lssfr'][:,0]+10**data['lssfr'][:,1]) + lms
+                lsfr = np.log10(10**data['lssfr'][0]+10**data['lssfr'][1]) + lms
                 lsfr = lsfr/const.IMF_SFR['Chabrier']
             # lms = lms + np.log10(h0)     
             del data
@@ -446,39 +446,39 @@ def test_medians(infile, outplot, lines_cut=0, r_cut=999 ,i_cut=999 ,k_cut=999,
         with h5py.File(infile,'r') as file:
             f = file['data']
             
-            lu = f['lu_sfr'][:,0]
-            lne = f['lne_sfr'][:,0]
+            lu = f['lu_sfr'][0]
+            lne = f['lne_sfr'][0]
             
-            lus = [f['lu_sfr'][:,0],f['lu_sfr'][:,1],f['lu_agn'][:,0]]
-            lnes = [f['lne_sfr'][:,0],f['lne_sfr'][:,1]]
-            lms = np.log10(10**f['lms'][:,0] + 10**f['lms'][:,1])
+            lus = [f['lu_sfr'][0],f['lu_sfr'][1],f['lu_agn'][0]]
+            lnes = [f['lne_sfr'][0],f['lne_sfr'][1]]
+            lms = np.log10(10**f['lms'][0] + 10**f['lms'][1])
             
-            Ha_flux_sfr = np.sum(f['Halpha_sfr_flux'],axis=0)
-            Ha_flux_agn = np.sum(f['Halpha_agn_flux'],axis=0)
+            Ha_flux_sfr = np.sum(read_line(f,'Halpha_sfr_flux'),axis=0)
+            Ha_flux_agn = np.sum(read_line(f,'Halpha_agn_flux'),axis=0)
             Ha_flux = Ha_flux_sfr + Ha_flux_agn
             
-            Hb_flux_sfr = np.sum(f['Hbeta_sfr_flux'],axis=0)
-            Hb_flux_agn = np.sum(f['Hbeta_agn_flux'],axis=0)
+            Hb_flux_sfr = np.sum(read_line(f,'Hbeta_sfr_flux'),axis=0)
+            Hb_flux_agn = np.sum(read_line(f,'Hbeta_agn_flux'),axis=0)
             Hb_flux = Hb_flux_sfr + Hb_flux_agn
             
-            NII6548_flux_sfr = np.sum(f['NII6584_sfr_flux'],axis=0)
-            NII6548_flux_agn = np.sum(f['NII6584_agn_flux'],axis=0)
+            NII6548_flux_sfr = np.sum(read_line(f,'NII6584_sfr_flux'),axis=0)
+            NII6548_flux_agn = np.sum(read_line(f,'NII6584_agn_flux'),axis=0)
             NII6548_flux = NII6548_flux_sfr + NII6548_flux_agn
             
-            OII3727_flux_sfr = np.sum(f['OII3727_sfr_flux'],axis=0)
-            OII3727_flux_agn = np.sum(f['OII3727_agn_flux'],axis=0)
+            OII3727_flux_sfr = np.sum(read_line(f,'OII3727_sfr_flux'),axis=0)
+            OII3727_flux_agn = np.sum(read_line(f,'OII3727_agn_flux'),axis=0)
             OII3727_flux = OII3727_flux_sfr + OII3727_flux_agn
             
-            OIII5007_flux_sfr = np.sum(f['OIII5007_sfr_flux'],axis=0)
-            OIII5007_flux_agn = np.sum(f['OIII5007_agn_flux'],axis=0)
+            OIII5007_flux_sfr = np.sum(read_line(f,'OIII5007_sfr_flux'),axis=0)
+            OIII5007_flux_agn = np.sum(read_line(f,'OIII5007_agn_flux'),axis=0)
             OIII5007_flux = OIII5007_flux_sfr + OIII5007_flux_agn
             
-            SII6731_flux_sfr = np.sum(f['SII6731_sfr_flux'],axis=0)
-            SII6731_flux_agn = np.sum(f['SII6731_agn_flux'],axis=0)
+            SII6731_flux_sfr = np.sum(read_line(f,'SII6731_sfr_flux'),axis=0)
+            SII6731_flux_agn = np.sum(read_line(f,'SII6731_agn_flux'),axis=0)
             SII6731_flux = SII6731_flux_sfr + SII6731_flux_agn
             
-            SII6717_flux_sfr = np.sum(f['SII6717_sfr_flux'],axis=0)
-            SII6717_flux_agn = np.sum(f['SII6717_agn_flux'],axis=0)
+            SII6717_flux_sfr = np.sum(read_line(f,'SII6717_sfr_flux'),axis=0)
+            SII6717_flux_agn = np.sum(read_line(f,'SII6717_agn_flux'),axis=0)
             SII6731_flux = SII6731_flux + SII6717_flux_sfr + SII6717_flux_agn
             
             r = f['m_R'][0]
@@ -583,10 +583,16 @@ def test_bpt(infile, outplot, photmod='gutkin16', plot_phot=False, create_file=F
         check_file(infile[num], verbose=True)
         f = h5py.File(infile[num], 'r')
         data = f['data']
+
+        # Properties as (ncomp, ngal), also for files with the galaxies first
+        def read_props(name):
+            if get_format_version(f) < 2:
+                return data[name][:].T
+            return data[name][:]
     
-        lu_disk = data['lu'][:,0]
-        lne_disk = data['lne'][:,0]
-        loh12_disk = data['lz'][:,0]
+        lu_disk = read_props('lu')[0]
+        lne_disk = read_props('lne')[0]
+        loh12_disk = read_props('lz')[0]
         
         minU, maxU = get_limits(propname='U', photmod=photmod)
         minnH, maxnH = get_limits(propname='nH', photmod=photmod)
@@ -606,13 +612,13 @@ def test_bpt(infile, outplot, photmod='gutkin16', plot_phot=False, create_file=F
         SII6717_6731 = np.sum(data['SII6731'],axis=0)[ind]
         OII3727 = np.sum(data['OII3727'],axis=0)[ind]
         
-        lz = data['lz'][:,0]
+        lz = read_props('lz')[0]
         lz = lz[ind]
         
-        lssfr = data['lssfr'][:,0]
+        lssfr = read_props('lssfr')[0]
         lssfr = lssfr[ind]
         
-        lms = np.log10(10**data['lms'][:,0] + 10**data['lms'][:,1])
+        lms = np.log10(10**read_props('lms')[0] + 10**read_props('lms')[1])
         lms = lms[ind]
         
         ind2 = np.where((Hbeta>0)&(OIII5007>0)&(NII6548>0)&(Halpha>0)&(SII6717_6731>0)&(OII3727>0))[0]
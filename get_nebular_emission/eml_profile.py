@@ -0,0 +1,193 @@
+import json
+import time
+from contextlib import contextmanager
+import numpy as np
+
+class Profile():
+    '''
+    Wall and CPU time, galaxies and bytes for each stage of the calculation,
+    accumulated over the subvolumes.
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.subvolumes = []
+        self.start = time.perf_counter()
+
+    def add(self, name, wall, cpu, rows_in=0, rows_out=0, bytes_read=0, bytes_written=0):
+        '''
+        Add a call to a stage.
+
+        Parameters
+        ----------
+        name : string
+         Name of the stage.
+        wall : float
+         Wall time (s).
+        cpu : float
+         CPU time of the thread running the stage (s).
+        rows_in : integer
+         Number of galaxies (or input rows) going into the stage.
+        rows_out : integer
+         Number of galaxies coming out of the stage.
+        bytes_read : integer
+         Bytes read from disk.
+        bytes_written : integer
+         Bytes handed to the output file (before compression).
+        '''
+
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'wall': 0., 'cpu': 0.,
+                                 'rows_in': 0, 'rows_out': 0,
+                                 'bytes_read': 0, 'bytes_written': 0}
+        record = self.stages[name]
+        record['calls'] += 1
+        record['wall'] += wall
+        record['cpu'] += cpu
+        record['rows_in'] += int(rows_in)
+        record['rows_out'] += int(rows_out)
+        record['bytes_read'] += int(bytes_read)
+        record['bytes_written'] += int(bytes_written)
+
+    def add_subvolume(self, infile, ngal, wall):
+        '''
+        Add the totals of a subvolume.
+
+        Parameters
+        ----------
+        infile : string
+         Input file of the subvolume.
+        ngal : integer
+         Number of galaxies written.
+        wall : float
+         Wall time since the subvolume was started (s).
+        '''
+
+        self.subvolumes.append({'infile': str(infile), 'ngal': int(ngal), 'wall': wall})
+
+    def merge(self, other):
+        '''
+        Add the stages of another Profile, for example from a worker process.
+
+        Parameters
+        ----------
+        other : Profile
+        '''
+
+        for name in other.stages:
+            record = other.stages[name]
+            self.add(name, record['wall'], record['cpu'],
+                     rows_in=record['rows_in'], rows_out=record['rows_out'],
+                     bytes_read=record['bytes_read'], bytes_written=record['bytes_written'])
+            self.stages[name]['calls'] += record['calls'] - 1
+
+    def get_report(self):
+        '''
+        Get the timing report, with the throughput of each stage.
+
+        Returns
+        -------
+        report : dictionary
+         Stages, subvolumes and totals.
+        '''
+
+        wall = time.perf_counter() - self.start
+        ngal = sum([sub['ngal'] for sub in self.subvolumes])
+
+        stages = {}
+        for name in self.stages:
+            record = dict(self.stages[name])
+            record['gal_per_s'] = record['rows_in']/record['wall'] if record['wall'] > 0 else 0.
+            stages[name] = record
+
+        report = {'stages': stages,
+                  'subvolumes': self.subvolumes,
+                  'ngal': ngal,
+                  'wall': wall,
+                  'gal_per_s': ngal/wall if wall > 0 else 0.}
+        return report
+
+    def print_report(self):
+        '''
+        Print out the timing report as a table.
+        '''
+
+        report = self.get_report()
+        print('{:<22} {:>6} {:>10} {:>10} {:>10} {:>10} {:>11} {:>9} {:>9}'.format(
+            'Stage', 'Calls', 'Wall(s)', 'CPU(s)', 'Rows in', 'Rows out',
+            'Gal/s', 'Read(MB)', 'Write(MB)'))
+        for name in report['stages']:
+            record = report['stages'][name]
+            print('{:<22} {:>6} {:>10.2f} {:>10.2f} {:>10} {:>10} {:>11.1f} {:>9.1f} {:>9.1f}'.format(
+                name, record['calls'], record['wall'], record['cpu'],
+                record['rows_in'], record['rows_out'], record['gal_per_s'],
+                record['bytes_read']/1e6, record['bytes_written']/1e6))
+        print('Galaxies: {}, total time: {:.2f} s, {:.1f} galaxies/s'.format(
+            report['ngal'], report['wall'], report['gal_per_s']))
+
+    def write_report(self, profile_file):
+        '''
+        Write the timing report in a JSON file.
+
+        Parameters
+        ----------
+        profile_file : string
+         Name of the JSON file.
+        '''
+
+        with open(profile_file, 'w') as ff:
+            json.dump(self.get_report(), ff, indent=1)
+
+@contextmanager
+def stage(profile, name, rows_in=0, bytes_read=0, bytes_written=0):
+    '''
+    Time a stage of the calculation, adding it to profile.
+    The yielded dictionary can be updated with the counts known at the end
+    of the stage (rows_out defaults to rows_in).
+
+    Parameters
+    ----------
+    profile : Profile
+     If None, nothing is recorded.
+    name : string
+     Name of the stage.
+    rows_in : integer
+     Number of galaxies going into the stage.
+    bytes_read : integer
+     Bytes read from disk.
+    bytes_written : integer
+     Bytes handed to the output file.
+    '''
+
+    counts = {'rows_in': rows_in, 'rows_out': rows_in,
+              'bytes_read': bytes_read, 'bytes_written': bytes_written}
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    yield counts
+    if profile is not None:
+        profile.add(name, time.perf_counter() - wall, time.thread_time() - cpu, **counts)
+
+def get_nbytes(values):
+    '''
+    Get the number of bytes of the arrays in a dictionary or list.
+
+    Parameters
+    ----------
+    values : dictionary or list
+     Arrays, lists of arrays or other objects (not counted).
+
+    Returns
+    -------
+    nbytes : integer
+    '''
+
+    if isinstance(values, dict):
+        values = list(values.values())
+    nbytes = 0
+    for val in values:
+        if isinstance(val, np.ndarray):
+            if val.dtype != object:
+                nbytes += val.nbytes
+        elif isinstance(val, (list, tuple)):
+            nbytes += get_nbytes(val)
+    return nbytes
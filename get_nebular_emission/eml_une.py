@@ -964,11 +964,8 @@ def get_une_kashino20(Q, lms, lssfr, loh12, T, ng_ratio, IMF_f):
     
     lssfr_new = np.full(np.shape(lssfr),const.notnum)
     for comp in range(lssfr.shape[1]):
-        for i in range(lssfr.shape[0]):
-            if Q[i,comp] == 0:
-                continue
-            else:
-                lssfr_new[i,comp] = np.log10(Q[i,comp]/(const.IMF_SFR[IMF_f[comp]] * const.phot_to_sfr_kenn)) - lms[i,comp]
+        ind = np.where(Q[:,comp] != 0)[0]
+        lssfr_new[ind,comp] = np.log10(Q[ind,comp]/(const.IMF_SFR[IMF_f[comp]] * const.phot_to_sfr_kenn)) - lms[ind,comp]
 
     ind = np.where((lssfr_new > const.notnum) &
                    (lms > 0) &
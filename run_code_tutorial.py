@@ -69,9 +69,23 @@ redshift = 0.15
 
 
 ### INPUT FORMAT
-# The code can work with text files (.txt, .dat, .csv...) or with HDF5 files.
+# The code can work with text files (.txt, .dat, .csv...), with HDF5 files,
+    # with NumPy arrays or with Parquet files.
 # If your input files are text files: inputformat = 'txt'
 # If your input files are HDF5 files: inputformat = 'hdf5'
+# If each subvolume is a directory with one NumPy file per column 
+    # (<name>.npy), or a single .npz file: inputformat = 'npy'
+    # The columns are then given by name, as for HDF5 files, and they are
+    # memory mapped instead of read.
+# If your input files are Parquet files: inputformat = 'parquet'
+    # This requires pyarrow. Only the needed columns are read, and row groups
+    # with no galaxies passing the selection criteria below are skipped.
+# If your input files are GALFORM HDF5 outputs (one galaxies.hdf5 per ivol
+    # subvolume): inputformat = 'galform'
+    # Datasets are given by name and only the selected galaxies are read.
+    # If cols is None, the standard GALFORM datasets in eml_const are used,
+    # and with attmod = 'ratios' and no att_params, the attenuation
+    # coefficients are calculated from the GALFORM L_tot_*_ext/L_tot_* lines.
 inputformat = 'txt'
 
 
@@ -361,6 +375,81 @@ maxcuts = [None]
     # galaxies with more than 20 DM particles in the simulations.
 ####################################################
 
+####################################################
+### DRY RUN ###
+
+# If dry_run = True, no emission line is calculated. Instead, the number of
+    # galaxies in each input file and those passing the cuts are counted,
+    # and a short benchmark is run to estimate the memory and time needed
+    # per subvolume. The estimates are printed as a table and written in
+    # plan_file (by default, <outfile>_plan.json).
+
+dry_run = False
+####################################################
+
+####################################################
+### OUTPUT STORAGE ###
+
+# The output datasets are stored in chunks of, at most, chunk_size galaxies
+    # and can be compressed with compression = 'gzip' (portable, with
+    # compression_opts from 0 to 9) or 'lzf' (faster, only readable with h5py).
+    # shuffle = True usually improves the compression, and fletcher32 = True
+    # stores a checksum for each chunk.
+# If prealloc = True, the selected galaxies are counted before the
+    # calculation and the output datasets are created with their final size.
+# With line_layout = 'stacked', the emission lines are stored as one
+    # (ncomp, nlines, ngal) dataset per kind of line (nebline_sfr,
+    # nebline_sfr_att, nebline_sfr_flux, ...) instead of one dataset per line.
+    # eml_io.read_line(hf['data'], 'Halpha_sfr') reads a line in both layouts.
+# With precision = 'float32', U, ne, Z, masses, sSFR, lines and fluxes are
+    # stored in single precision. Lines and fluxes are stored in units of
+    # 1e40 erg/s and 1e-17 erg/s/cm^2 (the 'scale' attribute of the dataset),
+    # which eml_io.read_line converts back to erg/s.
+# With shards = True, each subvolume is written to its own file,
+    # <outfile>_shard<i>.hdf5, and outfile joins them with virtual datasets.
+    # The shard files must be kept in the same directory as outfile.
+# If write_queue > 0, the output is written by a background thread while
+    # the next subvolume is calculated, keeping at most write_queue subvolumes
+    # in memory waiting to be written.
+# Each completed subvolume is recorded in the output file. If a run stops,
+    # rerunning it with resume = True checks the completed subvolumes,
+    # removes any partially written one and continues from the next subvolume.
+# With agn_layout = 'sparse', the AGN quantities (lu_agn, Halpha_agn, ...)
+    # are only stored for the galaxies with Lagn > 0, whose positions are in
+    # the agn_index dataset. eml_io.read_sparse(hf['data'], 'lu_agn') expands
+    # them to all the galaxies.
+# With n_workers > 1, the subvolumes are calculated in parallel by
+    # n_workers processes. The output is written in the order of infile
+    # and it is the same as with n_workers = 1. The largest subvolumes are
+    # calculated first and, if much larger than the rest, split in row
+    # windows (of at most window_rows rows, if given).
+# With profile = True, the time, galaxies per second and bytes read and
+    # written by each stage are printed at the end and written in
+    # <outfile>_profile.json.
+# With n_threads > 1, the emission lines are interpolated by n_threads
+    # threads, each one with a block of galaxies. The number of threads is
+    # limited by the available CPUs and by OMP_NUM_THREADS (or any BLAS limit).
+# With a memory budget, e.g. max_memory = '16GB', the number of workers
+    # (up to n_workers, 0 for as many as CPUs) and the rows per window
+    # are chosen to keep the estimated peak memory within the budget.
+    # The plan and the observed peak are printed at the end.
+
+chunk_size = 32768
+compression = None
+prealloc = False
+line_layout = 'separate'
+precision = 'float64'
+shards = False
+write_queue = 0
+resume = False
+agn_layout = 'dense'
+n_workers = 1
+window_rows = None
+profile = False
+n_threads = 1
+max_memory = None
+####################################################
+
 eml.eml(infile, outfile, 
             m_sfr_z=cols, infile_z0=infile_z0, 
             cutcols=cutcols, mincuts=mincuts, maxcuts=maxcuts,
@@ -380,4 +469,11 @@ eml.eml(infile, outfile,
             attmod=attmod, unemod_sfr=unemod_sfr, 
             unemod_agn=unemod_agn, photmod_sfr=photmod_sfr,
             photmod_agn=photmod_agn,
-            verbose=True)
\ No newline at end of file
+            dry_run=dry_run,
+            chunk_size=chunk_size, compression=compression,
+            prealloc=prealloc, line_layout=line_layout,
+            precision=precision, shards=shards,
+            write_queue=write_queue, resume=resume,
+            agn_layout=agn_layout, n_workers=n_workers,
+            window_rows=window_rows, profile=profile,
+            n_threads=n_threads, max_memory=max_memory, verbose=True)
\ No newline at end of file
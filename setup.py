@@ -33,4 +33,15 @@ setup(
         # Note: Matplotlib is loaded for test plot
         "matplotlib>=3.3",
     ],
+    extras_require={
+        # Parquet input files
+        "parquet": ["pyarrow"],
+        # Configuration files of the command line interface
+        "cli": ["pyyaml"],
+    },
+    entry_points={
+        "console_scripts": [
+            "get-nebular-emission=get_nebular_emission.eml_cli:main",
+        ],
+    },
 )
@@ -0,0 +1,249 @@
+import os, sys, json, shutil
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath('..'))
+import get_nebular_emission.eml as eml
+
+
+def test_eml_arrays():
+    rng = np.random.default_rng(1)
+    ngal = 50
+    ms = 10**rng.uniform(8, 11, (ngal, 2))
+    sfr = 10**rng.uniform(-2, 1, (ngal, 2))
+    zgas = 10**rng.uniform(-3, -1.5, (ngal, 2))
+
+    results = eml.eml_arrays(ms, sfr, zgas, mtot2mdisk=False, flux=True, redshift=0.5)
+    nlines = len(results['lines_sfr'])
+    assert results['nebline_sfr'].shape == (2, nlines, ngal)
+    assert results['fluxes_sfr'].shape == (2, nlines, ngal)
+    assert (results['nebline_sfr'][0] > 0).all()
+
+    # Galaxies are independent from each other
+    half = eml.eml_arrays(ms[:10], sfr[:10], zgas[:10], mtot2mdisk=False, flux=True, redshift=0.5)
+    assert np.array_equal(half['nebline_sfr'], results['nebline_sfr'][...,:10])
+    assert np.array_equal(half['lu_sfr'], results['lu_sfr'][:,:10])
+
+    # Errors in the inputs are raised instead of stopping
+    with pytest.raises(ValueError):
+        eml.eml_arrays(ms, sfr, zgas[:10], mtot2mdisk=False)
+    with pytest.raises(ValueError):
+        eml.eml_arrays(ms[:,0], sfr[:,0], zgas[:,0], mtot2mdisk=True)
+    with pytest.raises(ValueError):
+        eml.eml_arrays(ms, sfr, zgas, mtot2mdisk=False, unemod_sfr='kashino19')
+    with pytest.raises(ValueError):
+        eml.eml_arrays(ms, sfr, zgas, mtot2mdisk=False, AGN=True)
+
+    # Same default model in the file and in-memory calculations
+    import inspect
+    for func in [eml.eml, eml.calculate_subvolume, eml.calculate_lines, eml.eml_arrays]:
+        assert inspect.signature(func).parameters['unemod_sfr'].default == eml.const.unemod_sfr
+
+
+def test_iter_eml(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    ngal = 25
+    data = np.column_stack((10**rng.uniform(8, 11, (ngal, 2)), 10**rng.uniform(-2, 1, (ngal, 2)),
+                            10**rng.uniform(-3, -1.5, (ngal, 2))))
+    infile = str(tmp_path / 'subvol.txt')
+    np.savetxt(infile, data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+    kwargs = {'inputformat': 'txt', 'mtot2mdisk': False, 'unemod_sfr': 'kashino20'}
+
+    whole = list(eml.iter_eml([infile], [[0,2,4],[1,3,5]], **kwargs))
+    assert len(whole) == 1 and whole[0]['window'] is None
+
+    # Each chunk parses only its own lines of the input file
+    loadtxt = np.loadtxt
+    parsed = []
+    def count_loadtxt(*args, **kw):
+        parsed.append(kw.get('max_rows'))
+        return loadtxt(*args, **kw)
+    monkeypatch.setattr(np, 'loadtxt', count_loadtxt)
+    batches = list(eml.iter_eml([infile], [[0,2,4],[1,3,5]], chunk_rows=10, **kwargs))
+    assert [batch['window'] for batch in batches] == [[0, 10], [10, 20], [20, 25]]
+    assert parsed and all(rows is not None and rows <= 10 for rows in parsed)
+
+    nebline = np.concatenate([batch['nebline_sfr'] for batch in batches], axis=-1)
+    assert np.array_equal(nebline, whole[0]['nebline_sfr'])
+
+
+def test_sweep(tmp_path, monkeypatch):
+    import h5py
+    rng = np.random.default_rng(2)
+    ngal = 20
+    data = np.column_stack((10**rng.uniform(8, 11, (ngal, 2)), 10**rng.uniform(-2, 1, (ngal, 2)),
+                            10**rng.uniform(-3, -1.5, (ngal, 2))))
+    infile = str(tmp_path / 'subvol.txt')
+    np.savetxt(infile, data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+
+    configs = [{'unemod_sfr': 'kashino20'}, {'unemod_sfr': 'orsi14', 'gamma': 1.5}]
+    sweepfiles = eml.sweep([infile], str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], configs,
+                           inputformat='txt', mtot2mdisk=False, verbose=False)
+
+    # Workers using the input data in shared memory
+    shutil.copy(sweepfiles[1], str(tmp_path / 'serial.hdf5'))
+    eml.sweep([infile], str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], configs, n_workers=2,
+              inputformat='txt', mtot2mdisk=False, verbose=False)
+    with h5py.File(sweepfiles[1], 'r') as hf, h5py.File(str(tmp_path / 'serial.hdf5'), 'r') as hs:
+        assert np.array_equal(hf['data/Halpha_sfr'][:], hs['data/Halpha_sfr'][:])
+    assert sweepfiles == [str(tmp_path / 'out_sweep0.hdf5'), str(tmp_path / 'out_sweep1.hdf5')]
+
+    # Serial where the workers cannot be forked
+    monkeypatch.setattr(eml, 'get_mp_context', lambda: None)
+    eml.sweep([infile], str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], configs, n_workers=2,
+              inputformat='txt', mtot2mdisk=False, verbose=False)
+    with h5py.File(sweepfiles[1], 'r') as hf, h5py.File(str(tmp_path / 'serial.hdf5'), 'r') as hs:
+        assert np.array_equal(hf['data/Halpha_sfr'][:], hs['data/Halpha_sfr'][:])
+
+    # Same results as calculating each configuration separately
+    for sweepfile, config in zip(sweepfiles, configs):
+        results = eml.eml_arrays(data[:,[0,1]], data[:,[2,3]], data[:,[4,5]],
+                                 mtot2mdisk=False, **config)
+        iline = results['lines_sfr'].index('Halpha')
+        with h5py.File(sweepfile, 'r') as hf:
+            assert hf['header'].attrs['HII model'] == config['unemod_sfr']
+            assert np.array_equal(hf['data/Halpha_sfr'][:], results['nebline_sfr'][:,iline])
+
+    # Configurations without a model use the default of eml
+    sweepfile = eml.sweep([infile], str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], [{'gamma': 1.5}],
+                          inputformat='txt', mtot2mdisk=False, verbose=False)[0]
+    with h5py.File(sweepfile, 'r') as hf:
+        assert hf['header'].attrs['HII model'] == eml.const.unemod_sfr
+
+
+def test_eml_max_memory(tmp_path):
+    import h5py
+    import get_nebular_emission.eml_plan as plan
+    from get_nebular_emission.eml_io import get_format_version
+    rng = np.random.default_rng(4)
+    ngal = 30
+    data = np.column_stack((10**rng.uniform(8, 11, (ngal, 2)), 10**rng.uniform(-2, 1, (ngal, 2)),
+                            10**rng.uniform(-3, -1.5, (ngal, 2))))
+    infile = str(tmp_path / 'subvol.txt')
+    np.savetxt(infile, data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+    options = {'inputformat': 'txt', 'unemod_sfr': 'kashino20', 'mtot2mdisk': False,
+               'verbose': False}
+    eml.eml([infile], str(tmp_path / 'full.hdf5'), [[0,2,4],[1,3,5]], **options)
+
+    # Budget for windows of 10 rows
+    nbytes_row = plan.get_nbytes_row(2, inputformat='txt')
+    nbytes_gal = plan.get_nbytes_gal(2)
+    max_memory = plan.get_task_memory(1, 10, nbytes_row, nbytes_gal)
+    outfile = str(tmp_path / 'out.hdf5')
+    eml.eml([infile], outfile, [[0,2,4],[1,3,5]], max_memory=max_memory, **options)
+
+    with h5py.File(outfile, 'r') as hf, h5py.File(str(tmp_path / 'full.hdf5'), 'r') as hs:
+        memory_plan = json.loads(hf['header'].attrs['Memory plan'])
+        assert memory_plan['window_rows'] == 10
+        assert memory_plan['peak_memory']['main'] > 0
+        assert get_format_version(hf) == eml.const.format_version
+        assert np.array_equal(hf['data/Halpha_sfr'][:], hs['data/Halpha_sfr'][:])
+
+
+def test_eml_task_order(tmp_path, monkeypatch):
+    import h5py
+    from concurrent.futures import Future
+    rng = np.random.default_rng(6)
+    infile = []
+    for nrows in [5, 5, 30]:
+        data = np.column_stack((10**rng.uniform(8, 11, (nrows, 2)), 10**rng.uniform(-2, 1, (nrows, 2)),
+                                10**rng.uniform(-3, -1.5, (nrows, 2))))
+        infile.append(str(tmp_path / 'ivol{}.txt'.format(len(infile))))
+        np.savetxt(infile[-1], data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+    options = {'inputformat': 'txt', 'mtot2mdisk': False, 'verbose': False}
+    eml.eml(infile, str(tmp_path / 'serial.hdf5'), [[0,2,4],[1,3,5]], **options)
+
+    # Tasks calculated in the main process, in the order of submission
+    submitted, shutdown = [], []
+    class Pool:
+        def __init__(self, max_workers=None, mp_context=None):
+            pass
+        def submit(self, func, i, *args, **kwargs):
+            submitted.append((i, kwargs['window']))
+            future = Future()
+            if i in failed:
+                future.set_exception(RuntimeError('worker failed'))
+            else:
+                future.set_result(func(i, *args, **kwargs))
+            return future
+        def shutdown(self, cancel_futures=False):
+            shutdown.append(cancel_futures)
+    failed = []
+    monkeypatch.setattr(eml, 'ProcessPoolExecutor', Pool)
+    monkeypatch.setattr(eml, 'get_mp_context', lambda: 'fork')
+
+    # The next task to be written goes first, then the largest ones
+    eml.eml(infile, str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], n_workers=2,
+            window_rows=10, **options)
+    assert submitted == [(0, None), (2, [0, 10]), (2, [10, 20]), (2, [20, 30]), (1, None)]
+
+    # Within a memory budget, only n_workers tasks ahead of the one being written
+    memory_plan = {'max_memory': 1e9, 'n_workers': 2, 'window_rows': 10, 'max_rows': 30,
+                   'bytes_per_row': 1, 'bytes_per_galaxy': 1, 'memory': 1e8}
+    monkeypatch.setattr(eml, 'get_memory_plan', lambda *args, **kwargs: dict(memory_plan))
+    del submitted[:]
+    eml.eml(infile, str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], max_memory=1e9, **options)
+    assert submitted == [(0, None), (2, [0, 10]), (1, None), (2, [10, 20]), (2, [20, 30])]
+
+    with h5py.File(str(tmp_path / 'out.hdf5'), 'r') as hf, \
+         h5py.File(str(tmp_path / 'serial.hdf5'), 'r') as hs:
+        assert np.array_equal(hf['data/Halpha_sfr'][:], hs['data/Halpha_sfr'][:])
+
+    # After a failed task, the pending tasks are cancelled and the output closed
+    failed.append(1)
+    del shutdown[:]
+    with pytest.raises(RuntimeError):
+        eml.eml(infile, str(tmp_path / 'out.hdf5'), [[0,2,4],[1,3,5]], n_workers=2,
+                write_queue=2, **options)
+    assert shutdown == [True]
+    with h5py.File(str(tmp_path / 'out.hdf5'), 'a') as hf:
+        assert hf['data/Halpha_sfr'].shape[1] == 5
+
+
+def test_eml_profile_windows(tmp_path):
+    rng = np.random.default_rng(7)
+    ngal = 25
+    data = np.column_stack((10**rng.uniform(8, 11, (ngal, 2)), 10**rng.uniform(-2, 1, (ngal, 2)),
+                            10**rng.uniform(-3, -1.5, (ngal, 2))))
+    infile = str(tmp_path / 'subvol.txt')
+    np.savetxt(infile, data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+    outfile = str(tmp_path / 'out.hdf5')
+    eml.eml([infile], outfile, [[0,2,4],[1,3,5]], inputformat='txt', mtot2mdisk=False,
+            verbose=False, n_workers=2, window_rows=10, profile=True)
+
+    # Each window is charged its share of the subvolume
+    with open(str(tmp_path / 'out_profile.json'), 'r') as ff:
+        record = json.load(ff)['stages']['get_data']
+    assert record['calls'] == 3 and record['rows_in'] == ngal
+    assert os.path.getsize(infile) - 3 <= record['bytes_read'] <= os.path.getsize(infile)
+
+
+def test_eml_prealloc_resume(tmp_path):
+    import h5py
+    from get_nebular_emission.eml_io import get_checkpoint, get_resume
+    rng = np.random.default_rng(5)
+    infile = []
+    for i in range(2):
+        data = np.column_stack((10**rng.uniform(8, 11, (30, 2)), 10**rng.uniform(-2, 1, (30, 2)),
+                                10**rng.uniform(-3, -1.5, (30, 2))))
+        infile.append(str(tmp_path / 'ivol{}.txt'.format(i)))
+        np.savetxt(infile[-1], data, header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+    options = {'inputformat': 'txt', 'unemod_sfr': 'kashino20', 'mtot2mdisk': False,
+               'verbose': False, 'prealloc': True, 'n_workers': 2, 'window_rows': 10}
+    outfile = str(tmp_path / 'out.hdf5')
+    eml.eml(infile, outfile, [[0,2,4],[1,3,5]], **options)
+
+    # Offsets of the subvolumes, not of their last windows
+    assert get_checkpoint(outfile)['offset'] == [0, 30]
+    assert get_resume(outfile, infile) == (2, 60)
+    with h5py.File(outfile, 'r') as hf:
+        full = hf['data/Halpha_sfr'][:]
+
+    # Interrupted after the first subvolume, with the second partially written
+    with h5py.File(outfile, 'a') as hf:
+        for key in hf['checkpoint'].attrs:
+            hf['checkpoint'].attrs[key] = hf['checkpoint'].attrs[key][:1]
+        hf['data/Halpha_sfr'][:, 30:] = 0.
+    eml.eml(infile, outfile, [[0,2,4],[1,3,5]], resume=True, **options)
+    assert get_checkpoint(outfile)['offset'] == [0, 30]
+    with h5py.File(outfile, 'r') as hf:
+        assert np.array_equal(hf['data/Halpha_sfr'][:], full)
@@ -0,0 +1,58 @@
+import os, sys, json
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath('..'))
+import get_nebular_emission.eml_cli as cli
+
+
+def test_expand_infiles(tmp_path):
+    for i in [1, 0, 2]:
+        (tmp_path / 'ivol{}.txt'.format(i)).write_text('1 2 3\n')
+    infile = cli.expand_infiles(str(tmp_path / 'ivol*.txt'))
+    assert infile == [str(tmp_path / 'ivol{}.txt'.format(i)) for i in range(3)]
+    # Patterns kept in order, without repeating files
+    infile = cli.expand_infiles([str(tmp_path / 'ivol2.txt'), str(tmp_path / 'ivol*.txt')])
+    assert infile[0].endswith('ivol2.txt') and len(infile) == 3
+    with pytest.raises(SystemExit):
+        cli.expand_infiles(str(tmp_path / 'none*.txt'))
+
+
+def test_run(tmp_path):
+    pytest.importorskip('yaml')
+    import h5py
+    rng = np.random.default_rng(3)
+    for i in range(2):
+        data = np.column_stack((10**rng.uniform(8, 11, (10, 2)), 10**rng.uniform(-2, 1, (10, 2)),
+                                10**rng.uniform(-3, -1.5, (10, 2))))
+        np.savetxt(str(tmp_path / 'ivol{}.txt'.format(i)), data,
+                   header='Mdisk Mbulge SFRdisk SFRbulge Zdisk Zbulge')
+
+    outfile = str(tmp_path / 'out.hdf5')
+    config = str(tmp_path / 'config.yaml')
+    with open(config, 'w') as ff:
+        ff.write('infile: {}\n'.format(str(tmp_path / 'ivol*.txt')))
+        ff.write('outfile: {}\n'.format(outfile))
+        ff.write('m_sfr_z: [[0, 2, 4], [1, 3, 5]]\n')
+        ff.write('inputformat: txt\nunemod_sfr: kashino20\nmtot2mdisk: false\nverbose: false\n')
+
+    assert cli.main(['run', config, '--profile']) == 0
+    with open(cli.get_manifest_name(outfile), 'r') as ff:
+        manifest = json.load(ff)
+    assert manifest['status'] == 'completed'
+    assert manifest['options']['profile'] is True
+    assert [sub['ngal'] for sub in manifest['subvolumes']] == [10, 10]
+    assert all(sub['wall'] > 0 for sub in manifest['subvolumes'])
+    with h5py.File(outfile, 'r') as hf:
+        assert hf['data/lms'].shape == (2, 20)
+
+    # Failed runs exit with a non-zero status
+    failed = str(tmp_path / 'failed.yaml')
+    with open(config, 'r') as ff, open(failed, 'w') as fw:
+        fw.write(ff.read().replace('inputformat: txt', 'inputformat: hdf5'))
+    assert cli.main(['run', failed]) == 1
+    with open(cli.get_manifest_name(outfile), 'r') as ff:
+        assert json.load(ff)['status'] == 'failed'
+
+    with open(config, 'a') as ff:
+        ff.write('unknown_option: 1\n')
+    assert cli.main(['run', config]) == 1
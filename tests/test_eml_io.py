@@ -1,6 +1,9 @@
 import os, sys
+import numpy as np
+import pytest
 sys.path.insert(0, os.path.abspath('..'))
 import get_nebular_emission.eml_io as eml
+import get_nebular_emission.eml_const as const
 
 exdir = 'example_data/'
 exfile = exdir+'example_data.dat'
@@ -21,3 +24,361 @@ def test_get_ncomponents():
     assert eml.get_ncomponents([0,1,2]) == 1
     assert eml.get_ncomponents([[0,1,2]]) == 1
     assert eml.get_ncomponents([[0,1,2],[3,4,5]]) == 2
+
+
+def test_get_npy_column(tmp_path):
+    vals = np.arange(10.)
+
+    npydir = tmp_path / 'subvol'
+    npydir.mkdir()
+    np.save(npydir / 'mstars.npy', vals)
+    col = eml.get_npy_column(str(npydir), 'mstars')
+    assert isinstance(col, np.memmap)
+    assert np.array_equal(col, vals)
+
+    np.savez(tmp_path / 'subvol.npz', mstars=vals)
+    col = eml.get_npy_column(str(tmp_path / 'subvol.npz'), 'mstars')
+    assert isinstance(col, np.memmap)
+    assert np.array_equal(col, vals)
+
+    np.savez_compressed(tmp_path / 'subvol_c.npz', mstars=vals)
+    col = eml.get_npy_column(str(tmp_path / 'subvol_c.npz'), 'mstars')
+    assert np.array_equal(col, vals)
+
+    # A missing subvolume stops, also without messages
+    with pytest.raises(SystemExit):
+        eml.read_data(str(tmp_path / 'missing.npz'), [['mstars', 'mstars', 'mstars']],
+                      inputformat='npy', verbose=False)
+
+
+def test_get_parquet_rowgroups(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    mhalo = np.arange(100.)
+    pq.write_table(pa.table({'mhalo': mhalo}), tmp_path / 'subvol.parquet',
+                   row_group_size=10)
+    pf = eml.get_parquet_file(str(tmp_path / 'subvol.parquet'))
+
+    rowgroups, rowstart = eml.get_parquet_rowgroups(pf, cutcols=['mhalo'],
+                                                    mincuts=[45.], maxcuts=[72.])
+    assert rowgroups == [4, 5, 6, 7]
+    assert rowstart[5] == 50
+
+    data, rows = eml.read_parquet(pf, ['mhalo'], rowgroups, rowstart)
+    assert np.array_equal(data['mhalo'], mhalo[40:80])
+    assert np.array_equal(rows, np.arange(40, 80))
+
+    # Row groups overlapping a window of rows
+    rowgroups = eml.get_parquet_rowgroups(pf, cutcols=['mhalo'], mincuts=[45.],
+                                          maxcuts=[72.], limit=65, start=55)[0]
+    assert rowgroups == [5, 6]
+
+    # A cut column missing from the file
+    with pytest.raises(SystemExit):
+        eml.get_parquet_rowgroups(pf, cutcols=['mgas'], mincuts=[45.], maxcuts=[None])
+
+    # Rows of a file with a different row group layout
+    pq.write_table(pa.table({'mhalo': mhalo}), tmp_path / 'subvol_z0.parquet',
+                   row_group_size=7)
+    rows = np.array([3, 41, 42, 77])
+    pf_z0 = eml.get_parquet_file(str(tmp_path / 'subvol_z0.parquet'))
+    assert np.array_equal(eml.read_parquet_rows(pf_z0, ['mhalo'], rows)['mhalo'], mhalo[rows])
+
+
+def test_read_hdf5_rows(tmp_path):
+    import h5py
+    vals = np.arange(100.)
+    with h5py.File(tmp_path / 'galaxies.hdf5', 'w') as hf:
+        hf.create_dataset('mstars_total', data=vals)
+
+    rows = np.array([3, 4, 5, 10, 11, 50, 99])
+    with h5py.File(tmp_path / 'galaxies.hdf5', 'r') as hf:
+        assert np.array_equal(eml.read_hdf5_rows(hf['mstars_total'], rows), vals[rows])
+        assert np.array_equal(eml.read_hdf5_rows(hf['mstars_total'], rows, maxslabs=2), vals[rows])
+        assert len(eml.read_hdf5_rows(hf['mstars_total'], [])) == 0
+
+
+def test_read_data_window(tmp_path):
+    import h5py
+    ngal = 30
+    vals = np.array([np.arange(ngal)+1., np.arange(ngal)+2.,
+                     np.arange(ngal)+3., np.arange(ngal)%3.])
+    names = ['mstars', 'sfr', 'z', 'mhalo']
+
+    infiles = {'txt': str(tmp_path / 'subvol.txt'),
+               'hdf5': str(tmp_path / 'subvol.hdf5'),
+               'npy': str(tmp_path / 'subvol.npz')}
+    np.savetxt(infiles['txt'], vals.T, header='mstars sfr z mhalo')
+    with h5py.File(infiles['hdf5'], 'w') as hf:
+        for k in range(len(names)):
+            hf.create_dataset('data/'+names[k], data=vals[k])
+    np.savez(infiles['npy'], **{names[k]: vals[k] for k in range(len(names))})
+    cols = {'txt': [[0, 1, 2]], 'hdf5': [names[:3]], 'npy': [names[:3]]}
+    cutcols = {'txt': [3], 'hdf5': ['mhalo'], 'npy': ['mhalo']}
+
+    sel = np.where(vals[3] > 0.5)[0]
+    for fmt in infiles:
+        for window in [[0, 7], [7, 19], [19, ngal]]:
+            lms, lssfr, loh12, cut = eml.read_data(infiles[fmt], cols[fmt], cutcols=cutcols[fmt],
+                                                   mincuts=[0.5], maxcuts=[None],
+                                                   inputformat=fmt, window=window)
+            rows = sel[(sel >= window[0]) & (sel < window[1])]
+            assert np.array_equal(cut, rows)
+            assert np.array_equal(lms[:,0], vals[0][rows])
+            assert np.array_equal(loh12[:,0], vals[2][rows])
+
+    # Only the rows from the first to the last selected are parsed
+    assert np.array_equal(eml.read_txt_rows(infiles['txt'], [0, 3], sel[2:5], skip=1),
+                          vals[[0, 3]][:, sel[2:5]].T)
+    assert np.array_equal(eml.read_txt_rows(infiles['txt'], [1], sel[-1:], skip=1),
+                          vals[1][sel[-1:]])
+    assert eml.read_txt_rows(infiles['txt'], [0, 3], [], skip=1).shape == (0, 2)
+
+
+def test_get_nheader_cached(tmp_path):
+    infile = tmp_path / 'subvol.txt'
+    infile.write_text('# header\n\n# Mstars SFR Z\n-1.5 2 3\n4 5 6\n')
+    assert eml.get_nheader(str(infile)) == 3
+    # Lines split across blocks, scanned again without the cached value
+    eml._nheader_cache.clear()
+    assert eml.get_nheader(str(infile), blocksize=4) == 3
+    assert eml.get_nheader(str(infile), firstchar='#') == 3
+
+    # A modified file is scanned again
+    infile.write_text('1 2 3\n')
+    os.utime(infile, ns=(0, 10**9))
+    assert eml.get_nheader(str(infile)) == 0
+
+
+def test_writer(tmp_path):
+    import h5py
+    outfile = str(tmp_path / 'out.hdf5')
+    with eml.Writer(outfile) as writer:
+        writer.write_header({'HII model': 'kashino20'})
+        for ngal in [3, 2]:
+            writer.write('lms', np.ones((ngal, 2)), label='log10(M*) (Msun)')
+            writer.write('Halpha_sfr', np.ones((2, ngal)), axis=1)
+
+    with h5py.File(outfile, 'r') as hf:
+        assert hf['header'].attrs['HII model'] == 'kashino20'
+        assert hf['data/lms'].shape == (5, 2)
+        assert hf['data/Halpha_sfr'].shape == (2, 5)
+        # Chunks not limited by the size of the first subvolume
+        assert hf['data/lms'].chunks == (const.chunk_size, 2)
+
+
+def test_writer_prealloc(tmp_path):
+    import h5py
+    outfile = str(tmp_path / 'out.hdf5')
+    with eml.Writer(outfile) as writer:
+        writer.prealloc(5)
+        # Subvolumes written out of order at their positions
+        for offset, ngal in [(3, 2), (0, 3)]:
+            writer.offset = offset
+            writer.write('lms', np.full((ngal, 2), ngal))
+            writer.write('Halpha_sfr', np.full((2, ngal), ngal), axis=1)
+
+    with h5py.File(outfile, 'r') as hf:
+        assert np.array_equal(hf['data/lms'][:,0], [3, 3, 3, 2, 2])
+        assert np.array_equal(hf['data/Halpha_sfr'][1], [3, 3, 3, 2, 2])
+
+
+def get_test_results(ngal, ncomp=2, flux=0., att=const.notnum):
+    nlines = len(const.lines_model['gutkin16'])
+    props = np.ones((ngal, ncomp))
+    nebline = np.arange(ncomp*nlines*ngal, dtype=float).reshape((ncomp, nlines, ngal))
+    return eml.get_results(props, props, props, props, props, nebline,
+                           nebline_sfr_att=np.full(nebline.shape, att),
+                           fluxes_sfr=np.full(nebline.shape, flux),
+                           fluxes_sfr_att=np.array(None))
+
+
+def test_write_results(tmp_path):
+    import h5py
+    outfile = str(tmp_path / 'out.hdf5')
+    schema = eml.get_schema(photmod_sfr='gutkin16')
+    with eml.Writer(outfile) as writer:
+        # Fluxes calculated, but all zero in the second subvolume
+        for ngal, first, flux in [(4, True, 1.), (3, False, 0.)]:
+            eml.write_results(writer, get_test_results(ngal, flux=flux), schema, first=first)
+
+    with h5py.File(outfile, 'r') as hf:
+        # Galaxies along the last axis
+        assert hf['data/lms'].shape == (2, 7)
+        assert hf['data/Halpha_sfr'].shape == (2, 7)
+        assert np.array_equal(hf['data/Halpha_sfr_flux'][0], [1, 1, 1, 1, 0, 0, 0])
+        # Neither unattenuated lines nor quantities not calculated are written
+        assert 'Halpha_sfr_att' not in hf['data']
+        assert 'Halpha_sfr_flux_att' not in hf['data']
+
+    # Attenuated lines written whatever the value for the first galaxy
+    results = get_test_results(4, att=1.)
+    results['nebline_sfr_att'][0,:,0] = -1.
+    with eml.Writer(outfile) as writer:
+        eml.write_results(writer, results, schema)
+    with h5py.File(outfile, 'r') as hf:
+        assert hf['data/Halpha_sfr_att'].shape == (2, 4)
+
+
+def test_read_line_stacked(tmp_path):
+    import h5py
+    outfile = str(tmp_path / 'out.hdf5')
+    results = get_test_results(4)
+    schema = eml.get_schema(photmod_sfr='gutkin16', line_layout='stacked')
+    with eml.Writer(outfile) as writer:
+        eml.write_results(writer, results, schema)
+
+    iline = list(const.lines_model['gutkin16']).index('Halpha')
+    with h5py.File(outfile, 'r') as hf:
+        assert hf['data/nebline_sfr'].shape == results['nebline_sfr'].shape
+        assert np.array_equal(eml.read_line(hf['data'], 'Halpha_sfr'),
+                              results['nebline_sfr'][:,iline])
+
+
+def test_get_precision():
+    dtypes = eml.get_precision('float32')
+    assert dtypes['props'] == 'float32' and dtypes['fluxes'] == 'float32'
+    assert dtypes['lines'] == 'float32' and dtypes['extra'] == 'float64'
+    with pytest.raises(SystemExit):
+        eml.get_precision({'lines': 'float16'})
+
+
+def test_writer_float32(tmp_path):
+    import h5py
+    outfile = str(tmp_path / 'out.hdf5')
+    lines = np.array([[3.2e42, 1.5e39, 0.], [7.1e41, eml.const.notnum, 2.e40]])
+    with eml.Writer(outfile, precision='float32') as writer:
+        writer.write('Halpha_sfr', lines, axis=1, group='lines')
+    # Appended in the units of the existing dataset
+    with eml.Writer(outfile, mode='a', precision='float64') as writer:
+        writer.write('Halpha_sfr', lines, axis=1, group='lines')
+
+    with h5py.File(outfile, 'r') as hf:
+        assert hf['data/Halpha_sfr'].dtype == np.float32
+        assert hf['data/Halpha_sfr'].attrs['scale'] == eml.const.float32_scales['lines']
+        values = eml.read_line(hf['data'], 'Halpha_sfr')
+    assert np.allclose(values, np.tile(lines, 2), rtol=1e-6)
+    assert values[1,1] == eml.const.notnum
+
+
+def test_stitch_shards(tmp_path):
+    import h5py
+    shardfiles = [eml.get_shard_name(str(tmp_path / 'out.hdf5'), i) for i in range(2)]
+    for shardfile, ngal in zip(shardfiles, [3, 2]):
+        with eml.Writer(shardfile) as writer:
+            writer.write_header({'HII model': 'kashino20'})
+            writer.write('lms', np.full((ngal, 2), ngal))
+            writer.write('Halpha_sfr', np.full((2, ngal), ngal), axis=1)
+
+    eml.stitch_shards(str(tmp_path / 'out.hdf5'), shardfiles, verbose=False)
+    with h5py.File(tmp_path / 'out.hdf5', 'r') as hf:
+        assert hf['data/lms'].is_virtual
+        assert np.array_equal(hf['data/lms'][:,0], [3, 3, 3, 2, 2])
+        assert np.array_equal(hf['data/Halpha_sfr'][1], [3, 3, 3, 2, 2])
+
+
+def test_writer_thread():
+    written = []
+    writer_thread = eml.WriterThread(maxsize=1)
+    for i in range(3):
+        writer_thread.submit(written.append, i)
+    writer_thread.close()
+    assert written == [0, 1, 2]
+
+    # Errors in the writer are raised in the calling thread
+    writer_thread = eml.WriterThread(maxsize=1)
+    writer_thread.submit(np.zeros(2).__setitem__, 5, 1.)
+    with pytest.raises(IndexError):
+        writer_thread.close()
+
+    # Closing again, or discarding after an error elsewhere, does not raise
+    writer_thread.close(discard=True)
+    writer_thread = eml.WriterThread(maxsize=1)
+    writer_thread.submit(np.zeros(2).__setitem__, 5, 1.)
+    writer_thread.close(discard=True)
+    writer_thread.close(discard=True)
+
+
+def test_checkpoint(tmp_path):
+    outfile = str(tmp_path / 'out.hdf5')
+    infiles = ['ivol0.hdf5', 'ivol1.hdf5', 'ivol2.hdf5']
+    schema = eml.get_schema(photmod_sfr='gutkin16')
+    with eml.Writer(outfile) as writer:
+        writer.write_header({'Line layout': 'separate'})
+        for i, ngal in enumerate([4, 3]):
+            eml.write_results(writer, get_test_results(ngal), schema, first=(i==0))
+            writer.checkpoint(i, infiles[i], ngal)
+        # Subvolume interrupted before its checkpoint
+        eml.write_results(writer, get_test_results(5), schema, first=False)
+
+    records = eml.get_checkpoint(outfile)
+    assert records['offset'] == [0, 4] and records['ngal'] == [4, 3]
+    assert eml.get_resume(outfile, infiles) == (2, 7)
+    with pytest.raises(SystemExit):
+        eml.get_resume(outfile, infiles[::-1])
+
+    with eml.Writer(outfile, mode='a') as writer:
+        writer.truncate(7)
+        assert writer.hfdat['lms'].shape == (2, 7)
+
+
+def test_read_sparse(tmp_path):
+    outfile = str(tmp_path / 'out.hdf5')
+    nlines = len(const.lines_model['feltre16'])
+    schema = eml.get_schema(AGN=True, agn_layout='sparse')
+    with eml.Writer(outfile) as writer:
+        for i, Lagn in enumerate([np.array([0., 1e44, 0.]), np.array([2e44, 0.])]):
+            ngal = len(Lagn)
+            props = np.ones((ngal, 2))
+            nebline = np.ones((2, nlines, ngal))
+            results = eml.get_results(props, props, props, props, props, nebline,
+                                      lu_agn=props, lne_agn=props, loh12_agn=props,
+                                      epsilon_agn=np.ones(ngal), nebline_agn=nebline*Lagn,
+                                      Lagn=Lagn)
+            eml.write_results(writer, results, schema, first=(i==0))
+
+    import h5py
+    with h5py.File(outfile, 'r') as hf:
+        assert np.array_equal(hf['data/agn_index'][:], [1, 3])
+        assert hf['data/Halpha_agn'].shape == (1, 2)
+        assert np.array_equal(eml.read_line(hf['data'], 'Halpha_agn')[0], [0, 1e44, 0, 2e44, 0])
+        assert np.array_equal(eml.read_sparse(hf['data'], 'lu_agn')[1],
+                              [const.notnum, 1, const.notnum, 1, const.notnum])
+
+
+def test_share_arrays():
+    values = [{'lms': np.arange(6.).reshape((3, 2)), 'Lagn_param': [[None]]}]
+    shared = eml.share_arrays(values)
+    assert isinstance(shared[0]['lms'], eml.SharedArray)
+    assert shared[0]['Lagn_param'] == [[None]]
+
+    views = eml.view_arrays(shared)
+    assert np.array_equal(views[0]['lms'], values[0]['lms'])
+    # Views of the same block
+    views[0]['lms'][0, 0] = -1.
+    assert eml.view_arrays(shared)[0]['lms'][0, 0] == -1.
+
+    del views
+    eml.close_arrays(shared, unlink=True)
+
+
+def test_get_nthreads(monkeypatch):
+    for name in const.thread_limits:
+        monkeypatch.delenv(name, raising=False)
+    ncpu = eml.get_nthreads(0)
+    assert ncpu >= 1
+    assert eml.get_nthreads(ncpu + 10) == ncpu
+    # Limits set for OpenMP or BLAS are respected
+    monkeypatch.setenv('OMP_NUM_THREADS', '1')
+    assert eml.get_nthreads(4) == 1
+
+
+def test_get_mp_context(monkeypatch):
+    monkeypatch.setattr(sys, 'platform', 'linux')
+    monkeypatch.setattr(eml.multiprocessing, 'get_all_start_methods', lambda: ['spawn'])
+    assert eml.get_mp_context() is None
+    monkeypatch.setattr(eml.multiprocessing, 'get_all_start_methods', lambda: ['fork', 'spawn'])
+    assert eml.get_mp_context().get_start_method() == 'fork'
+    monkeypatch.setattr(sys, 'platform', 'darwin')
+    assert eml.get_mp_context() is None
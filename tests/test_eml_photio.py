@@ -0,0 +1,43 @@
+import os, sys
+import numpy as np
+sys.path.insert(0, os.path.abspath('..'))
+import get_nebular_emission.eml_photio as photio
+from get_nebular_emission.eml_io import locate_interval
+import get_nebular_emission.eml_const as const
+
+
+def test_get_interval():
+    edges = [-4., -3.5, -3., -2.5, -2., -1.5, -1.]
+    vals = np.array([-999., -4.5, -4., -3.7, -3.5, -2.2, -1., -0.5])
+    ind, d = photio.get_interval(vals, edges, minval=-5.)
+    for val, i, di in zip(vals, ind, d):
+        i1 = locate_interval(val, edges)
+        if val < -5.:
+            assert i == 0 and di == 0.
+        elif i1 == len(edges) - 1:
+            assert i == len(edges) - 2 and di == 1.
+        else:
+            assert i == i1
+            assert di == (val - edges[i1])/(edges[i1 + 1] - edges[i1])
+
+
+def test_get_limits_cached():
+    limits = photio.get_limits(propname='Z', photmod='gutkin16')
+    assert ('gutkin16', 'Z') in photio._limits_cache
+    assert photio.get_limits(propname='Z', photmod='gutkin16') == limits
+
+
+def test_get_lines_threads():
+    rng = np.random.default_rng(0)
+    ngal = 3*const.thread_block
+    lu = rng.uniform(-4.5, -0.5, (ngal, 2))
+    lne = rng.uniform(0.5, 4.5, (ngal, 2))
+    loh12 = rng.uniform(-4.2, -1.3, (ngal, 2))
+    lu[::7,1] = const.notnum
+
+    # 3 blocks for the first component, 2 for the second one with fewer galaxies
+    assert len(photio.get_blocks(lu, n_threads=4)) == 5
+    # Same result interpolating blocks of galaxies in threads
+    for get_lines in [photio.get_lines_Gutkin, photio.get_lines_Feltre]:
+        nebline = get_lines(lu, lne, loh12)
+        assert np.array_equal(get_lines(lu, lne, loh12, n_threads=4), nebline)
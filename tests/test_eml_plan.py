@@ -0,0 +1,100 @@
+import os, sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath('..'))
+import get_nebular_emission.eml_plan as plan
+
+
+def test_count_selected(tmp_path):
+    infile = tmp_path / 'subvol.txt'
+    infile.write_text('# Mstars SFR Z Mhalo\n' +
+                      ''.join(['1 2 3 {}\n'.format(i) for i in range(100)]) + '\n  \n')
+    # Blank lines are not counted as rows
+    nrows = plan.count_rows(str(infile), 0, inputformat='txt')
+    assert nrows == 100
+    assert plan.count_lines(str(infile), skip=1, blocksize=5) == 100
+
+    assert plan.count_selected(str(infile), nrows, inputformat='txt') == (100, False)
+    assert plan.count_selected(str(infile), nrows, inputformat='txt', cutcols=[3],
+                               mincuts=[9.5], maxcuts=[None]) == (90, False)
+    nsel, sampled = plan.count_selected(str(infile), nrows, inputformat='txt', cutcols=[3],
+                                        mincuts=[None], maxcuts=[50], nsample=40)
+    # Sampled over the whole file, which is sorted by the cut parameter
+    assert sampled and nsel == 50
+
+
+def test_get_read_size(tmp_path):
+    import h5py
+    infile = str(tmp_path / 'subvol.hdf5')
+    with h5py.File(infile, 'w') as hf:
+        for name in ['mstars', 'sfr', 'z', 'mhalo']:
+            hf.create_dataset('data/' + name, data=np.zeros(100))
+    # Only the columns read, once each
+    assert plan.get_read_size(infile, ['mstars', 'sfr', 'z', 'mstars', None],
+                              inputformat='hdf5') == (100, 3*800)
+
+    infile = str(tmp_path / 'subvol.txt')
+    with open(infile, 'w') as ff:
+        ff.write('# Mstars SFR Z\n' + '1 2 3\n'*20)
+    assert plan.get_read_size(infile, [0, 1, 2], inputformat='txt') == (20, os.path.getsize(infile))
+
+
+def test_get_nbytes_gal():
+    nbytes = plan.get_nbytes_gal(1)
+    assert plan.get_nbytes_gal(2) > nbytes
+    assert plan.get_nbytes_gal(1, att=True, flux=True, AGN=True) > nbytes
+
+    # Blocks of different components interpolated by parallel threads
+    nbytes = plan.get_nbytes_gal(2)
+    assert plan.get_nbytes_gal(2, n_threads=2) > nbytes
+    assert plan.get_nbytes_gal(2, n_threads=8) == plan.get_nbytes_gal(2, n_threads=2)
+
+
+def test_get_tasks(tmp_path):
+    infile = []
+    for nrows in [10, 100, 20]:
+        infile.append(str(tmp_path / 'subvol{}.txt'.format(nrows)))
+        with open(infile[-1], 'w') as ff:
+            ff.write('# Mstars SFR Z\n' + '1 2 3\n'*nrows)
+
+    # Largest first, with the largest split in row windows
+    windows, order = plan.get_tasks([0, 1, 2], infile, 0, 2, inputformat='txt')
+    assert windows[0] == [None] and windows[2] == [None]
+    assert windows[1] == [[0, 50], [50, 100]]
+    assert order == [(1, 0), (1, 1), (2, 0), (0, 0)]
+
+    windows, order = plan.get_tasks([2], infile, 0, 2, inputformat='txt', window_rows=8)
+    assert windows[2] == [[0, 6], [6, 13], [13, 20]]
+
+
+def test_parse_memory():
+    assert plan.parse_memory('16GB') == 16e9
+    assert plan.parse_memory('512 MiB') == 512*2**20
+    assert plan.parse_memory(1e9) == 1e9
+    with pytest.raises(SystemExit):
+        plan.parse_memory('16 apples')
+
+
+def test_get_memory_plan(tmp_path):
+    infile = []
+    for nrows in [100, 300]:
+        infile.append(str(tmp_path / 'subvol{}.txt'.format(nrows)))
+        with open(infile[-1], 'w') as ff:
+            ff.write('# Mstars SFR Z\n' + '1 2 3\n'*nrows)
+
+    memory_plan = plan.get_memory_plan([0, 1], infile, [[0, 1, 2]], '16GB',
+                                       inputformat='txt', verbose=False)
+    assert memory_plan['n_workers'] == 1 and memory_plan['window_rows'] is None
+    assert memory_plan['max_rows'] == 300
+
+    # Windows for the largest subvolume within the budget
+    nbytes_gal = memory_plan['bytes_per_galaxy']
+    budget = plan.get_task_memory(1, 120, memory_plan['bytes_per_row'], nbytes_gal)
+    memory_plan = plan.get_memory_plan([0, 1], infile, [[0, 1, 2]], budget + 0.5*nbytes_gal,
+                                       inputformat='txt', verbose=False)
+    assert memory_plan['window_rows'] == 120
+    assert memory_plan['memory'] <= budget + 0.5*nbytes_gal
+
+    with pytest.raises(SystemExit):
+        plan.get_memory_plan([0, 1], infile, [[0, 1, 2]], '100MB',
+                             inputformat='txt', verbose=False)
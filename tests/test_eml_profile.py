@@ -0,0 +1,32 @@
+import os, sys
+import json
+import numpy as np
+sys.path.insert(0, os.path.abspath('..'))
+import get_nebular_emission.eml_profile as prof
+
+
+def test_profile(tmp_path):
+    profile = prof.Profile()
+    for ngal in [10, 30]:
+        with prof.stage(profile, 'get_data', rows_in=2*ngal, bytes_read=100) as counts:
+            counts['rows_out'] = ngal
+        with prof.stage(profile, 'write', rows_in=ngal,
+                        bytes_written=prof.get_nbytes({'lms': np.zeros(ngal), 'x': None})):
+            pass
+        profile.add_subvolume('subvol.txt', ngal, 1.)
+
+    # Stages from another process are added up
+    worker = prof.Profile()
+    worker.add('get_data', 1., 0.5, rows_in=5, rows_out=5)
+    profile.merge(worker)
+
+    report = profile.get_report()
+    assert report['ngal'] == 40
+    assert report['stages']['get_data']['calls'] == 3
+    assert report['stages']['get_data']['rows_in'] == 85
+    assert report['stages']['get_data']['rows_out'] == 45
+    assert report['stages']['write']['bytes_written'] == 40*8
+
+    profile.write_report(str(tmp_path / 'profile.json'))
+    with open(tmp_path / 'profile.json') as ff:
+        assert json.load(ff)['stages']['write']['calls'] == 2